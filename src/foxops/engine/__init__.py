@@ -12,7 +12,13 @@ from foxops.engine.models import load_incarnation_state  # noqa
 from foxops.engine.models import load_incarnation_state_from_string  # noqa
 from foxops.engine.models import save_incarnation_state  # noqa
 from foxops.engine.patching.git_diff_patch import diff_and_patch  # noqa
+from foxops.engine.patching.git_index_diff import index_diff_and_patch  # noqa
+from foxops.engine.patching.inprocess_patch import inprocess_diff_and_patch  # noqa
+from foxops.engine.patching.tree_diff import tree_diff_and_patch  # noqa
+from foxops.engine.profiling import log_rendering_profile  # noqa
+from foxops.engine.profiling import profile_rendering  # noqa
 from foxops.engine.update import (  # noqa
+    DiffPatchFunc,
     update_incarnation,
     update_incarnation_from_git_template_repository,
 )
@@ -1,6 +1,7 @@
 import asyncio
 import copy
 import logging
+from contextlib import nullcontext
 from dataclasses import asdict
 from pathlib import Path
 from subprocess import PIPE, check_output
@@ -17,6 +18,7 @@ from foxops.engine.models import (
     load_incarnation_state,
 )
 from foxops.engine.patching.git_diff_patch import diff_and_patch
+from foxops.engine.profiling import RenderingProfile, profile_rendering
 from foxops.engine.update import update_incarnation_from_git_template_repository
 from foxops.logger import bind, get_logger, setup_logging
 
@@ -88,6 +90,19 @@ def cmd_initialize(
         "--template-version",
         help="Template repository version to use",
     ),
+    rendering_processes: Optional[int] = typer.Option(  # noqa: B008
+        None,
+        "--processes",
+        "-p",
+        min=0,
+        help="Number of worker processes to render the template in, 0 uses one per CPU core "
+        "[default: FOXOPS_ENGINE_RENDERING_PROCESSES or 1]",
+    ),
+    profile: bool = typer.Option(  # noqa: B008
+        False,
+        "--profile",
+        help="Profile the rendering and print the slowest template files",
+    ),
 ):
     """Initialize an incarnation repository with a version of a template and some data."""
     template_data: TemplateData = dict(tuple(x.split("=", maxsplit=1)) for x in raw_template_data)  # type: ignore
@@ -117,15 +132,19 @@ def cmd_initialize(
     )
 
     try:
-        asyncio.run(
-            initialize_incarnation(
-                template_root_dir=template_repository,
-                template_repository=str(template_repository),
-                template_repository_version=repository_version,
-                template_data=template_data,
-                incarnation_root_dir=incarnation_dir,
+        with profile_rendering() if profile else nullcontext() as rendering_profile:
+            asyncio.run(
+                initialize_incarnation(
+                    template_root_dir=template_repository,
+                    template_repository=str(template_repository),
+                    template_repository_version=repository_version,
+                    template_data=template_data,
+                    incarnation_root_dir=incarnation_dir,
+                    rendering_processes=rendering_processes,
+                )
             )
-        )
+        if rendering_profile is not None:
+            _print_rendering_profile(rendering_profile)
     except Exception as exc:
         logger.exception(f"initialization failed: {exc}")
     else:
@@ -172,6 +191,19 @@ def cmd_update(
         "-r",
         help="Override the template repository with a local path recorded in the incarnation state",
     ),
+    rendering_processes: Optional[int] = typer.Option(  # noqa: B008
+        None,
+        "--processes",
+        "-p",
+        min=0,
+        help="Number of worker processes to render the template in, 0 uses one per CPU core "
+        "[default: FOXOPS_ENGINE_RENDERING_PROCESSES or 1]",
+    ),
+    profile: bool = typer.Option(  # noqa: B008
+        False,
+        "--profile",
+        help="Profile the rendering and print the slowest template files",
+    ),
 ):
     """Initialize an incarnation repository with a version of a template and some data."""
     template_data: dict[str, str] = dict(tuple(x.split("=", maxsplit=1)) for x in raw_template_data)  # type: ignore
@@ -230,15 +262,19 @@ def cmd_update(
     )
 
     try:
-        _, _, files_with_conflicts = asyncio.run(
-            update_incarnation_from_git_template_repository(
-                template_git_repository=Path(incarnation_state.template_repository),
-                update_template_repository_version=update_repository_version,
-                update_template_data=merged_template_data,
-                incarnation_root_dir=incarnation_dir,
-                diff_patch_func=diff_and_patch,
+        with profile_rendering() if profile else nullcontext() as rendering_profile:
+            _, _, files_with_conflicts = asyncio.run(
+                update_incarnation_from_git_template_repository(
+                    template_git_repository=Path(incarnation_state.template_repository),
+                    update_template_repository_version=update_repository_version,
+                    update_template_data=merged_template_data,
+                    incarnation_root_dir=incarnation_dir,
+                    diff_patch_func=diff_and_patch,
+                    rendering_processes=rendering_processes,
+                )
             )
-        )
+        if rendering_profile is not None:
+            _print_rendering_profile(rendering_profile)
 
         if files_with_conflicts:
             logger.error(
@@ -251,6 +287,17 @@ def cmd_update(
         logger.exception(f"update failed: {exc}")
 
 
+def _print_rendering_profile(profile: RenderingProfile) -> None:
+    slowest = profile.slowest()
+    typer.echo(f"rendered {len(profile.entries)} template files, the {len(slowest)} slowest ones:")
+    typer.echo(f"{'compile ms':>12} {'render ms':>12} {'bytes':>12} {'cached':>6}  template file")
+    for entry in slowest:
+        typer.echo(
+            f"{entry.compile_time * 1000:>12.3f} {entry.render_time * 1000:>12.3f} {entry.output_bytes:>12} "
+            f"{'yes' if entry.cached else 'no':>6}  {entry.template_path}"
+        )
+
+
 @app.callback()
 def main(
     verbose: bool = typer.Option(False, "--verbose", "-v", help="turn on verbose logging"),  # noqa: B008
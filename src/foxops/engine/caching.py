@@ -0,0 +1,231 @@
+import fnmatch
+import hashlib
+import io
+import json
+import os
+import stat
+import tarfile
+import tempfile
+from dataclasses import asdict
+from pathlib import Path
+
+from jinja2.bccache import Bucket, FileSystemBytecodeCache
+
+from foxops.engine.models import IncarnationState
+from foxops.engine.settings import get_engine_settings
+from foxops.engine.sinks import InMemoryEntry, InMemorySink
+from foxops.logger import get_logger
+
+#: Holds the module logger
+logger = get_logger(__name__)
+
+#: Holds the file name pattern of the compiled templates, see `TemplateBytecodeCache`
+_TEMPLATE_BYTECODE_PATTERN = "__fengine_%s.cache"
+#: Holds the file name pattern of the cached template version manifests, see `get_template_version_manifest`
+TEMPLATE_VERSION_MANIFEST_PATTERN = "__fengine_manifest_%s.json"
+
+
+class TemplateBytecodeCache(FileSystemBytecodeCache):
+    """A size-bounded, persistent cache for compiled template files.
+
+    The compiled templates are stored on the local disk and are keyed by the git sha
+    of the template repository version and the path of the template file relative to the
+    template directory. This makes the cache independent of the (temporary) directory
+    the template repository has been checked out to.
+
+    Jinja still verifies the checksum of the template source before using a cached
+    entry, thus, a stale entry is never used.
+    Templates compiled for different kinds of environments (e.g. trusted ones) are
+    distinguished by their `variant`.
+
+    The cache is pruned with a least-recently-used strategy: every cache hit bumps the
+    modification time of the cache entry and `prune()` removes the oldest entries until
+    the cache fits into `max_size` bytes again, see `prune_template_cache`.
+    As the cache only grows when entries are written, `prune()` doesn't do anything
+    unless this cache has written an entry since it has last been pruned.
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        template_repository_version_hash: str,
+        max_size: int,
+        variant: str | None = None,
+    ):
+        directory.mkdir(parents=True, exist_ok=True)
+        super().__init__(str(directory), pattern=_TEMPLATE_BYTECODE_PATTERN)
+        self.template_repository_version_hash = template_repository_version_hash
+        self.max_size = max_size
+        self.variant = variant
+        #: Holds the keys of the cache entries which have been loaded by this cache
+        self.loaded_keys: set[str] = set()
+        #: Holds whether this cache has written an entry since it has last been pruned
+        self.written = False
+
+    def get_cache_key(self, name: str, filename: str | None = None) -> str:
+        key = f"{self.template_repository_version_hash}:{name}"
+        if self.variant is not None:
+            key = f"{self.variant}:{key}"
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    def load_bytecode(self, bucket: Bucket) -> None:
+        super().load_bytecode(bucket)
+        if bucket.code is not None:
+            self.loaded_keys.add(bucket.key)
+            try:
+                os.utime(self._get_cache_filename(bucket))
+            except OSError:
+                # NOTE: the entry may have been pruned by another process in the meantime.
+                pass
+
+    def dump_bytecode(self, bucket: Bucket) -> None:
+        super().dump_bytecode(bucket)
+        self.written = True
+
+    def prune(self) -> None:
+        """Remove the least recently used cache entries until the cache fits into `max_size` bytes."""
+        if not self.written:
+            return
+        self.written = False
+        prune_template_cache(Path(self.directory), self.max_size)
+
+
+class RenderingCache:
+    """A size-bounded, content-addressed, persistent cache of rendered incarnations.
+
+    A rendering is keyed by the hash of the incarnation state it has been rendered from, i.e.
+    the template repository, its version (and git sha) and the template data.
+    Incarnations with an identical state share a single cache entry.
+
+    The renderings are stored as tar archives and are pruned with a least-recently-used strategy,
+    see `prune_least_recently_used`.
+    """
+
+    #: Holds the file name pattern of the cache entries
+    pattern = "__fengine_rendering_%s.tar"
+
+    def __init__(self, directory: Path, max_size: int):
+        directory.mkdir(parents=True, exist_ok=True)
+        self.directory = directory
+        self.max_size = max_size
+
+    @staticmethod
+    def get_cache_key(incarnation_state: IncarnationState) -> str:
+        raw_state = json.dumps(asdict(incarnation_state), sort_keys=True, default=str)
+        return hashlib.sha256(raw_state.encode("utf-8")).hexdigest()
+
+    def _get_cache_path(self, incarnation_state: IncarnationState) -> Path:
+        return self.directory / (self.pattern % self.get_cache_key(incarnation_state))
+
+    def load(self, incarnation_state: IncarnationState) -> InMemorySink | None:
+        """Load the rendering of the given incarnation state, `None` if it's not cached."""
+        cache_path = self._get_cache_path(incarnation_state)
+        try:
+            with tarfile.open(cache_path, "r:") as archive:
+                incarnation = _read_rendering_archive(archive)
+            os.utime(cache_path)
+        except (FileNotFoundError, tarfile.TarError):
+            # NOTE: the entry may have been pruned by another process in the meantime.
+            return None
+
+        logger.debug(f"loaded rendered incarnation from cache at {cache_path}")
+        return incarnation
+
+    def store(self, incarnation_state: IncarnationState, incarnation: InMemorySink) -> None:
+        """Store the complete rendering of the given incarnation state and prune the cache."""
+        cache_path = self._get_cache_path(incarnation_state)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f, tarfile.open(fileobj=f, mode="w:") as archive:
+                _write_rendering_archive(archive, incarnation)
+            # NOTE: the entry is replaced atomically, so that concurrent readers never see a partial entry.
+            os.replace(tmp_path, cache_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+        logger.debug(f"stored rendered incarnation in cache at {cache_path}")
+        prune_least_recently_used(self.directory, self.pattern % ("*",), self.max_size)
+
+
+def get_rendering_cache() -> RenderingCache | None:
+    """Get the rendering cache configured by the `rendering_cache_dir` engine setting, if any."""
+    settings = get_engine_settings()
+    if settings.rendering_cache_dir is None:
+        return None
+    return RenderingCache(settings.rendering_cache_dir, settings.rendering_cache_max_size)
+
+
+def _write_rendering_archive(archive: tarfile.TarFile, incarnation: InMemorySink) -> None:
+    for path, entry in incarnation.entries.items():
+        info = tarfile.TarInfo(path.as_posix())
+        info.mode = stat.S_IMODE(entry.mode)
+        if entry.symlink_target is not None:
+            info.type = tarfile.SYMTYPE
+            info.linkname = entry.symlink_target
+            archive.addfile(info)
+        elif entry.content is not None:
+            info.size = len(entry.content)
+            archive.addfile(info, io.BytesIO(entry.content))
+        else:
+            info.type = tarfile.DIRTYPE
+            archive.addfile(info)
+
+
+def _read_rendering_archive(archive: tarfile.TarFile) -> InMemorySink:
+    incarnation = InMemorySink()
+    for info in archive:
+        path = Path(info.name)
+        if info.issym():
+            incarnation.entries[path] = InMemoryEntry(stat.S_IFLNK | info.mode, symlink_target=info.linkname)
+        elif info.isdir():
+            incarnation.entries[path] = InMemoryEntry(stat.S_IFDIR | info.mode)
+        else:
+            content = archive.extractfile(info).read()  # type: ignore
+            incarnation.entries[path] = InMemoryEntry(stat.S_IFREG | info.mode, content=content)
+    return incarnation
+
+
+def prune_template_cache(directory: Path, max_size: int) -> None:
+    """Remove the least recently used compiled templates and template version manifests in the template cache.
+
+    Both kinds of entries share the `max_size` bytes of the template cache.
+    """
+    patterns = [_TEMPLATE_BYTECODE_PATTERN % ("*",), TEMPLATE_VERSION_MANIFEST_PATTERN % ("*",)]
+    prune_least_recently_used(directory, patterns, max_size)
+
+
+def prune_least_recently_used(directory: Path, pattern: str | list[str], max_size: int) -> None:
+    """Remove the least recently used entries matching `pattern` in `directory` until they fit into `max_size` bytes.
+
+    The modification time of an entry is considered its last usage.
+    If multiple patterns are given, the entries matching any of them are pruned together.
+    """
+    patterns = [pattern] if isinstance(pattern, str) else pattern
+    entries: list[tuple[float, int, str]] = []
+    total_size = 0
+    with os.scandir(directory) as it:
+        for entry in it:
+            if not any(fnmatch.fnmatchcase(entry.name, p) for p in patterns):
+                continue
+            try:
+                entry_stat = entry.stat(follow_symlinks=False)
+            except FileNotFoundError:
+                continue
+            entries.append((entry_stat.st_mtime, entry_stat.st_size, entry.path))
+            total_size += entry_stat.st_size
+
+    if total_size <= max_size:
+        return
+
+    entries.sort()
+    for _, size, path in entries:
+        if total_size <= max_size:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total_size -= size
+
+    logger.debug(f"pruned cache at {directory} to {total_size} bytes")
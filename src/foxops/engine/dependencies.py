@@ -0,0 +1,392 @@
+import contextlib
+import dataclasses
+import hashlib
+import json
+import os
+import tempfile
+import typing
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from jinja2 import Environment, UndefinedError, meta
+
+from foxops.engine.caching import (
+    TEMPLATE_VERSION_MANIFEST_PATTERN,
+    prune_template_cache,
+)
+from foxops.engine.manifest import TemplateEntry, TemplateEntryType, scan_template
+from foxops.engine.models import (
+    TemplateConfig,
+    TemplateData,
+    fill_missing_optionals_with_defaults,
+    load_template_config,
+)
+from foxops.engine.rendering import (
+    TemplatePathRenderer,
+    create_template_environment,
+    render_template,
+)
+from foxops.engine.settings import get_engine_settings
+from foxops.engine.sinks import InMemorySink
+from foxops.external.git import GitRepository
+from foxops.logger import get_logger
+
+#: Holds the module logger
+logger = get_logger(__name__)
+
+#: Holds the version of the format of the cached template version manifests,
+#: it must be incremented whenever the format changes to invalidate the existing manifests.
+_MANIFEST_FORMAT_VERSION = 1
+
+
+@dataclass(frozen=True)
+class VariableDependencyIndex:
+    """Maps the template variables to the template entries they are used in.
+
+    A template entry depends on a variable if the variable is used in its path (including
+    the paths of its parent directories), its content or its symlink target.
+    Entries which include, import or extend other templates are always rendered,
+    because their dependencies can't be determined from their own source.
+
+    All paths are relative to the template root directory.
+    """
+
+    #: Holds the template entries by the variables they depend on
+    variables: dict[str, frozenset[Path]] = field(default_factory=dict)
+    #: Holds the template entries which must always be rendered
+    always_rendered: frozenset[Path] = frozenset()
+
+    def affected_by(self, variable_names: typing.Iterable[str]) -> set[Path]:
+        """Get the template entries which have to be rendered when the given variables change."""
+        affected = set(self.always_rendered)
+        for name in variable_names:
+            affected.update(self.variables.get(name, ()))
+        return affected
+
+    def to_json(self) -> str:
+        return json.dumps(self._to_dict())
+
+    @classmethod
+    def from_json(cls, raw_index: str) -> "VariableDependencyIndex":
+        return cls._from_dict(json.loads(raw_index))
+
+    def _to_dict(self) -> dict[str, typing.Any]:
+        return {
+            "variables": {name: sorted(p.as_posix() for p in paths) for name, paths in self.variables.items()},
+            "always_rendered": sorted(p.as_posix() for p in self.always_rendered),
+        }
+
+    @classmethod
+    def _from_dict(cls, index: dict[str, typing.Any]) -> "VariableDependencyIndex":
+        return cls(
+            variables={name: frozenset(Path(p) for p in paths) for name, paths in index["variables"].items()},
+            always_rendered=frozenset(Path(p) for p in index["always_rendered"]),
+        )
+
+
+def build_variable_dependency_index(environment: Environment, manifest: list[TemplateEntry]) -> VariableDependencyIndex:
+    """Analyze the paths, contents and symlink targets of the given template entries for the variables they use."""
+    path_renderer = TemplatePathRenderer(environment, {})
+    path_variables: dict[Path, frozenset[str]] = {Path("."): frozenset()}
+    variables: dict[str, set[Path]] = {}
+    always_rendered: set[Path] = set()
+
+    def _find_variables(source: str) -> set[str]:
+        if path_renderer.is_literal(source):
+            return set()
+        ast = environment.parse(source)
+        if any(True for _ in meta.find_referenced_templates(ast)):
+            raise _ReferencesTemplatesError()
+        return meta.find_undeclared_variables(ast)
+
+    # NOTE: the manifest lists the entries of a directory before the entries of its subdirectories,
+    #       thus, the variables of the parent directory path are always known already.
+    for entry in manifest:
+        try:
+            entry_path_variables = path_variables[entry.path.parent] | _find_variables(entry.path.name)
+            if entry.type is TemplateEntryType.DIRECTORY:
+                path_variables[entry.path] = frozenset(entry_path_variables)
+
+            entry_variables = set(entry_path_variables)
+            if entry.type is TemplateEntryType.SYMLINK:
+                entry_variables |= _find_variables(typing.cast(str, entry.symlink_target))
+            elif entry.type is TemplateEntryType.FILE and not entry.excluded:
+                source, _, _ = environment.loader.get_source(environment, entry.path.as_posix())  # type: ignore
+                entry_variables |= _find_variables(source)
+        except _ReferencesTemplatesError:
+            always_rendered.add(entry.path)
+            continue
+
+        for name in entry_variables:
+            variables.setdefault(name, set()).add(entry.path)
+
+    return VariableDependencyIndex(
+        variables={name: frozenset(paths) for name, paths in variables.items()},
+        always_rendered=frozenset(always_rendered),
+    )
+
+
+@dataclass(frozen=True)
+class TemplateVersionManifest:
+    """Holds everything fengine derives from a template repository version alone.
+
+    This is the parsed `fengine.yaml`, the entries of the template directory (including the
+    hashes of the file contents and whether they are literal) and the variable dependency index.
+    It doesn't depend on any template data, thus, it's computed once per template version
+    and reused by all renderings of it, see `get_template_version_manifest`.
+    """
+
+    #: Holds the template configuration from the `fengine.yaml`
+    template_config: TemplateConfig
+    #: Holds the entries of the template directory, see `scan_template`
+    entries: list[TemplateEntry]
+    #: Holds the template variables used by the template entries
+    dependency_index: VariableDependencyIndex
+
+    def to_json(self) -> str:
+        return json.dumps(
+            {
+                "format_version": _MANIFEST_FORMAT_VERSION,
+                "template_config": json.loads(self.template_config.json()),
+                "entries": [
+                    {
+                        "path": entry.path.as_posix(),
+                        "type": entry.type.value,
+                        "mode": entry.mode,
+                        "symlink_target": entry.symlink_target,
+                        "excluded": entry.excluded,
+                        "size": entry.size,
+                        "content_hash": entry.content_hash,
+                        "literal": entry.literal,
+                    }
+                    for entry in self.entries
+                ],
+                "dependency_index": self.dependency_index._to_dict(),
+            }
+        )
+
+    @classmethod
+    def from_json(cls, raw_manifest: str) -> "TemplateVersionManifest":
+        """Parse a manifest written by `to_json`.
+
+        Raises a `ValueError` if the manifest has been written in another format version.
+        """
+        manifest = json.loads(raw_manifest)
+        if (format_version := manifest.get("format_version")) != _MANIFEST_FORMAT_VERSION:
+            raise ValueError(f"unsupported template version manifest format version: {format_version}")
+        return cls(
+            template_config=TemplateConfig.parse_obj(manifest["template_config"]),
+            entries=[
+                TemplateEntry(
+                    path=Path(entry["path"]),
+                    type=TemplateEntryType(entry["type"]),
+                    mode=entry["mode"],
+                    symlink_target=entry["symlink_target"],
+                    excluded=entry["excluded"],
+                    size=entry["size"],
+                    content_hash=entry["content_hash"],
+                    literal=entry["literal"],
+                )
+                for entry in manifest["entries"]
+            ],
+            dependency_index=VariableDependencyIndex._from_dict(manifest["dependency_index"]),
+        )
+
+
+def build_template_version_manifest(template_repository_root_dir: Path) -> TemplateVersionManifest:
+    """Scan, hash and analyze the template of the given template repository."""
+    template_config = load_template_config(template_repository_root_dir / "fengine.yaml")
+    template_root_dir = template_repository_root_dir / "template"
+    environment = create_template_environment(template_root_dir)
+    path_renderer = TemplatePathRenderer(environment, {})
+
+    entries = []
+    for entry in scan_template(template_root_dir, template_config.rendering.excluded_files):
+        if entry.type is TemplateEntryType.FILE:
+            content = (template_root_dir / entry.path).read_bytes()
+            entry = dataclasses.replace(
+                entry,
+                content_hash=hashlib.sha256(content).hexdigest(),
+                literal=not entry.excluded and _is_literal_content(path_renderer, content),
+            )
+        entries.append(entry)
+
+    return TemplateVersionManifest(
+        template_config=template_config,
+        entries=entries,
+        dependency_index=build_variable_dependency_index(environment, entries),
+    )
+
+
+def get_template_version_manifest(
+    template_repository_root_dir: Path, template_repository_version_hash: str
+) -> TemplateVersionManifest:
+    """Get the manifest of a template repository version.
+
+    The manifest is cached per git sha of the template repository version
+    in the `template_cache_dir` engine setting, if configured.
+    Cached manifests of another format version are rebuilt, and the manifests are pruned
+    together with the compiled templates, see `prune_template_cache`.
+    The template repository must not have any uncommitted changes.
+    """
+    settings = get_engine_settings()
+    cache_dir = settings.template_cache_dir
+    cache_path = (
+        cache_dir / (TEMPLATE_VERSION_MANIFEST_PATTERN % template_repository_version_hash) if cache_dir else None
+    )
+    if cache_path is not None and cache_path.exists():
+        try:
+            manifest = TemplateVersionManifest.from_json(cache_path.read_text())
+        except (ValueError, KeyError) as exc:
+            logger.debug(f"rebuilding invalid cached template version manifest {cache_path}: {exc}")
+        else:
+            # NOTE: the manifest may have been pruned by another process in the meantime.
+            with contextlib.suppress(OSError):
+                os.utime(cache_path)
+            return manifest
+
+    manifest = build_template_version_manifest(template_repository_root_dir)
+    if cache_path is not None:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        # NOTE: the manifest is written atomically, concurrent reconciliations may read it at any time.
+        fd, tmp_path = tempfile.mkstemp(dir=cache_path.parent, prefix=".tmp-")
+        with os.fdopen(fd, "w") as f:
+            f.write(manifest.to_json())
+        os.replace(tmp_path, cache_path)
+        prune_template_cache(cache_path.parent, settings.template_cache_max_size)
+    return manifest
+
+
+def get_changed_variables(old_template_data: TemplateData, new_template_data: TemplateData) -> set[str]:
+    """Get the names of the variables which values differ between the given template data."""
+    missing = object()
+    return {
+        name
+        for name in old_template_data.keys() | new_template_data.keys()
+        if old_template_data.get(name, missing) != new_template_data.get(name, missing)
+    }
+
+
+async def get_template_paths_affected_by_update(
+    original_template_root_dir: Path,
+    updated_template_root_dir: Path,
+    changed_template_paths: typing.Iterable[Path],
+    original_template_data: TemplateData,
+    updated_template_data: TemplateData,
+) -> set[Path] | None:
+    """Get the template entries which may render differently between two template versions and template data.
+
+    These are the entries which changed between the template versions (including the directories
+    containing them) and the ones which depend on variables which values differ,
+    including changed defaults in the `fengine.yaml` of the templates.
+    All other entries render to the same output for both versions, thus,
+    it's sufficient to render only the returned entries to diff the two incarnations.
+
+    The affected entries are determined from the manifests of both template versions, thus, this is only
+    done if the manifests are cached, see the `template_cache_dir` engine setting. Building both manifests
+    for a single update would scan and hash both template directories, which costs about as much as rendering them.
+
+    :param changed_template_paths: The paths which changed between the template versions,
+    relative to the template root directory.
+    Returns `None` if all template entries must be rendered, e.g. because the excluded files changed
+    or there is no template cache.
+    """
+    if get_engine_settings().template_cache_dir is None:
+        logger.debug("no template cache configured, rendering all template entries")
+        return None
+
+    original_manifest, updated_manifest = [
+        get_template_version_manifest(template_root_dir, await GitRepository(template_root_dir).head())
+        for template_root_dir in [original_template_root_dir, updated_template_root_dir]
+    ]
+    original_template_config = original_manifest.template_config
+    updated_template_config = updated_manifest.template_config
+    if original_template_config.rendering.excluded_files != updated_template_config.rendering.excluded_files:
+        return None
+
+    changed_variables = get_changed_variables(
+        fill_missing_optionals_with_defaults(original_template_data, original_template_config),
+        fill_missing_optionals_with_defaults(updated_template_data, updated_template_config),
+    )
+    affected_template_paths = set(changed_template_paths)
+    # NOTE: git only reports files, thus, the directories containing them are rendered again, too.
+    #       Otherwise, a renamed or deleted directory would remain in a rendering derived from a previous one,
+    #       and a new directory would be missing from it, see `rerender_template`.
+    affected_template_paths |= {
+        parent for path in changed_template_paths for parent in path.parents if parent != Path(".")
+    }
+    for manifest in [original_manifest, updated_manifest]:
+        affected_template_paths |= manifest.dependency_index.affected_by(changed_variables)
+    return affected_template_paths
+
+
+async def rerender_template(
+    template_root_dir: Path,
+    incarnation: InMemorySink,
+    previous_incarnation: InMemorySink,
+    previous_template_data: TemplateData,
+    template_data: TemplateData,
+    template_version_manifest: TemplateVersionManifest,
+    template_repository_version_hash: str,
+    processes: int | None = None,
+    affected_template_paths: set[Path] | None = None,
+    trusted: bool = False,
+) -> None:
+    """Render a template based on a previous (complete) rendering.
+
+    Only the `affected_template_paths` are rendered, all other entries are taken over from
+    the previous rendering, see `get_template_paths_affected_by_update`.
+    If they are not given, the previous rendering must be of the same template version and
+    only the template entries depending on the changed variables are rendered, see `VariableDependencyIndex`.
+    """
+    if affected_template_paths is None:
+        changed_variables = get_changed_variables(previous_template_data, template_data)
+        affected_template_paths = template_version_manifest.dependency_index.affected_by(changed_variables)
+        logger.debug(
+            "re-render template entries affected by changed template data",
+            changed_variables=sorted(changed_variables),
+        )
+    logger.debug("re-render affected template entries", affected_template_paths=len(affected_template_paths))
+
+    incarnation.entries.update(previous_incarnation.entries)
+    previous_path_renderer = TemplatePathRenderer(
+        create_template_environment(template_root_dir, trusted=trusted), previous_template_data
+    )
+    for template_path in affected_template_paths:
+        try:
+            previous_rendered_path = await previous_path_renderer.render(template_path)
+        except UndefinedError:
+            # NOTE: the entry uses a variable the previous template data didn't have,
+            #       thus, it can't have been part of the previous rendering.
+            continue
+        incarnation.entries.pop(previous_rendered_path, None)
+
+    await render_template(
+        template_root_dir,
+        incarnation,
+        template_data,
+        template_version_manifest.template_config.rendering.excluded_files,
+        processes=processes,
+        template_repository_version_hash=template_repository_version_hash,
+        template_paths=affected_template_paths,
+        trusted=trusted,
+        manifest=template_version_manifest.entries,
+    )
+
+
+def _is_literal_content(path_renderer: TemplatePathRenderer, content: bytes) -> bool:
+    """Check if the given template file content renders to itself.
+
+    Besides containing no template syntax, the content must be valid UTF-8 and must not contain
+    carriage returns, because jinja2 normalizes the newlines of the rendered content.
+    """
+    if b"\r" in content:
+        return False
+    try:
+        return path_renderer.is_literal(content.decode("utf-8"))
+    except UnicodeDecodeError:
+        return False
+
+
+class _ReferencesTemplatesError(Exception):
+    pass
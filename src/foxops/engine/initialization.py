@@ -1,14 +1,23 @@
+import stat
 from pathlib import Path
 
+from foxops.engine.dependencies import (
+    TemplateVersionManifest,
+    get_template_version_manifest,
+    rerender_template,
+)
 from foxops.engine.fvars import merge_template_data_with_fvars
 from foxops.engine.models import (
     IncarnationState,
     TemplateData,
+    dump_incarnation_state,
     fill_missing_optionals_with_defaults,
     load_template_config,
     save_incarnation_state,
 )
 from foxops.engine.rendering import render_template
+from foxops.engine.settings import get_engine_settings
+from foxops.engine.sinks import InMemorySink, RenderSink
 from foxops.errors import ReconciliationUserError
 from foxops.external.git import GitRepository
 from foxops.logger import get_logger
@@ -16,6 +25,9 @@ from foxops.logger import get_logger
 #: Holds the module logger
 logger = get_logger(__name__)
 
+#: Holds the mode of the incarnation state file when it's written into a `RenderSink`
+INCARNATION_STATE_FILE_MODE = stat.S_IFREG | 0o644
+
 
 async def initialize_incarnation(
     template_root_dir: Path,
@@ -23,12 +35,15 @@ async def initialize_incarnation(
     template_repository_version: str,
     template_data: TemplateData,
     incarnation_root_dir: Path,
+    rendering_processes: int | None = None,
 ) -> IncarnationState:
     """Initialize an incarnation repository with a version of a template.
 
     The initialization process consists of the following steps:
         * ensure incarnation directory exists
         * render template directory file system contents into incarnation directory
+
+    The `rendering_processes` are passed on to `render_template`.
     """
     template_data = merge_template_data_with_fvars(
         template_data=template_data,
@@ -40,6 +55,7 @@ async def initialize_incarnation(
         template_repository_version=template_repository_version,
         template_data=template_data,
         incarnation_root_dir=incarnation_root_dir,
+        rendering_processes=rendering_processes,
     )
 
 
@@ -48,10 +64,37 @@ async def _initialize_incarnation(
     template_repository: str,
     template_repository_version: str,
     template_data: TemplateData,
-    incarnation_root_dir: Path,
+    incarnation_root_dir: Path | RenderSink,
+    rendering_processes: int | None = None,
+    previous_rendering: tuple[IncarnationState, InMemorySink] | None = None,
+    template_paths: set[Path] | None = None,
 ) -> IncarnationState:
+    """Initialize an incarnation without merging the fvars.
+
+    If `template_paths` are given, only these template entries are rendered, see `render_template`.
+
+    If a complete `previous_rendering` is given and the incarnation is rendered in memory, all entries
+    but the `template_paths` are taken over from it. Without `template_paths` this requires the previous
+    rendering to be of the same template version, then only the template entries affected by the changed
+    template data are rendered. See `rerender_template`.
+
+    If the `template_cache_dir` engine setting is configured, the manifest of a clean template
+    repository version is reused across initializations, see `get_template_version_manifest`.
+    """
+    template_version_manifest: TemplateVersionManifest | None = None
+    if (
+        get_engine_settings().template_cache_dir is not None
+        and not await GitRepository(template_root_dir).has_uncommitted_changes()
+    ):
+        template_version_manifest = get_template_version_manifest(
+            template_root_dir, await GitRepository(template_root_dir).head()
+        )
+
     # verify that the template data in the desired incarnation state match the required template variables
-    template_config = load_template_config(template_root_dir / "fengine.yaml")
+    if template_version_manifest is not None:
+        template_config = template_version_manifest.template_config
+    else:
+        template_config = load_template_config(template_root_dir / "fengine.yaml")
     logger.debug(f"load template config from {template_config} to initialize incarnation at {incarnation_root_dir}")
     required_variable_names = set(template_config.required_variables.keys())
     provided_variable_names = set(template_data.keys())
@@ -74,14 +117,46 @@ async def _initialize_incarnation(
         template_config=template_config,
     )
 
-    await render_template(
-        template_root_dir / "template",
-        incarnation_root_dir,
-        template_data_with_defaults,
-        rendering_filename_exclude_patterns=template_config.rendering.excluded_files,
-    )
-
     template_repository_version_hash = await GitRepository(template_root_dir).head()
+    trusted = template_repository in get_engine_settings().trusted_template_repositories
+    if (
+        previous_rendering is not None
+        and isinstance(incarnation_root_dir, InMemorySink)
+        and (
+            template_paths is not None
+            or previous_rendering[0].template_repository_version_hash == template_repository_version_hash
+        )
+    ):
+        if template_version_manifest is None:
+            template_version_manifest = get_template_version_manifest(
+                template_root_dir, template_repository_version_hash
+            )
+        previous_incarnation_state, previous_incarnation = previous_rendering
+        await rerender_template(
+            template_root_dir / "template",
+            incarnation_root_dir,
+            previous_incarnation,
+            previous_incarnation_state.template_data,
+            template_data_with_defaults,
+            template_version_manifest=template_version_manifest,
+            template_repository_version_hash=template_repository_version_hash,
+            processes=rendering_processes,
+            affected_template_paths=template_paths,
+            trusted=trusted,
+        )
+    else:
+        await render_template(
+            template_root_dir / "template",
+            incarnation_root_dir,
+            template_data_with_defaults,
+            rendering_filename_exclude_patterns=template_config.rendering.excluded_files,
+            processes=rendering_processes,
+            template_repository_version_hash=template_repository_version_hash,
+            template_paths=template_paths,
+            trusted=trusted,
+            manifest=template_version_manifest.entries if template_version_manifest is not None else None,
+        )
+
     incarnation_state = IncarnationState(
         template_repository=template_repository,
         template_repository_version=template_repository_version,
@@ -89,7 +164,13 @@ async def _initialize_incarnation(
         template_data=template_data_with_defaults,
     )
 
-    incarnation_config_path = Path(incarnation_root_dir, ".fengine.yaml")
-    save_incarnation_state(incarnation_config_path, incarnation_state)
-    logger.debug(f"save incarnation state to {incarnation_config_path} after template initialization")
+    if isinstance(incarnation_root_dir, Path):
+        incarnation_config_path = Path(incarnation_root_dir, ".fengine.yaml")
+        save_incarnation_state(incarnation_config_path, incarnation_state)
+        logger.debug(f"save incarnation state to {incarnation_config_path} after template initialization")
+    else:
+        await incarnation_root_dir.write_file(
+            Path(".fengine.yaml"), dump_incarnation_state(incarnation_state), INCARNATION_STATE_FILE_MODE
+        )
+        logger.debug(f"save incarnation state to {incarnation_root_dir} after template initialization")
     return incarnation_state
@@ -0,0 +1,44 @@
+import os
+import typing
+from pathlib import Path
+
+from jinja2 import BaseLoader, Environment, TemplateNotFound
+from jinja2.loaders import split_template_path
+
+
+class ImmutableFileSystemLoader(BaseLoader):
+    """Load templates from a template directory which doesn't change while it's rendered.
+
+    fengine always renders a template repository checked out at a fixed version,
+    thus, the templates are never revalidated: unlike the `FileSystemLoader`,
+    this loader neither stats the template files when loading them nor when jinja2
+    checks whether a cached template is up-to-date.
+
+    Every template source is read at most once and kept for the lifetime of the loader,
+    so that all lookups of the same template share the loaded source.
+    """
+
+    def __init__(self, searchpath: Path, encoding: str = "utf-8"):
+        #: Holds the template root directory, as a list for compatibility with the `FileSystemLoader`
+        self.searchpath = [os.fspath(searchpath)]
+        self.encoding = encoding
+        self._sources: dict[str, tuple[str, str]] = {}
+
+    def get_source(
+        self, environment: Environment, template: str
+    ) -> tuple[str, str | None, typing.Callable[[], bool] | None]:
+        if (loaded := self._sources.get(template)) is None:
+            filename = os.path.join(self.searchpath[0], *split_template_path(template))
+            try:
+                with open(filename, encoding=self.encoding) as f:
+                    loaded = (f.read(), os.path.normpath(filename))
+            except (FileNotFoundError, IsADirectoryError, NotADirectoryError):
+                raise TemplateNotFound(template)
+            self._sources[template] = loaded
+
+        source, filename = loaded
+        return source, filename, _is_up_to_date
+
+
+def _is_up_to_date() -> bool:
+    return True
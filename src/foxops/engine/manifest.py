@@ -0,0 +1,145 @@
+import fnmatch
+import os
+import re
+import stat
+import typing
+from dataclasses import dataclass
+from enum import Enum
+from pathlib import Path, PurePath
+
+#: Holds the marker for a pattern segment matching any number of directories
+_RECURSIVE_WILDCARD = "**"
+
+
+class TemplateEntryType(Enum):
+    FILE = "file"
+    DIRECTORY = "directory"
+    SYMLINK = "symlink"
+
+
+@dataclass(frozen=True)
+class TemplateEntry:
+    """Represents a single file system entry of a template directory."""
+
+    #: Holds the path of the entry relative to the template root directory
+    path: Path
+    #: Holds the type of the entry
+    type: TemplateEntryType
+    #: Holds the mode of the entry as reported by `lstat`
+    mode: int
+    #: Holds the (unrendered) target if the entry is a symlink
+    symlink_target: str | None = None
+    #: Holds whether the content of the entry is excluded from rendering
+    excluded: bool = False
+    #: Holds the size of the entry in bytes as reported by `lstat`
+    size: int = 0
+    #: Holds the SHA256 hex digest of the content if the entry is a file and it's been hashed
+    content_hash: str | None = None
+    #: Holds whether the content of the entry is known to render to itself, i.e. it contains no template syntax
+    literal: bool = False
+
+
+class ExcludeMatcher:
+    """Match template paths against a list of glob patterns.
+
+    The patterns are compiled once and follow the semantics of `pathlib.Path.glob()`,
+    relative to the template root directory:
+
+        * `*`, `?` and `[...]` match within a single path segment.
+        * a `**` segment matches any number of directories, including none.
+        * a trailing `**` segment only matches directories.
+    """
+
+    def __init__(self, patterns: typing.Iterable[str]):
+        self._patterns: list[tuple[typing.Callable[[str], typing.Any] | None, ...]] = []
+        for pattern in patterns:
+            pure_pattern = PurePath(pattern)
+            if pure_pattern.is_absolute():
+                raise ValueError(f"exclude patterns must be relative, got {pattern}")
+            self._patterns.append(
+                tuple(
+                    None if part == _RECURSIVE_WILDCARD else re.compile(fnmatch.translate(part)).match
+                    for part in pure_pattern.parts
+                )
+            )
+
+    def matches(self, relative_path: PurePath, is_dir: bool = False) -> bool:
+        return any(self._matches_pattern(p, relative_path.parts, is_dir) for p in self._patterns)
+
+    @staticmethod
+    def _matches_pattern(
+        pattern: tuple[typing.Callable[[str], typing.Any] | None, ...],
+        parts: tuple[str, ...],
+        is_dir: bool,
+    ) -> bool:
+        if not pattern or (pattern[-1] is None and not is_dir):
+            return False
+
+        def _closure(states: set[int]) -> set[int]:
+            # a recursive wildcard may match no directory at all
+            closed = set(states)
+            for state in sorted(states):
+                while state < len(pattern) and pattern[state] is None:
+                    state += 1
+                    closed.add(state)
+            return closed
+
+        states = _closure({0})
+        for part in parts:
+            next_states = set()
+            for state in states:
+                if state == len(pattern):
+                    continue
+                if (segment_matcher := pattern[state]) is None:
+                    next_states.add(state)
+                elif segment_matcher(part):
+                    next_states.add(state + 1)
+            if not next_states:
+                return False
+            states = _closure(next_states)
+
+        return len(pattern) in states
+
+
+def scan_template(template_root_dir: Path, exclude_patterns: typing.Iterable[str]) -> list[TemplateEntry]:
+    """Scan the given template directory in a single pass.
+
+    The entries are returned top-down: the entries of a directory are listed
+    before the entries of its subdirectories. Symlinks to directories are not followed.
+
+    :param exclude_patterns: A list of glob patterns matching files which contents should not be rendered,
+    see `ExcludeMatcher`.
+    """
+    exclude_matcher = ExcludeMatcher(exclude_patterns)
+    manifest: list[TemplateEntry] = []
+
+    pending_dirs = [(template_root_dir, Path())]
+    while pending_dirs:
+        directory, relative_directory = pending_dirs.pop()
+        subdirs = []
+        with os.scandir(directory) as it:
+            for dir_entry in sorted(it, key=lambda e: e.name):
+                relative_path = relative_directory / dir_entry.name
+                entry_stat = dir_entry.stat(follow_symlinks=False)
+                if stat.S_ISLNK(entry_stat.st_mode):
+                    entry = TemplateEntry(
+                        relative_path,
+                        TemplateEntryType.SYMLINK,
+                        entry_stat.st_mode,
+                        symlink_target=os.readlink(dir_entry.path),
+                    )
+                elif stat.S_ISDIR(entry_stat.st_mode):
+                    entry = TemplateEntry(relative_path, TemplateEntryType.DIRECTORY, entry_stat.st_mode)
+                    subdirs.append((Path(dir_entry.path), relative_path))
+                else:
+                    entry = TemplateEntry(
+                        relative_path,
+                        TemplateEntryType.FILE,
+                        entry_stat.st_mode,
+                        excluded=exclude_matcher.matches(relative_path),
+                        size=entry_stat.st_size,
+                    )
+                manifest.append(entry)
+        pending_dirs.extend(reversed(subdirs))
+
+    return manifest
@@ -0,0 +1,101 @@
+import hashlib
+from dataclasses import dataclass
+from pathlib import Path
+
+from foxops.engine.sinks import InMemoryEntry, InMemorySink
+
+#: Holds the path of the root directory of a rendered incarnation
+ROOT = Path(".")
+
+
+@dataclass(frozen=True)
+class MerkleTree:
+    """Represents the Merkle hashes of a rendered incarnation.
+
+    The hash of an entry covers its type, mode and content, see `InMemoryEntry.digest`.
+    The hash of a directory covers the names and hashes of its children (and its own mode),
+    thus, the hash of the root directory `ROOT` covers the entire rendered incarnation.
+    """
+
+    #: Holds the hashes of all entries and directories by their path
+    hashes: dict[Path, bytes]
+    #: Holds the paths of the children of all directories
+    children: dict[Path, list[Path]]
+
+    @property
+    def root_hash(self) -> bytes:
+        return self.hashes[ROOT]
+
+
+def build_merkle_tree(incarnation: InMemorySink) -> MerkleTree:
+    """Build the Merkle tree of a rendered incarnation held in memory.
+
+    Directories which don't have an entry on their own (e.g. because they only exist
+    as parents of rendered files) are part of the tree, too.
+    """
+    children: dict[Path, list[Path]] = {ROOT: []}
+    for path, entry in incarnation.entries.items():
+        if path in children:
+            # NOTE: the directory has already been added as parent of a previous entry.
+            continue
+        if entry.content is None and entry.symlink_target is None:
+            children[path] = []
+        child = path
+        for parent in path.parents:
+            if parent in children:
+                children[parent].append(child)
+                break
+            children[parent] = [child]
+            child = parent
+
+    hashes: dict[Path, bytes] = {}
+    # NOTE: the directories are hashed bottom-up, thus, the hashes of their children are known.
+    for directory in sorted(children, key=lambda p: len(p.parts), reverse=True):
+        digest = hashlib.sha256(b"tree\0")
+        if (directory_entry := incarnation.entries.get(directory)) is not None:
+            digest.update(directory_entry.digest)
+        for child in sorted(children[directory]):
+            child_hash = hashes.get(child) or incarnation.entries[child].digest
+            digest.update(b"%s\0%s" % (child.name.encode("utf-8"), child_hash))
+        hashes[directory] = digest.digest()
+
+    for path, entry in incarnation.entries.items():
+        hashes.setdefault(path, entry.digest)
+    return MerkleTree(hashes, children)
+
+
+def changed_subtrees(old_tree: MerkleTree, new_tree: MerkleTree) -> set[Path]:
+    """Get the paths of all entries and directories which hashes differ between the two trees.
+
+    Only the directories which hashes differ are descended into.
+    The result is empty if the root hashes match.
+    """
+    changed: set[Path] = set()
+    pending = [ROOT]
+    while pending:
+        path = pending.pop()
+        if old_tree.hashes.get(path) == new_tree.hashes.get(path):
+            continue
+        changed.add(path)
+        pending.extend(old_tree.children.get(path, []))
+        pending.extend(new_tree.children.get(path, []))
+    return changed
+
+
+def prune_unchanged_subtrees(
+    old_incarnation: InMemorySink, new_incarnation: InMemorySink
+) -> tuple[InMemorySink, InMemorySink] | None:
+    """Reduce two rendered incarnations to the subtrees which differ between them.
+
+    Returns `None` if the incarnations are identical, otherwise the two incarnations
+    holding only the changed entries, which are the only ones a diff can consist of.
+    """
+    changed = changed_subtrees(build_merkle_tree(old_incarnation), build_merkle_tree(new_incarnation))
+    if not changed:
+        return None
+    return _select_entries(old_incarnation, changed), _select_entries(new_incarnation, changed)
+
+
+def _select_entries(incarnation: InMemorySink, paths: set[Path]) -> InMemorySink:
+    entries: dict[Path, InMemoryEntry] = {p: e for p, e in incarnation.entries.items() if p in paths}
+    return InMemorySink(entries)
@@ -1,4 +1,5 @@
 import copy
+import io
 from dataclasses import asdict, dataclass
 from pathlib import Path
 
@@ -44,10 +45,15 @@ class IncarnationState:
 
 
 def save_incarnation_state(incarnation_state_path: Path, incarnation_state: IncarnationState) -> None:
-    with incarnation_state_path.open("w") as f:
+    incarnation_state_path.write_text(dump_incarnation_state(incarnation_state))
+
+
+def dump_incarnation_state(incarnation_state: IncarnationState) -> str:
+    with io.StringIO() as f:
         f.write("# This file is auto-generated and owned by foxops.\n")
         f.write("# DO NOT EDIT MANUALLY.\n")
         yaml.dump(asdict(incarnation_state), f)
+        return f.getvalue()
 
 
 def load_incarnation_state(incarnation_state_path: Path) -> IncarnationState:
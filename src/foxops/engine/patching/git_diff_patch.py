@@ -1,102 +1,136 @@
-import filecmp
-import os
+import asyncio
+import contextlib
 import re
-import shutil
 import typing
 from contextlib import asynccontextmanager
 from pathlib import Path
-from tempfile import TemporaryDirectory, mkstemp
+from tempfile import TemporaryDirectory
 
-from foxops.external.git import GitRepository
+from foxops.engine.manifest import TemplateEntryType, scan_template
+from foxops.engine.patching.git_objects import GitFastImport, GitTreeSink
+from foxops.engine.patching.rejections import analyze_rejections
+from foxops.engine.sinks import InMemorySink, RenderSink
 from foxops.logger import get_logger
 from foxops.utils import CalledProcessError, check_call
 
 #: Holds the module logger
 logger = get_logger(__name__)
 
+#: Holds the maximum number of bytes of a patch which are held in memory at once
+_PATCH_CHUNK_SIZE = 64 * 1024
+
 
 async def diff_and_patch(
-    diff_a_directory: Path,
-    diff_b_directory: Path,
+    diff_a_directory: Path | InMemorySink,
+    diff_b_directory: Path | InMemorySink,
     patch_directory: Path,
 ) -> list[Path] | None:
-    if (patch_path := await diff(diff_a_directory, diff_b_directory)) is not None:
-        try:
-            return await patch(
-                patch_path,
-                patch_directory,
-                diff_b_directory,
-            )
-        finally:
-            patch_path.unlink()
-    return None
+    """Diff two rendered incarnations and apply the changes to the incarnation in `patch_directory`.
+
+    The rendered incarnations may either be directories or held in memory.
+    The diff is streamed into `git apply` while it's created, see `patch`.
+    """
+    async with setup_diff_git_repository(diff_a_directory, diff_b_directory) as git_tmpdir:
+        logger.debug(f"create git diff between branch old and new in {git_tmpdir}")
+        return await patch(
+            stream_git_output("--no-pager", "diff", "old..new", expected_returncodes=frozenset({0, 1}), cwd=git_tmpdir),
+            patch_directory,
+            diff_b_directory,
+            diff_a_directory,
+        )
+
+
+async def stream_git_output(
+    *args: str,
+    expected_returncodes: frozenset[int] = frozenset({0}),
+    **kwargs: typing.Any,
+) -> typing.AsyncIterator[bytes]:
+    """Run git with the given arguments and yield its output in chunks of up to `_PATCH_CHUNK_SIZE` bytes.
+
+    The exit code is checked once the entire output has been consumed.
+    If the output isn't consumed entirely, the git process is killed.
+    """
+    cmdline = ["git", *args]
+    proc = await asyncio.create_subprocess_exec(
+        *cmdline,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        **kwargs,
+    )
+    assert proc.stdout is not None and proc.stderr is not None
+    # NOTE: stderr is read concurrently, otherwise git may block writing to it while stdout is consumed.
+    stderr_task = asyncio.ensure_future(proc.stderr.read())
+    completed = False
+    try:
+        while chunk := await proc.stdout.read(_PATCH_CHUNK_SIZE):
+            yield chunk
+        completed = True
+    finally:
+        if not completed:
+            with contextlib.suppress(ProcessLookupError):
+                proc.kill()
+            await proc.wait()
+            stderr_task.cancel()
+
+    stderr = await stderr_task
+    await proc.wait()
+    if proc.returncode not in expected_returncodes:
+        raise CalledProcessError(proc.returncode if proc.returncode is not None else -1, cmdline, b"", stderr)
 
 
 @asynccontextmanager
-async def setup_diff_git_repository(old_directory: Path, new_directory: Path) -> typing.AsyncGenerator[Path, None]:
-    # FIXME(TF): in case the *git way* provides as the viable long-term solution we could directly
-    #            bootstrap that intermediate git repository instead of this copy-paste roundtrip.
+async def setup_diff_git_repository(
+    old_directory: Path | InMemorySink, new_directory: Path | InMemorySink
+) -> typing.AsyncGenerator[Path, None]:
+    """Set up a scratch git repository with the branches `old` and `new` holding the given incarnations.
+
+    The incarnations are written straight into the object database with `git fast-import`,
+    without copying them into a working directory and updating an index.
+    """
     git_tmpdir: str
     with TemporaryDirectory() as git_tmpdir:
-        await check_call("git", "init", ".", "--initial-branch", "main", cwd=git_tmpdir)
-        await check_call(
-            "git",
-            "config",
-            "user.name",
-            "fengine",
-            cwd=git_tmpdir,
-        )
-        await check_call(
-            "git",
-            "config",
-            "user.email",
-            "noreply@fengine.io",
-            cwd=git_tmpdir,
-        )
-        await check_call(
-            "git",
-            "commit",
-            "--allow-empty",
-            "-m",
-            "empty initial commit",
-            cwd=git_tmpdir,
-        )
-        await check_call("git", "switch", "--create", "old", "main", cwd=git_tmpdir)
-        shutil.copytree(old_directory, git_tmpdir, dirs_exist_ok=True)
-        await check_call("git", "add", ".", cwd=git_tmpdir)
-        await check_call("git", "commit", "-m", "old template status", cwd=git_tmpdir)
-        await check_call("git", "switch", "--create", "new", "main", cwd=git_tmpdir)
-        shutil.copytree(new_directory, git_tmpdir, dirs_exist_ok=True)
-        await check_call("git", "add", ".", cwd=git_tmpdir)
-        await check_call("git", "commit", "-m", "new template status", cwd=git_tmpdir)
+        await check_call("git", "init", "--bare", "--quiet", ".", cwd=git_tmpdir)
+        async with GitFastImport(Path(git_tmpdir)) as fast_import:
+            for ref, rendered_incarnation in [("refs/heads/old", old_directory), ("refs/heads/new", new_directory)]:
+                sink = GitTreeSink(fast_import, ref)
+                await _write_rendered_incarnation(rendered_incarnation, sink)
+                tree = await sink.write_tree()
+                logger.debug(f"wrote rendered incarnation to {ref} with tree {tree}")
 
         yield Path(git_tmpdir)
 
 
-async def diff(old_directory: Path, new_directory: Path) -> Path | None:
-    async with setup_diff_git_repository(old_directory, new_directory) as git_tmpdir:
-        logger.debug(f"create git diff between branch old and new in {git_tmpdir}")
+async def _write_rendered_incarnation(rendered_incarnation: Path | InMemorySink, sink: RenderSink) -> None:
+    if isinstance(rendered_incarnation, InMemorySink):
+        await rendered_incarnation.replay(sink)
+        return
 
-        repo = GitRepository(git_tmpdir)
-        diff_output = await repo.diff("old", "new")
+    for entry in await asyncio.to_thread(scan_template, rendered_incarnation, []):
+        if entry.type is TemplateEntryType.SYMLINK:
+            await sink.write_symlink(entry.path, typing.cast(str, entry.symlink_target), entry.mode)
+        elif entry.type is TemplateEntryType.FILE:
+            await sink.copy_file(entry.path, rendered_incarnation / entry.path, entry.mode)
 
-        if diff_output == "":
-            logger.info("The update didn't change anything, no patch to create")
-            return None
 
-        logger.debug("create patch from git diff", diff_output=diff_output)
-        fd, patch_path = mkstemp(prefix="fengine-update-", suffix=".patch")
-        os.close(fd)
+async def patch(
+    diff_output: bytes | typing.AsyncIterable[bytes],
+    incarnation_root_dir: Path,
+    rendered_updated_template_directory: Path | InMemorySink,
+    rendered_pristine_template_directory: Path | InMemorySink | None = None,
+) -> list[Path] | None:
+    """Apply a patch to an incarnation with `git apply --reject`.
 
-        (p := Path(patch_path)).write_text(diff_output)
-        return p
+    The patch is piped into `git apply` chunk by chunk as it's produced, e.g. by `stream_git_output`,
+    thus, it's never held in memory entirely nor written to a file.
+    The rejections are analyzed afterwards, see `analyze_rejections`.
 
+    Returns `None` if the patch is empty, otherwise the files which have conflicts.
+    """
+    chunks = aiter(_iterate_chunks(diff_output) if isinstance(diff_output, bytes) else diff_output)
+    if not (first_chunk := await anext(chunks, b"")):
+        logger.info("The update didn't change anything, no patch to apply")
+        return None
 
-async def patch(
-    patch_path: Path,
-    incarnation_root_dir: Path,
-    rendered_updated_template_directory: Path,
-) -> list[Path]:
     # NOTE(TF): it's crucial that the paths are fully resolved here,
     #           because we are going to fiddle around how they
     #           are relative to each other.
@@ -110,86 +144,109 @@ async def patch(
     )
 
     # FIXME(TF): may check git status to check if something has been modified or not ...
-    logger.debug(f"applying patch {patch_path} to {incarnation_subdir} inside {incarnation_root_dir}")
+    logger.debug(f"applying patch to {incarnation_subdir} inside {incarnation_root_dir}")
+    # The `--reject` option makes it apply the parts of the patch that are applicable,
+    # and leave the rejected hunks in corresponding *.rej files.
+    git_apply_options = [
+        "--reject",
+        "--verbose",
+    ]
+    if incarnation_subdir is not None:
+        git_apply_options.extend(["--directory", str(incarnation_subdir)])
+
+    apply_proc = await asyncio.create_subprocess_exec(
+        "git",
+        "apply",
+        *git_apply_options,
+        "-",
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE,
+        cwd=str(incarnation_repository_dir),
+    )
+    assert apply_proc.stdin is not None and apply_proc.stderr is not None
+    stderr_task = asyncio.ensure_future(apply_proc.stderr.read())
     try:
-        # The `--reject` option makes it apply the parts of the patch that are applicable,
-        # and leave the rejected hunks in corresponding *.rej files.
-        git_apply_options = [
-            "--reject",
-            "--verbose",
-        ]
-        if incarnation_subdir is not None:
-            git_apply_options.extend(["--directory", str(incarnation_subdir)])
-
-        await check_call(
-            "git",
-            "apply",
-            *git_apply_options,
-            str(patch_path),
-            cwd=str(incarnation_repository_dir),
-        )
-    except CalledProcessError as exc:
+        await _write_chunks(apply_proc.stdin, first_chunk, chunks)
+    except BaseException:
+        # NOTE: the patch is incomplete, e.g. because its producer failed. `git apply` is killed
+        #       before its input is closed, so that it never applies a truncated patch.
+        with contextlib.suppress(ProcessLookupError):
+            apply_proc.kill()
+        await apply_proc.wait()
+        stderr_task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await stderr_task
+        raise
+    finally:
+        apply_proc.stdin.close()
+    apply_rejection_output = await stderr_task
+    await apply_proc.wait()
+
+    if apply_proc.returncode != 0:
         logger.debug(
             "detected conflicts with patch, analyzing rejections ...",
-            patch_path=patch_path,
-            exc=exc,
+            returncode=apply_proc.returncode,
         )
-        apply_rejection_output = exc.stderr
         files_with_conflicts = await analyze_patch_rejections(
             apply_rejection_output,
             incarnation_repository_dir,
             incarnation_subdir,
             rendered_updated_template_directory,
+            rendered_pristine_template_directory,
         )
         return files_with_conflicts
     else:
         return []
 
 
+async def _iterate_chunks(content: bytes) -> typing.AsyncIterator[bytes]:
+    for offset in range(0, len(content), _PATCH_CHUNK_SIZE):
+        yield content[offset : offset + _PATCH_CHUNK_SIZE]
+
+
+async def _write_chunks(stdin: asyncio.StreamWriter, first_chunk: bytes, chunks: typing.AsyncIterator[bytes]) -> None:
+    try:
+        stdin.write(first_chunk)
+        await stdin.drain()
+        async for chunk in chunks:
+            stdin.write(chunk)
+            await stdin.drain()
+    except (BrokenPipeError, ConnectionResetError):
+        # NOTE: `git apply` stopped reading the patch, e.g. because it's corrupt.
+        #       The patch is still consumed, so that its producer finishes.
+        async for _ in chunks:
+            pass
+
+
 async def analyze_patch_rejections(
     apply_rejection_output: bytes,
     incarnation_repository_dir: Path,
     incarnation_subdir: Path | None,
-    rendered_updated_template_directory: Path,
+    rendered_updated_template_directory: Path | InMemorySink,
+    rendered_pristine_template_directory: Path | InMemorySink | None = None,
 ) -> list[Path]:
+    """Analyze the rejections of `git apply --reject`, see `analyze_rejections`.
+
+    Returns the files which still have conflicts, relative to the repository root.
+    """
     if incarnation_subdir is None:
         incarnation_dir = incarnation_repository_dir
     else:
         incarnation_dir = incarnation_repository_dir / incarnation_subdir
 
-    files_with_conflicts: list[Path] = []
-    for file_with_rejection in parse_git_apply_rejection_output(apply_rejection_output):
-        conflict_fixed = await attempt_fixing_rejection(
-            (incarnation_repository_dir / file_with_rejection).relative_to(incarnation_dir),
-            incarnation_dir,
-            rendered_updated_template_directory,
-        )
-        if not conflict_fixed:
-            logger.debug(f"file {file_with_rejection} still has conflicts")
-            files_with_conflicts.append(file_with_rejection)
-    return files_with_conflicts
-
-
-async def attempt_fixing_rejection(
-    file_with_rejection: Path,
-    patch_directory: Path,
-    diff_b_directory: Path,
-) -> bool:
-    diff_b_file = diff_b_directory / file_with_rejection
-    patch_file = patch_directory / file_with_rejection
-
-    logger.debug(f"attempting to fix rejection for file {file_with_rejection} ...")
-
-    if filecmp.cmp(diff_b_file, patch_file, shallow=True):
-        # the rejected hunk tried to apply a change which was already applied,
-        # we can safely remove the rejection file.
-        (patch_file.with_suffix(patch_file.suffix + ".rej")).unlink()
-        logger.debug(
-            f"the rejection was caused because the two files are identical, mark {file_with_rejection} as fixed"
-        )
-        return True
-
-    return False
+    file_rejections = await analyze_rejections(
+        [
+            (incarnation_repository_dir / file_with_rejection).relative_to(incarnation_dir)
+            for file_with_rejection in parse_git_apply_rejection_output(apply_rejection_output)
+        ],
+        incarnation_dir,
+        rendered_updated_template_directory,
+        rendered_pristine_template_directory,
+    )
+    return [
+        (incarnation_dir / r.path).relative_to(incarnation_repository_dir) for r in file_rejections if not r.resolved
+    ]
 
 
 def parse_git_apply_rejection_output(output: bytes) -> list[Path]:
@@ -0,0 +1,153 @@
+import asyncio
+import contextlib
+import os
+import typing
+import uuid
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from foxops.engine.patching.git_diff_patch import patch, stream_git_output
+from foxops.engine.patching.git_objects import GitFastImport, GitTreeSink
+from foxops.engine.sinks import InMemorySink
+from foxops.logger import get_logger
+from foxops.utils import CalledProcessError
+
+#: Holds the module logger
+logger = get_logger(__name__)
+
+#: Holds the number of diffs after which the scratch object store is replaced by an empty one
+SCRATCH_OBJECT_STORE_MAX_DIFFS = 256
+
+
+class ScratchObjectStore:
+    """A bare git repository the rendered incarnations are written into as tree objects.
+
+    A store is shared by all diffs of a process, so that identical files (e.g. the
+    ones which didn't change between two template versions) are only hashed and stored once.
+    As the objects of a store are never pruned, it's retired after `max_diffs` diffs and
+    removed as soon as the last diff using it finished, see `get_scratch_object_store`.
+
+    A store must be created with `create`, which initializes its repository.
+    """
+
+    def __init__(self, max_diffs: int = SCRATCH_OBJECT_STORE_MAX_DIFFS):
+        self._tmpdir = TemporaryDirectory(prefix="fengine-objects-")
+        self.git_dir = Path(self._tmpdir.name)
+        self.max_diffs = max_diffs
+        self._diffs = 0
+        self._in_flight = 0
+
+    @classmethod
+    async def create(cls, max_diffs: int = SCRATCH_OBJECT_STORE_MAX_DIFFS) -> "ScratchObjectStore":
+        """Create a store with an empty bare repository."""
+        store = cls(max_diffs)
+        await store._git("init", "--bare", "--quiet")
+        return store
+
+    @property
+    def retired(self) -> bool:
+        return self._diffs >= self.max_diffs
+
+    @contextlib.contextmanager
+    def use(self) -> typing.Iterator[Path]:
+        """Use the store for a single diff and yield its git directory."""
+        self._diffs += 1
+        self._in_flight += 1
+        try:
+            yield self.git_dir
+        finally:
+            self._in_flight -= 1
+            if self.retired and self._in_flight == 0:
+                self._tmpdir.cleanup()
+
+    async def write_tree(self, rendered_incarnation: Path | InMemorySink) -> str:
+        """Write a rendered incarnation as tree object into the store and return its SHA.
+
+        A directory is added to a temporary index with the directory as work tree, without copying it.
+        An in-memory rendering is streamed into the store with `git fast-import`.
+        """
+        if isinstance(rendered_incarnation, InMemorySink):
+            ref = f"refs/fengine/{uuid.uuid4().hex}"
+            async with GitFastImport(self.git_dir) as fast_import:
+                sink = GitTreeSink(fast_import, ref)
+                await rendered_incarnation.replay(sink)
+                tree = await sink.write_tree()
+            await self._git("update-ref", "-d", ref)
+            return tree
+
+        index_file = self.git_dir / f"index-{uuid.uuid4().hex}"
+        try:
+            env = {**os.environ, "GIT_WORK_TREE": str(rendered_incarnation), "GIT_INDEX_FILE": str(index_file)}
+            # NOTE: files ignored by a `.gitignore` of the incarnation are part of the incarnation, too.
+            await self._git("add", "--all", "--force", env=env)
+            return (await self._git("write-tree", env=env)).decode("utf-8").strip()
+        finally:
+            index_file.unlink(missing_ok=True)
+
+    def diff_trees(self, old_tree: str, new_tree: str) -> typing.AsyncIterator[bytes]:
+        """Stream the patch between two trees of the store, in a format `git apply` understands."""
+        return stream_git_output(
+            "diff-tree",
+            "-p",
+            "--binary",
+            "--full-index",
+            "--no-renames",
+            old_tree,
+            new_tree,
+            env={**os.environ, "GIT_DIR": str(self.git_dir)},
+        )
+
+    async def _git(self, *args: str, env: dict[str, str] | None = None) -> bytes:
+        cmdline = ["git", "-c", "core.autocrlf=false", *args]
+        proc = await asyncio.create_subprocess_exec(
+            *cmdline,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            env={**(env if env is not None else os.environ), "GIT_DIR": str(self.git_dir)},
+        )
+        stdout, stderr = await proc.communicate()
+        if proc.returncode != 0:
+            raise CalledProcessError(proc.returncode if proc.returncode is not None else -1, cmdline, stdout, stderr)
+        return stdout
+
+
+#: Holds the scratch object store of the process
+_scratch_object_store: ScratchObjectStore | None = None
+
+
+async def get_scratch_object_store() -> ScratchObjectStore:
+    """Get the scratch object store shared by all diffs of the process.
+
+    A new store is created once the current one is retired.
+    """
+    global _scratch_object_store
+    if _scratch_object_store is None or _scratch_object_store.retired:
+        store = await ScratchObjectStore.create()
+        # NOTE: a concurrent diff may have replaced the retired store while this one has been created.
+        if _scratch_object_store is None or _scratch_object_store.retired:
+            _scratch_object_store = store
+        else:
+            store._tmpdir.cleanup()
+    return _scratch_object_store
+
+
+async def index_diff_and_patch(
+    diff_a_directory: Path | InMemorySink,
+    diff_b_directory: Path | InMemorySink,
+    patch_directory: Path,
+) -> list[Path] | None:
+    """Diff two rendered incarnations as git trees and apply the changes to the incarnation in `patch_directory`.
+
+    Both incarnations are written as tree objects into the scratch object store, see `ScratchObjectStore`.
+    Unlike `diff_and_patch`, no repository is set up per update.
+    """
+    store = await get_scratch_object_store()
+    with store.use():
+        old_tree = await store.write_tree(diff_a_directory)
+        new_tree = await store.write_tree(diff_b_directory)
+        if old_tree == new_tree:
+            logger.info("The update didn't change anything, no patch to create")
+            return None
+
+        logger.debug(f"create patch between tree {old_tree} and {new_tree}")
+        return await patch(store.diff_trees(old_tree, new_tree), patch_directory, diff_b_directory, diff_a_directory)
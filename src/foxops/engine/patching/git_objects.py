@@ -0,0 +1,149 @@
+import asyncio
+import stat
+import typing
+from pathlib import Path
+
+from foxops.utils import CalledProcessError, check_call
+
+#: Holds the committer used for the commits created by `GitFastImport`
+_COMMITTER = b"fengine <noreply@fengine.io> now"
+#: Holds the git mode of symlinks
+_GIT_SYMLINK_MODE = b"120000"
+
+
+class GitFastImport:
+    """A long-lived `git fast-import` process writing objects into a git repository.
+
+    Blobs are streamed to the process as soon as they are written, without any
+    working directory or index involved. Multiple `GitTreeSink`s may share a single process.
+
+    Use it as an async context manager, the process is terminated when leaving the context.
+    """
+
+    def __init__(self, git_dir: Path):
+        self.git_dir = git_dir
+        self._process: asyncio.subprocess.Process | None = None
+        self._last_mark = 0
+        self._lock = asyncio.Lock()
+
+    async def __aenter__(self) -> "GitFastImport":
+        self._process = await asyncio.create_subprocess_exec(
+            "git",
+            "fast-import",
+            "--quiet",
+            "--date-format=now",
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            cwd=self.git_dir,
+        )
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        await self.close()
+
+    @property
+    def _stdin(self) -> asyncio.StreamWriter:
+        if self._process is None or self._process.stdin is None:
+            raise RuntimeError("git fast-import is not running")
+        return self._process.stdin
+
+    async def write_blob(self, content: bytes) -> int:
+        """Write a blob and return the fast-import mark referring to it."""
+        self._last_mark += 1
+        mark = self._last_mark
+        # NOTE: the command is written at once, thus, concurrent writers don't interleave.
+        self._stdin.writelines([b"blob\nmark :%d\ndata %d\n" % (mark, len(content)), content, b"\n"])
+        await self._drain()
+        return mark
+
+    async def commit(self, ref: str, files: dict[Path, tuple[bytes, int]]) -> str:
+        """Commit the given files to `ref` and return the SHA of the resulting tree.
+
+        :param files: Maps the paths of the tree to their git mode and the mark of their blob.
+        """
+        commands = [b"commit %s\ncommitter %s\ndata 0\n" % (ref.encode(), _COMMITTER)]
+        commands.extend(
+            b"M %s :%d %s\n" % (git_mode, mark, _quote_path(path)) for path, (git_mode, mark) in files.items()
+        )
+        # NOTE: the progress message is echoed once the checkpoint has updated the ref.
+        commands.append(b"\ncheckpoint\nprogress %s\n" % ref.encode())
+        async with self._lock:
+            self._stdin.writelines(commands)
+            await self._stdin.drain()
+            assert self._process is not None and self._process.stdout is not None
+            if not await self._process.stdout.readline():
+                await self.close()
+                raise RuntimeError("git fast-import stopped unexpectedly")
+
+        proc = await check_call("git", "rev-parse", f"{ref}^{{tree}}", cwd=self.git_dir)
+        return (await proc.stdout.read()).decode("utf-8").strip()  # type: ignore
+
+    async def close(self) -> None:
+        if self._process is None:
+            return
+        process, self._process = self._process, None
+        try:
+            process.stdin.close()  # type: ignore
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        stdout, stderr = await process.communicate()
+        if process.returncode != 0:
+            raise CalledProcessError(
+                process.returncode if process.returncode is not None else -1,
+                ["git", "fast-import"],
+                stdout,
+                stderr,
+            )
+
+    async def _drain(self) -> None:
+        # NOTE: concurrent `drain()` calls on the same stream are not supported on all Python versions.
+        async with self._lock:
+            await self._stdin.drain()
+
+
+class GitTreeSink:
+    """Write the rendered entries as blobs into a git repository and build a tree from them.
+
+    Git doesn't track directories, thus, empty directories are not part of the tree.
+    Only the executable bit of the file modes is kept, like git does.
+    """
+
+    def __init__(self, fast_import: GitFastImport, ref: str):
+        self.fast_import = fast_import
+        self.ref = ref
+        self._files: dict[Path, tuple[bytes, int]] = {}
+
+    async def write_directory(self, path: Path, mode: int) -> None:
+        pass
+
+    async def write_file(self, path: Path, content: str | bytes, mode: int) -> None:
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        mark = await self.fast_import.write_blob(content)
+        self._files[path] = (b"100755" if mode & stat.S_IXUSR else b"100644", mark)
+
+    async def write_file_chunks(self, path: Path, chunks: typing.AsyncIterator[str], mode: int) -> None:
+        await self.write_file(path, "".join([c async for c in chunks]), mode)
+
+    async def copy_file(self, path: Path, source: Path, mode: int) -> None:
+        await self.write_file(path, await asyncio.to_thread(source.read_bytes), mode)
+
+    async def write_symlink(self, path: Path, target: str, mode: int) -> None:
+        mark = await self.fast_import.write_blob(target.encode("utf-8"))
+        self._files[path] = (_GIT_SYMLINK_MODE, mark)
+
+    async def flush(self) -> None:
+        pass
+
+    async def write_tree(self) -> str:
+        """Commit all written entries to the `ref` of this sink and return the SHA of the tree."""
+        return await self.fast_import.commit(self.ref, self._files)
+
+
+def _quote_path(path: Path) -> bytes:
+    """Quote a path for the fast-import stream, if necessary."""
+    raw_path = path.as_posix()
+    if raw_path.startswith('"') or "\n" in raw_path:
+        raw_path = '"' + raw_path.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+    return raw_path.encode("utf-8")
@@ -0,0 +1,107 @@
+import difflib
+import re
+import typing
+from dataclasses import dataclass
+
+from foxops.engine.patching.merge import split_lines
+
+#: Holds the number of context lines around the changes of a hunk, the same as git uses by default
+_CONTEXT_LINES = 3
+#: Matches the header of a hunk, capturing the start of the old and the new range
+_HUNK_HEADER_REGEX = re.compile(rb"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+#: Holds the marker git appends to a line which doesn't end with a line feed
+_NO_NEWLINE_MARKER = b"\\ No newline at end of file"
+
+
+@dataclass(frozen=True)
+class Hunk:
+    """Represents a hunk of a unified diff between the lines of two files."""
+
+    #: Holds the index of the first line of the hunk in the old file
+    old_start: int
+    #: Holds the index of the first line of the hunk in the new file
+    new_start: int
+    #: Holds the lines of the hunk, each prefixed with ` ` (context), `-` (removed) or `+` (added)
+    lines: list[bytes]
+
+    @property
+    def old_lines(self) -> list[bytes]:
+        return [line[1:] for line in self.lines if line[:1] != b"+"]
+
+    @property
+    def new_lines(self) -> list[bytes]:
+        return [line[1:] for line in self.lines if line[:1] != b"-"]
+
+    @property
+    def leading_context(self) -> int:
+        return next((i for i, line in enumerate(self.lines) if line[:1] != b" "), len(self.lines))
+
+    @property
+    def trailing_context(self) -> int:
+        return next((i for i, line in enumerate(reversed(self.lines)) if line[:1] != b" "), len(self.lines))
+
+    def to_bytes(self) -> bytes:
+        old_lines, new_lines = self.old_lines, self.new_lines
+        chunks = [
+            b"@@ -%s +%s @@\n"
+            % (
+                _hunk_range(self.old_start, self.old_start + len(old_lines)),
+                _hunk_range(self.new_start, self.new_start + len(new_lines)),
+            )
+        ]
+        for line in self.lines:
+            chunks.append(line)
+            if not line.endswith(b"\n"):
+                chunks.append(b"\n\\ No newline at end of file\n")
+        return b"".join(chunks)
+
+
+def unified_hunks(old_lines: list[bytes], new_lines: list[bytes]) -> typing.Iterator[Hunk]:
+    """Compute the hunks of a unified diff between two lists of lines, with the same context as git."""
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    for group in matcher.get_grouped_opcodes(_CONTEXT_LINES):
+        lines: list[bytes] = []
+        for tag, i1, i2, j1, j2 in group:
+            if tag == "equal":
+                lines.extend(b" " + line for line in old_lines[i1:i2])
+                continue
+            lines.extend(b"-" + line for line in old_lines[i1:i2])
+            lines.extend(b"+" + line for line in new_lines[j1:j2])
+        yield Hunk(group[0][1], group[0][3], lines)
+
+
+def _hunk_range(start: int, stop: int) -> bytes:
+    length = stop - start
+    if length == 1:
+        return b"%d" % (start + 1)
+    if length == 0:
+        return b"%d,0" % start
+    return b"%d,%d" % (start + 1, length)
+
+
+def parse_hunks(patch: bytes) -> list[Hunk]:
+    """Parse the hunks of a patch of a single file, e.g. of a `.rej` file written by `git apply --reject`.
+
+    Lines outside of hunks (like the `diff` header) are ignored.
+    """
+    hunks: list[Hunk] = []
+    for line in split_lines(patch):
+        if match := _HUNK_HEADER_REGEX.match(line):
+            old_start, old_length, new_start, new_length = match.groups()
+            hunks.append(
+                Hunk(
+                    _range_start(int(old_start), old_length),
+                    _range_start(int(new_start), new_length),
+                    [],
+                )
+            )
+        elif hunks and line.startswith(_NO_NEWLINE_MARKER) and hunks[-1].lines:
+            hunks[-1].lines[-1] = hunks[-1].lines[-1].removesuffix(b"\n")
+        elif hunks and line[:1] in (b" ", b"-", b"+"):
+            hunks[-1].lines.append(line)
+    return hunks
+
+
+def _range_start(start: int, length: bytes | None) -> int:
+    # NOTE: the start of an empty range is the line before it, see `_hunk_range`.
+    return start if length == b"0" else start - 1
@@ -0,0 +1,239 @@
+import asyncio
+import os
+import stat
+import typing
+from pathlib import Path
+
+from foxops.engine.patching.hunks import Hunk, unified_hunks
+from foxops.engine.patching.merge import is_binary, split_lines
+from foxops.engine.patching.rejections import analyze_rejections
+from foxops.engine.patching.tree_diff import GitFile, is_symlink, read_git_files
+from foxops.engine.sinks import InMemorySink
+from foxops.logger import get_logger
+
+#: Holds the module logger
+logger = get_logger(__name__)
+
+#: Holds the git mode of executable files
+_GIT_EXECUTABLE_MODE = b"100755"
+
+
+async def inprocess_diff_and_patch(
+    diff_a_directory: Path | InMemorySink,
+    diff_b_directory: Path | InMemorySink,
+    patch_directory: Path,
+) -> list[Path] | None:
+    """Diff two rendered incarnations and apply the changes to the incarnation in `patch_directory`, in-process.
+
+    No git process is spawned, the file-level diffs are applied like `git apply --reject` does, see `apply_tree_diff`.
+    Thus, the rejected hunks are written to `.rej` files and the files with conflicts are
+    returned relative to the root of the repository the incarnation is in, like `diff_and_patch` does.
+    """
+    old_files, new_files = await read_git_files(diff_a_directory), await read_git_files(diff_b_directory)
+
+    incarnation_dir = patch_directory.resolve()
+    incarnation_repository_dir = find_repository_root(incarnation_dir)
+    incarnation_subdir = incarnation_dir.relative_to(incarnation_repository_dir)
+
+    files_with_rejections = await asyncio.to_thread(
+        apply_tree_diff, old_files, new_files, incarnation_dir, incarnation_subdir
+    )
+    if files_with_rejections is None:
+        logger.info("The update didn't change anything, no patch to apply")
+        return None
+
+    file_rejections = await analyze_rejections(
+        files_with_rejections, incarnation_dir, diff_b_directory, diff_a_directory
+    )
+    return [incarnation_subdir / r.path for r in file_rejections if not r.resolved]
+
+
+def find_repository_root(directory: Path) -> Path:
+    """Find the root directory of the git repository the given (resolved) directory is in.
+
+    Like `git rev-parse --show-toplevel`, but without running git.
+    If the directory isn't in a git repository, the directory itself is returned.
+    """
+    for candidate in [directory, *directory.parents]:
+        if (candidate / ".git").exists():
+            return candidate
+    return directory
+
+
+def apply_tree_diff(
+    old_files: dict[Path, GitFile],
+    new_files: dict[Path, GitFile],
+    directory: Path,
+    repository_subdir: Path = Path("."),
+) -> list[Path] | None:
+    """Apply the changes between two sets of files, see `read_git_files`, to the files in `directory`.
+
+    The changes are applied with the same semantics as `git apply --reject`:
+
+    * hunks are searched around their original position and applied if their context matches exactly,
+      otherwise they are written to a `.rej` file next to the file.
+    * files which don't meet the preconditions of their change (e.g. a new file which already exists,
+      a changed file which is missing or a deleted file which has been modified) are left untouched.
+    * binary files are only changed if they are identical to the old file.
+
+    Returns `None` if there are no changes, otherwise the paths of the files with rejected hunks.
+    The `repository_subdir` is the path of `directory` in its repository, it's used in the `.rej` files.
+    """
+    files_with_rejections: list[Path] = []
+    changed = False
+    for path in sorted(old_files.keys() | new_files.keys()):
+        old_file = old_files.get(path)
+        new_file = new_files.get(path)
+        if old_file == new_file:
+            continue
+
+        changed = True
+        if old_file is None:
+            _create_file(directory / path, typing.cast(GitFile, new_file))
+        elif new_file is None:
+            _delete_file(directory, path, old_file)
+        elif is_symlink(old_file) != is_symlink(new_file):
+            if _delete_file(directory, path, old_file):
+                _create_file(directory / path, new_file)
+        elif not _modify_file(directory / path, old_file, new_file, repository_subdir / path):
+            files_with_rejections.append(path)
+    return files_with_rejections if changed else None
+
+
+def _read_current_content(file: Path, old_file: GitFile) -> bytes | None:
+    try:
+        file_stat = file.lstat()
+    except FileNotFoundError:
+        logger.warning(f"{file} doesn't exist in the incarnation, the change isn't applied")
+        return None
+    if is_symlink(old_file) != stat.S_ISLNK(file_stat.st_mode) or not (
+        stat.S_ISLNK(file_stat.st_mode) or stat.S_ISREG(file_stat.st_mode)
+    ):
+        logger.warning(f"{file} has the wrong type in the incarnation, the change isn't applied")
+        return None
+    return os.readlink(file).encode("utf-8") if is_symlink(old_file) else file.read_bytes()
+
+
+def _create_file(file: Path, new_file: GitFile) -> None:
+    if os.path.lexists(file):
+        logger.warning(f"{file} already exists in the incarnation, it isn't created")
+        return
+    file.parent.mkdir(parents=True, exist_ok=True)
+    _write_file(file, new_file)
+
+
+def _delete_file(directory: Path, path: Path, old_file: GitFile) -> bool:
+    file = directory / path
+    if (current_content := _read_current_content(file, old_file)) is None:
+        return False
+    if current_content != old_file[1]:
+        logger.warning(f"{file} has been modified in the incarnation, it isn't deleted")
+        return False
+    file.unlink()
+    # NOTE: like git, the directories which became empty are removed, too.
+    for parent in path.parents:
+        if parent == Path("."):
+            break
+        try:
+            (directory / parent).rmdir()
+        except OSError:
+            break
+    return True
+
+
+def _modify_file(file: Path, old_file: GitFile, new_file: GitFile, repository_path: Path) -> bool:
+    """Apply the changes of a single file and return `False` if any of its hunks has been rejected."""
+    if (current_content := _read_current_content(file, old_file)) is None:
+        return True
+
+    old_mode, old_content = old_file
+    new_mode, new_content = new_file
+    rejected_hunks: list[Hunk] = []
+    if old_content == new_content:
+        content = current_content
+    elif is_binary(old_content) or is_binary(new_content):
+        if current_content != old_content:
+            logger.warning(f"{file} has been modified in the incarnation, the binary change isn't applied")
+            return True
+        content = new_content
+    else:
+        content, rejected_hunks = apply_hunks(
+            current_content, unified_hunks(split_lines(old_content), split_lines(new_content))
+        )
+
+    if old_mode != new_mode:
+        file.unlink()
+        _write_file(file, (new_mode, content))
+    elif content != current_content:
+        if is_symlink(new_file):
+            file.unlink()
+            file.symlink_to(content.decode("utf-8"))
+        else:
+            file.write_bytes(content)
+
+    if rejected_hunks:
+        file.with_name(file.name + ".rej").write_bytes(
+            b"diff a/%s b/%s\t(rejected hunks)\n" % ((repository_path.as_posix().encode("utf-8"),) * 2)
+            + b"".join(hunk.to_bytes() for hunk in rejected_hunks)
+        )
+        return False
+    return True
+
+
+def _write_file(file: Path, git_file: GitFile) -> None:
+    mode, content = git_file
+    if is_symlink(git_file):
+        file.symlink_to(content.decode("utf-8"))
+        return
+
+    # NOTE: like git, the file is created with the permissions allowed by the umask.
+    fd = os.open(file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o777 if mode == _GIT_EXECUTABLE_MODE else 0o666)
+    with os.fdopen(fd, "wb") as f:
+        f.write(content)
+
+
+def apply_hunks(content: bytes, hunks: typing.Iterable[Hunk]) -> tuple[bytes, list[Hunk]]:
+    """Apply the hunks to the content one after another, like `git apply` does.
+
+    A hunk is searched starting at its position in the new file, alternating backwards and forwards.
+    A hunk at the beginning of the file (or without trailing context) must match at the beginning
+    (or the end) of the content. The context must match exactly, there is no fuzz.
+
+    Returns the patched content and the hunks which couldn't be applied.
+    """
+    image = split_lines(content)
+    rejected_hunks: list[Hunk] = []
+    for hunk in hunks:
+        preimage = hunk.old_lines
+        match_beginning = hunk.old_start == 0
+        match_end = hunk.trailing_context == 0
+        if (position := _find_position(image, preimage, hunk, match_beginning, match_end)) is None:
+            rejected_hunks.append(hunk)
+            continue
+        image[position : position + len(preimage)] = hunk.new_lines
+    return b"".join(image), rejected_hunks
+
+
+def _find_position(
+    image: list[bytes], preimage: list[bytes], hunk: Hunk, match_beginning: bool, match_end: bool
+) -> int | None:
+    def matches(position: int) -> bool:
+        return 0 <= position <= len(image) - len(preimage) and image[position : position + len(preimage)] == preimage
+
+    if match_beginning or match_end:
+        position = 0 if match_beginning else len(image) - len(preimage)
+        if match_end and position + len(preimage) != len(image):
+            return None
+        return position if matches(position) else None
+
+    # NOTE: git starts searching at the line the hunk header gives for the new file.
+    new_position = hunk.new_start + 1 if hunk.new_lines else hunk.new_start
+    line = min(max(new_position - 1, 0), len(image))
+    if matches(line):
+        return line
+    for offset in range(1, max(line, len(image) - line) + 1):
+        if matches(line - offset):
+            return line - offset
+        if matches(line + offset):
+            return line + offset
+    return None
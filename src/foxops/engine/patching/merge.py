@@ -0,0 +1,82 @@
+import difflib
+
+#: Holds the number of leading bytes git looks at to decide whether a file is binary
+_BINARY_DETECTION_SIZE = 8000
+
+
+def merge_file_content(base: bytes, ours: bytes, theirs: bytes) -> bytes | None:
+    """Merge the changes of two versions of a file relative to their common base, like `git merge-file` does.
+
+    Returns the merged content, or `None` if the changes overlap (or any version is binary).
+    """
+    if is_binary(base) or is_binary(ours) or is_binary(theirs):
+        return None
+    merged_lines = merge_lines(split_lines(base), split_lines(ours), split_lines(theirs))
+    return b"".join(merged_lines) if merged_lines is not None else None
+
+
+def merge_lines(base: list[bytes], ours: list[bytes], theirs: list[bytes]) -> list[bytes] | None:
+    """Merge two versions of a list of lines with their common base, using the diff3 algorithm.
+
+    The lines are split into stable chunks (lines of the base matched in both versions) and
+    unstable chunks between them. An unstable chunk changed in only one of the versions (or
+    in the same way in both) is taken from that version, otherwise it's a conflict.
+
+    Returns the merged lines, or `None` if there is a conflict.
+    """
+    ours_matches = _matching_lines(base, ours)
+    theirs_matches = _matching_lines(base, theirs)
+
+    merged: list[bytes] = []
+    base_position = ours_position = theirs_position = 0
+    while True:
+        stable_line = next(
+            (i for i in range(base_position, len(base)) if i in ours_matches and i in theirs_matches), None
+        )
+        if stable_line is None:
+            chunk = _merge_chunk(base[base_position:], ours[ours_position:], theirs[theirs_position:])
+        else:
+            chunk = _merge_chunk(
+                base[base_position:stable_line],
+                ours[ours_position : ours_matches[stable_line]],
+                theirs[theirs_position : theirs_matches[stable_line]],
+            )
+        if chunk is None:
+            return None
+        merged.extend(chunk)
+
+        if stable_line is None:
+            return merged
+        merged.append(base[stable_line])
+        base_position = stable_line + 1
+        ours_position = ours_matches[stable_line] + 1
+        theirs_position = theirs_matches[stable_line] + 1
+
+
+def _matching_lines(base: list[bytes], other: list[bytes]) -> dict[int, int]:
+    matcher = difflib.SequenceMatcher(None, base, other, autojunk=False)
+    return {block.a + i: block.b + i for block in matcher.get_matching_blocks() for i in range(block.size)}
+
+
+def _merge_chunk(base: list[bytes], ours: list[bytes], theirs: list[bytes]) -> list[bytes] | None:
+    if ours == theirs or theirs == base:
+        return ours
+    if ours == base:
+        return theirs
+    return None
+
+
+def split_lines(content: bytes) -> list[bytes]:
+    """Split the content of a file into lines like git does, keeping the line feeds."""
+    # NOTE: `bytes.splitlines()` also splits at carriage returns, git only splits at line feeds.
+    lines = content.split(b"\n")
+    last_line = lines.pop()
+    result = [line + b"\n" for line in lines]
+    if last_line:
+        result.append(last_line)
+    return result
+
+
+def is_binary(content: bytes) -> bool:
+    """Check if git treats the given content as binary, i.e. if there's a NUL byte near its beginning."""
+    return b"\0" in content[:_BINARY_DETECTION_SIZE]
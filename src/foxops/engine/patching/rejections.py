@@ -0,0 +1,153 @@
+import asyncio
+import enum
+from dataclasses import dataclass
+from pathlib import Path
+
+from foxops.engine.patching.hunks import Hunk, parse_hunks
+from foxops.engine.patching.merge import (
+    is_binary,
+    merge_file_content,
+    merge_lines,
+    split_lines,
+)
+from foxops.engine.settings import get_engine_settings
+from foxops.engine.sinks import InMemorySink
+from foxops.logger import get_logger
+
+#: Holds the module logger
+logger = get_logger(__name__)
+
+
+class HunkStatus(enum.Enum):
+    """Represents the outcome of the analysis of a rejected hunk."""
+
+    #: The change of the hunk is already contained in the incarnation file
+    APPLIED = "applied"
+    #: The change of the hunk has been merged into the incarnation file, see `merge_file_content`
+    MERGED = "merged"
+    #: The change of the hunk conflicts with a change of the incarnation file
+    CONFLICT = "conflict"
+
+
+@dataclass(frozen=True)
+class FileRejection:
+    """Represents the analysis of an incarnation file with rejected hunks."""
+
+    #: Holds the path of the file relative to the incarnation directory
+    path: Path
+    #: Holds the status of every rejected hunk of the file, in the order of the `.rej` file
+    hunks: list[HunkStatus]
+    #: Holds whether all rejected hunks of the file have been resolved and its `.rej` file has been removed
+    resolved: bool
+
+
+async def analyze_rejections(
+    files_with_rejections: list[Path],
+    incarnation_dir: Path,
+    rendered_updated_template_directory: Path | InMemorySink,
+    rendered_pristine_template_directory: Path | InMemorySink | None = None,
+) -> list[FileRejection]:
+    """Analyze the rejected hunks of the given files (relative to `incarnation_dir`) in a batch.
+
+    The files are analyzed in parallel, each one in a single job of the thread pool.
+    A rejected hunk is resolved if its change is already contained in the incarnation file, i.e. if the
+    incarnation file is identical to the updated file or merging the change of the hunk alone into the
+    incarnation file doesn't change it, see `merge_lines`. The latter requires the pristine incarnation.
+    If the `three_way_merge` engine setting is enabled and the pristine incarnation is given,
+    the remaining hunks are merged into the incarnation file, if they don't overlap with its changes.
+
+    The `.rej` files of the files whose rejected hunks have all been resolved are removed.
+    """
+    file_rejections = await asyncio.gather(
+        *(
+            asyncio.to_thread(
+                _analyze_rejection,
+                incarnation_dir,
+                path,
+                rendered_updated_template_directory,
+                rendered_pristine_template_directory,
+                get_engine_settings().three_way_merge,
+            )
+            for path in files_with_rejections
+        )
+    )
+    for file_rejection in file_rejections:
+        logger.debug(
+            "analyzed rejected hunks",
+            path=file_rejection.path,
+            hunks=[status.value for status in file_rejection.hunks],
+            resolved=file_rejection.resolved,
+        )
+    return list(file_rejections)
+
+
+def _analyze_rejection(
+    incarnation_dir: Path,
+    path: Path,
+    rendered_updated_template_directory: Path | InMemorySink,
+    rendered_pristine_template_directory: Path | InMemorySink | None,
+    three_way_merge: bool,
+) -> FileRejection:
+    incarnation_file = incarnation_dir / path
+    rejection_file = incarnation_file.with_name(incarnation_file.name + ".rej")
+    current_content = incarnation_file.read_bytes()
+    updated_content = _read_rendered_file(rendered_updated_template_directory, path)
+    hunks = parse_hunks(rejection_file.read_bytes())
+
+    if current_content == updated_content:
+        statuses = [HunkStatus.APPLIED] * len(hunks)
+        resolved = True
+    else:
+        pristine_content = (
+            _read_rendered_file(rendered_pristine_template_directory, path)
+            if rendered_pristine_template_directory is not None
+            else None
+        )
+        if pristine_content is None or is_binary(pristine_content) or is_binary(current_content):
+            statuses = [HunkStatus.CONFLICT] * len(hunks)
+        else:
+            pristine_lines = split_lines(pristine_content)
+            current_lines = split_lines(current_content)
+            statuses = [
+                HunkStatus.APPLIED if _is_hunk_applied(pristine_lines, current_lines, hunk) else HunkStatus.CONFLICT
+                for hunk in hunks
+            ]
+
+        # NOTE: the incarnation file already contains the applied hunks, they are the same
+        #       change in the incarnation and the updated file, thus, they merge cleanly.
+        if HunkStatus.CONFLICT in statuses and three_way_merge:
+            merged_content = (
+                merge_file_content(pristine_content, current_content, updated_content)
+                if pristine_content is not None and updated_content is not None
+                else None
+            )
+            if merged_content is not None:
+                incarnation_file.write_bytes(merged_content)
+                statuses = [HunkStatus.MERGED if s is HunkStatus.CONFLICT else s for s in statuses]
+        # NOTE: a rejection file which can't be parsed is never resolved.
+        resolved = bool(statuses) and HunkStatus.CONFLICT not in statuses
+
+    if resolved:
+        rejection_file.unlink()
+    return FileRejection(path, statuses, resolved)
+
+
+def _is_hunk_applied(pristine_lines: list[bytes], current_lines: list[bytes], hunk: Hunk) -> bool:
+    """Check if the change of a hunk is already contained in the current lines.
+
+    The hunk is applied to the pristine lines at its exact position and the result is merged into the current
+    lines. The change is contained if the merge leaves the current lines unchanged. Unlike looking for the new
+    lines of the hunk, this doesn't mistake repeated context lines in the current lines for the change.
+    """
+    old_lines = hunk.old_lines
+    if pristine_lines[hunk.old_start : hunk.old_start + len(old_lines)] != old_lines:
+        return False
+    hunk_lines = pristine_lines[: hunk.old_start] + hunk.new_lines + pristine_lines[hunk.old_start + len(old_lines) :]
+    return merge_lines(pristine_lines, current_lines, hunk_lines) == current_lines
+
+
+def _read_rendered_file(rendered_incarnation: Path | InMemorySink, path: Path) -> bytes | None:
+    if isinstance(rendered_incarnation, InMemorySink):
+        return rendered_incarnation.read_bytes(path)
+    file = rendered_incarnation / path
+    return file.read_bytes() if file.is_file() else None
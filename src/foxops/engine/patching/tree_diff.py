@@ -0,0 +1,173 @@
+import asyncio
+import base64
+import hashlib
+import stat
+import typing
+import zlib
+from pathlib import Path
+
+from foxops.engine.manifest import TemplateEntryType, scan_template
+from foxops.engine.patching.git_diff_patch import patch
+from foxops.engine.patching.hunks import unified_hunks
+from foxops.engine.patching.merge import is_binary, split_lines
+from foxops.engine.sinks import InMemorySink
+from foxops.logger import get_logger
+
+#: Holds the module logger
+logger = get_logger(__name__)
+
+#: Holds the maximum number of bytes encoded in a single line of a git binary patch
+_BINARY_PATCH_LINE_SIZE = 52
+#: Holds the object id git uses for a missing blob
+_NULL_OID = b"0" * 40
+#: Holds the git mode of symlinks
+_GIT_SYMLINK_MODE = b"120000"
+
+#: Represents a file of a rendered incarnation as its git mode and content
+GitFile = tuple[bytes, bytes]
+
+
+async def tree_diff_and_patch(
+    diff_a_directory: Path | InMemorySink,
+    diff_b_directory: Path | InMemorySink,
+    patch_directory: Path,
+) -> list[Path] | None:
+    """Diff two rendered incarnations in-process and apply the changes to the incarnation in `patch_directory`.
+
+    Unlike `diff_and_patch`, the rendered incarnations are compared directly without
+    importing them into a scratch git repository, see `diff_trees`.
+    """
+    patch_content = await asyncio.to_thread(
+        diff_trees, await read_git_files(diff_a_directory), await read_git_files(diff_b_directory)
+    )
+    return await patch(patch_content, patch_directory, diff_b_directory, diff_a_directory)
+
+
+async def read_git_files(rendered_incarnation: Path | InMemorySink) -> dict[Path, GitFile]:
+    """Read the files of a rendered incarnation like git sees them.
+
+    Directories are ignored and only the executable bit of the file modes is kept.
+    """
+    if isinstance(rendered_incarnation, InMemorySink):
+        return {
+            path: (_GIT_SYMLINK_MODE, entry.symlink_target.encode("utf-8"))
+            if entry.symlink_target is not None
+            else (_git_file_mode(entry.mode), typing.cast(bytes, entry.content))
+            for path, entry in rendered_incarnation.entries.items()
+            if entry.symlink_target is not None or entry.content is not None
+        }
+
+    return await asyncio.to_thread(_read_git_files_from_directory, rendered_incarnation)
+
+
+def _read_git_files_from_directory(directory: Path) -> dict[Path, GitFile]:
+    files = {}
+    for entry in scan_template(directory, []):
+        if entry.type is TemplateEntryType.SYMLINK:
+            files[entry.path] = (_GIT_SYMLINK_MODE, typing.cast(str, entry.symlink_target).encode("utf-8"))
+        elif entry.type is TemplateEntryType.FILE:
+            files[entry.path] = (_git_file_mode(entry.mode), (directory / entry.path).read_bytes())
+    return files
+
+
+def diff_trees(old_files: dict[Path, GitFile], new_files: dict[Path, GitFile]) -> bytes:
+    """Create a patch in the format of `git diff --full-index --binary` between two sets of files.
+
+    The patch can be applied with `git apply`. An empty patch is returned if the files are identical.
+    Files which type changes (e.g. from a file to a symlink) are deleted and added again, like git does.
+    """
+    chunks: list[bytes] = []
+    for path in sorted(old_files.keys() | new_files.keys()):
+        old_file = old_files.get(path)
+        new_file = new_files.get(path)
+        if old_file == new_file:
+            continue
+
+        raw_path = path.as_posix()
+        if old_file is not None and new_file is not None and is_symlink(old_file) != is_symlink(new_file):
+            chunks.append(_diff_file(raw_path, old_file, None))
+            chunks.append(_diff_file(raw_path, None, new_file))
+        else:
+            chunks.append(_diff_file(raw_path, old_file, new_file))
+    return b"".join(chunks)
+
+
+def _diff_file(raw_path: str, old_file: GitFile | None, new_file: GitFile | None) -> bytes:
+    a_path = _quote_path("a/" + raw_path)
+    b_path = _quote_path("b/" + raw_path)
+    old_mode, old_content = old_file if old_file is not None else (None, b"")
+    new_mode, new_content = new_file if new_file is not None else (None, b"")
+    old_oid = _blob_oid(old_content) if old_file is not None else _NULL_OID
+    new_oid = _blob_oid(new_content) if new_file is not None else _NULL_OID
+
+    header = [b"diff --git %s %s\n" % (a_path, b_path)]
+    if old_mode is None:
+        header.append(b"new file mode %s\n" % new_mode)
+        header.append(b"index %s..%s\n" % (old_oid, new_oid))
+    elif new_mode is None:
+        header.append(b"deleted file mode %s\n" % old_mode)
+        header.append(b"index %s..%s\n" % (old_oid, new_oid))
+    elif old_mode != new_mode:
+        header.append(b"old mode %s\nnew mode %s\n" % (old_mode, new_mode))
+        if old_oid != new_oid:
+            header.append(b"index %s..%s\n" % (old_oid, new_oid))
+    else:
+        header.append(b"index %s..%s %s\n" % (old_oid, new_oid, old_mode))
+
+    if old_oid == new_oid:
+        return b"".join(header)
+
+    if is_binary(old_content) or is_binary(new_content):
+        header.append(b"GIT binary patch\n")
+        header.append(_binary_literal(new_content))
+        header.append(_binary_literal(old_content))
+        return b"".join(header)
+
+    header.append(b"--- %s\n" % (a_path if old_file is not None else b"/dev/null"))
+    header.append(b"+++ %s\n" % (b_path if new_file is not None else b"/dev/null"))
+    header.extend(hunk.to_bytes() for hunk in unified_hunks(split_lines(old_content), split_lines(new_content)))
+    return b"".join(header)
+
+
+def _binary_literal(content: bytes) -> bytes:
+    compressed = zlib.compress(content)
+    lines = [b"literal %d\n" % len(content)]
+    for offset in range(0, len(compressed), _BINARY_PATCH_LINE_SIZE):
+        chunk = compressed[offset : offset + _BINARY_PATCH_LINE_SIZE]
+        # NOTE: the length of a line is encoded as `A-Z` for 1-26 and `a-z` for 27-52 bytes.
+        length = chr(ord("A") + len(chunk) - 1) if len(chunk) <= 26 else chr(ord("a") + len(chunk) - 27)
+        lines.append(length.encode() + base64.b85encode(chunk, pad=True) + b"\n")
+    lines.append(b"\n")
+    return b"".join(lines)
+
+
+def is_symlink(file: GitFile) -> bool:
+    """Check if a file of a rendered incarnation, see `read_git_files`, is a symlink."""
+    return file[0] == _GIT_SYMLINK_MODE
+
+
+def _blob_oid(content: bytes) -> bytes:
+    return hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest().encode()  # nosec
+
+
+def _git_file_mode(mode: int) -> bytes:
+    return b"100755" if mode & stat.S_IXUSR else b"100644"
+
+
+def _quote_path(raw_path: str) -> bytes:
+    """Quote a path of the patch header like git does, if necessary."""
+    encoded_path = raw_path.encode("utf-8")
+    if not any(c < 0x20 or c >= 0x7F or c in b'"\\' for c in encoded_path):
+        return encoded_path
+
+    escapes = {ord("\t"): b"\\t", ord("\n"): b"\\n", ord('"'): b'\\"', ord("\\"): b"\\\\"}
+    quoted = [b'"']
+    for c in encoded_path:
+        if c in escapes:
+            quoted.append(escapes[c])
+        elif c < 0x20 or c >= 0x7F:
+            quoted.append(b"\\%03o" % c)
+        else:
+            quoted.append(bytes([c]))
+    quoted.append(b'"')
+    return b"".join(quoted)
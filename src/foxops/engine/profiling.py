@@ -0,0 +1,98 @@
+import contextlib
+import typing
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from foxops.engine.settings import get_engine_settings
+
+#: Holds the number of template files reported by default as the slowest ones of a profile
+SLOWEST_ENTRIES_LIMIT = 10
+
+#: Holds the profile the current rendering records into, if it's profiled
+_current_rendering_profile: ContextVar["RenderingProfile | None"] = ContextVar("rendering_profile", default=None)
+
+
+@dataclass(frozen=True)
+class RenderingProfileEntry:
+    """Represents the profile of rendering a single template file."""
+
+    #: Holds the path of the template file relative to the template root directory
+    template_path: Path
+    #: Holds the time in seconds it took to load and compile the template file
+    compile_time: float
+    #: Holds the time in seconds it took to render (and write) the template file
+    render_time: float
+    #: Holds the number of bytes of the rendered file
+    output_bytes: int
+    #: Holds whether the compiled template file has been taken from the template cache
+    cached: bool
+
+    @property
+    def total_time(self) -> float:
+        return self.compile_time + self.render_time
+
+    def to_dict(self) -> dict[str, typing.Any]:
+        return {
+            "template_path": self.template_path.as_posix(),
+            "compile_ms": round(self.compile_time * 1000, 3),
+            "render_ms": round(self.render_time * 1000, 3),
+            "output_bytes": self.output_bytes,
+            "cached": self.cached,
+        }
+
+
+@dataclass
+class RenderingProfile:
+    """Collects the profiles of all template files rendered while profiling, see `profile_rendering`."""
+
+    #: Holds the profiles of the rendered template files in the order they have been recorded
+    entries: list[RenderingProfileEntry] = field(default_factory=list)
+
+    def record(self, entry: RenderingProfileEntry) -> None:
+        self.entries.append(entry)
+
+    def slowest(self, limit: int = SLOWEST_ENTRIES_LIMIT) -> list[RenderingProfileEntry]:
+        """Get the `limit` template files which took the longest to compile and render."""
+        return sorted(self.entries, key=lambda e: e.total_time, reverse=True)[:limit]
+
+
+@contextlib.contextmanager
+def profile_rendering() -> typing.Iterator[RenderingProfile]:
+    """Profile all template files rendered within the context.
+
+    The profile is propagated to all tasks created within the context (and to the process pool
+    workers rendering the template files), thus, it may be used around `asyncio.run()`.
+    """
+    profile = RenderingProfile()
+    token = _current_rendering_profile.set(profile)
+    try:
+        yield profile
+    finally:
+        _current_rendering_profile.reset(token)
+
+
+def get_rendering_profile() -> RenderingProfile | None:
+    """Get the profile of the current rendering, `None` if the rendering isn't profiled."""
+    return _current_rendering_profile.get()
+
+
+@contextlib.contextmanager
+def log_rendering_profile(logger: typing.Any) -> typing.Iterator[None]:
+    """Profile the rendering within the context and log the slowest template files afterwards.
+
+    Does nothing unless the `rendering_profile` engine setting is enabled.
+    """
+    if not get_engine_settings().rendering_profile:
+        yield
+        return
+
+    with profile_rendering() as profile:
+        try:
+            yield
+        finally:
+            logger.info(
+                "rendering profile",
+                rendered_template_files=len(profile.entries),
+                slowest_template_files=[e.to_dict() for e in profile.slowest()],
+            )
@@ -1,233 +1,671 @@
+import asyncio
+import atexit
+import contextlib
 import functools
+import multiprocessing
 import os
+import stat
+import time
 import typing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
 
-from aiopath import AsyncPath
-from jinja2 import FileSystemLoader, StrictUndefined
+from jinja2 import Environment, StrictUndefined, Template
 from jinja2.sandbox import SandboxedEnvironment
 
+from foxops.engine.caching import TemplateBytecodeCache
+from foxops.engine.loaders import ImmutableFileSystemLoader
+from foxops.engine.manifest import TemplateEntry, TemplateEntryType, scan_template
 from foxops.engine.models import TemplateData
+from foxops.engine.profiling import (
+    RenderingProfileEntry,
+    get_rendering_profile,
+    profile_rendering,
+)
+from foxops.engine.settings import get_engine_settings
+from foxops.engine.sinks import (
+    WRITE_BATCH_SIZE,
+    DirectorySink,
+    InMemoryEntry,
+    InMemorySink,
+    RenderSink,
+)
 from foxops.logger import get_logger
 
 #: Holds the module logger
 logger = get_logger(__name__)
 
+#: Holds the rendering process pools by their amount of worker processes, see `get_rendering_process_pool`
+_rendering_process_pools: dict[int, ProcessPoolExecutor] = {}
 
-def create_template_environment(template_root_dir: Path) -> SandboxedEnvironment:
+
+def create_template_environment(
+    template_root_dir: Path,
+    template_repository_version_hash: str | None = None,
+    trusted: bool = False,
+) -> Environment:
     """Create a virtual environment to render a template into an incarnation.
 
     As of now the environment is an untouched jinja2 sandboxed environment
     which only has access to the template root directory.
+
+    Trusted templates are rendered with a plain, synchronous jinja2 environment instead,
+    which skips the safety checks the sandbox applies to every attribute access and call.
+    See the `trusted_template_repositories` engine setting.
+
+    If the git sha of the template repository version is given and the
+    `template_cache_dir` engine setting is configured, the compiled template
+    files are cached across renderings of the same template version.
+
+    The template root directory must not change during the lifetime of the environment,
+    the template files are never revalidated, see `ImmutableFileSystemLoader`.
     """
-    paths = [template_root_dir]
-    loader = FileSystemLoader(paths)
+    loader = ImmutableFileSystemLoader(template_root_dir)
+
+    bytecode_cache = None
+    settings = get_engine_settings()
+    if template_repository_version_hash is not None and settings.template_cache_dir is not None:
+        bytecode_cache = TemplateBytecodeCache(
+            settings.template_cache_dir,
+            template_repository_version_hash,
+            max_size=settings.template_cache_max_size,
+            variant="trusted" if trusted else None,
+        )
+
     # NOTE(TF): add extensions to the loader if necessary.
-    env = SandboxedEnvironment(
+    environment_class = Environment if trusted else SandboxedEnvironment
+    env = environment_class(
         loader=loader,
-        enable_async=True,
+        bytecode_cache=bytecode_cache,
+        enable_async=not trusted,
+        auto_reload=False,
         keep_trailing_newline=True,
         undefined=StrictUndefined,
     )
     return env
 
 
+class TemplatePathRenderer:
+    """Render the paths of template entries into incarnation paths.
+
+    A path is rendered segment by segment and the rendered directory prefixes
+    are memoized, thus, every unique directory of a template is only rendered once
+    no matter how many entries it contains.
+    Segments which don't contain any template syntax are returned unchanged
+    without being compiled, the others are compiled once per renderer.
+
+    A renderer is bound to the template data of a single rendering.
+    """
+
+    def __init__(self, environment: Environment, template_data: TemplateData):
+        self.environment = environment
+        self.template_data = template_data
+        self._template_syntax_markers = (
+            environment.block_start_string,
+            environment.variable_start_string,
+            environment.comment_start_string,
+        )
+        self._rendered_dirs: dict[Path, str] = {Path("."): "."}
+        self._compiled_segments: dict[str, Template] = {}
+
+    def is_literal(self, value: str) -> bool:
+        """Check if the given value doesn't contain any template syntax."""
+        return not any(marker in value for marker in self._template_syntax_markers)
+
+    async def render_string(self, value: str) -> str:
+        if self.is_literal(value):
+            return value
+        if (template := self._compiled_segments.get(value)) is None:
+            template = self._compiled_segments[value] = self.environment.from_string(value)
+        return await render_template_content(template, self.template_data)
+
+    async def render(self, relative_path: Path) -> Path:
+        """Render the given template path relative to the template root directory."""
+        rendered_parent = await self._render_dir(relative_path.parent)
+        rendered_name = await self.render_string(relative_path.name)
+        # NOTE: joining the rendered segments as strings (instead of paths) keeps the semantics
+        #       of rendering the entire path at once, e.g. for segments rendering to empty strings.
+        return Path(f"{rendered_parent}/{rendered_name}")
+
+    async def _render_dir(self, relative_dir_path: Path) -> str:
+        if (rendered_dir := self._rendered_dirs.get(relative_dir_path)) is None:
+            rendered_dir = str(await self.render(relative_dir_path))
+            self._rendered_dirs[relative_dir_path] = rendered_dir
+        return rendered_dir
+
+
 async def render_template(
     template_root_dir: Path,
-    incarnation_root_dir: Path,
+    incarnation_root_dir: Path | RenderSink,
     template_data: TemplateData,
     rendering_filename_exclude_patterns: list[str],
+    max_concurrency: int | None = None,
+    processes: int | None = None,
+    template_repository_version_hash: str | None = None,
+    template_paths: typing.Collection[Path] | None = None,
+    trusted: bool = False,
+    manifest: list[TemplateEntry] | None = None,
 ) -> None:
     """Render a template into an incarnation.
 
     As of now a very simplistic approach is used to find and render the files
     and folders in a template.
 
+    All directories are rendered before any file or symlink is rendered.
+    Within each of these two phases up to `max_concurrency` entries are rendered
+    concurrently. The resulting incarnation is the same regardless of the concurrency.
+
+    If more than one process is requested, the files and symlinks are split across
+    the workers of a process pool, each of them rendering its share with its own
+    template environment.
+
+    :param incarnation_root_dir: The directory to render the incarnation into or a `RenderSink`
+    receiving the rendered entries, e.g. an `InMemorySink` to render without touching the disk.
     :param rendering_filename_exclude_patterns: A list of glob patterns matching files which contents should not be
     rendered. Can be empty.
+    :param max_concurrency: The maximum number of entries rendered concurrently (per process).
+    Defaults to the `rendering_concurrency` engine setting.
+    :param processes: The number of worker processes to render files in. `1` renders in the current process
+    and `0` uses one process per CPU core. Defaults to the `rendering_processes` engine setting.
+    :param template_repository_version_hash: The git sha of the rendered template version.
+    Used to cache the compiled template files, see `create_template_environment`.
+    :param template_paths: The paths of the template entries to render, relative to the template root directory.
+    All entries are rendered if not given.
+    :param trusted: Whether the template is trusted and rendered without sandbox, see `create_template_environment`.
+    :param manifest: The entries of the template directory, e.g. from a cached `TemplateVersionManifest`.
+    The template directory is scanned if not given.
+
+    Template files of at least `rendering_streaming_threshold` bytes (engine setting) are
+    rendered in streaming mode, see `render_template_file`.
     """
     if not template_root_dir.is_absolute():
         raise ValueError(f"template_root_dir must be an absolute path, got {template_root_dir}")
 
-    files_to_render = set(template_root_dir.glob("**/*"))
-    for pattern in rendering_filename_exclude_patterns:
-        files_to_render -= set(template_root_dir.glob(pattern))
-
-    environment = create_template_environment(template_root_dir)
+    settings = get_engine_settings()
+    if max_concurrency is None:
+        max_concurrency = settings.rendering_concurrency
+    if max_concurrency < 1:
+        raise ValueError(f"max_concurrency must be at least 1, got {max_concurrency}")
+    if processes is None:
+        processes = settings.rendering_processes
+    if processes < 0:
+        raise ValueError(f"processes must not be negative, got {processes}")
+    if processes == 0:
+        processes = os.cpu_count() or 1
+
+    sink = as_render_sink(incarnation_root_dir, batch_size=WRITE_BATCH_SIZE)
+    if manifest is None:
+        manifest = scan_template(template_root_dir, rendering_filename_exclude_patterns)
+    if template_paths is not None:
+        manifest = [e for e in manifest if e.path in template_paths]
+    environment = create_template_environment(template_root_dir, template_repository_version_hash, trusted)
 
     logger.debug(
         "start rendering template",
         template_root_dir=template_root_dir,
-        incarnation_root_dir=incarnation_root_dir,
+        sink=sink,
         template_data=template_data,
         rendering_filename_exclude_patterns=rendering_filename_exclude_patterns,
+        max_concurrency=max_concurrency,
+        processes=processes,
+    )
+
+    template_dir_entries = [e for e in manifest if e.type is TemplateEntryType.DIRECTORY]
+    template_file_entries = [e for e in manifest if e.type is not TemplateEntryType.DIRECTORY]
+
+    path_renderer = TemplatePathRenderer(environment, template_data)
+    await run_bounded(
+        (
+            functools.partial(
+                render_template_dir,
+                environment,
+                template_root_dir / e.path,
+                sink,
+                template_data,
+                path_renderer=path_renderer,
+                template_entry=e,
+            )
+            for e in template_dir_entries
+        ),
+        max_concurrency,
     )
+    # NOTE: all directories must exist (with their modes applied) before any file is written.
+    await sink.flush()
 
-    async def _render_template_symlink(template_symlink_path):
-        return await render_template_symlink(
+    if processes == 1 or len(template_file_entries) <= 1:
+        await _render_template_file_entries(
             environment,
-            template_symlink_path,
-            incarnation_root_dir,
+            path_renderer,
+            template_root_dir,
+            template_file_entries,
+            sink,
             template_data,
+            max_concurrency,
         )
-
-    async def _render_template_dir(template_dir_path):
-        return await render_template_dir(
-            environment,
-            template_dir_path,
-            incarnation_root_dir,
+    else:
+        # NOTE: workers write directly into an incarnation directory,
+        #       any other sink receives the entries rendered in memory by the workers.
+        worker_incarnation_root_dir = sink.root_dir if isinstance(sink, DirectorySink) else None
+        profile = get_rendering_profile()
+        render_in_workers = functools.partial(
+            _render_template_file_entries_in_process_pool,
+            template_root_dir,
+            template_repository_version_hash,
+            template_file_entries,
+            worker_incarnation_root_dir,
             template_data,
+            max_concurrency,
+            trusted,
+            profile is not None,
+            processes,
+        )
+        try:
+            worker_results = await render_in_workers()
+        except BrokenProcessPool:
+            # NOTE: a worker died (e.g. killed by the OOM killer), the pool is unusable and replaced.
+            #       The rendering is only retried if the workers haven't written anything to disk.
+            if worker_incarnation_root_dir is not None:
+                raise
+            logger.warning("rendering process pool is broken, retrying with a new one", processes=processes)
+            worker_results = await render_in_workers()
+        for worker_entries, worker_profile_entries in worker_results:
+            if worker_entries is not None:
+                await InMemorySink(worker_entries).replay(sink)
+            if profile is not None:
+                profile.entries.extend(worker_profile_entries)
+
+    if isinstance(environment.bytecode_cache, TemplateBytecodeCache):
+        environment.bytecode_cache.prune()
+
+
+async def _render_template_file_entries_in_process_pool(
+    template_root_dir: Path,
+    template_repository_version_hash: str | None,
+    template_file_entries: list[TemplateEntry],
+    worker_incarnation_root_dir: Path | None,
+    template_data: TemplateData,
+    max_concurrency: int,
+    trusted: bool,
+    profiled: bool,
+    processes: int,
+) -> list[tuple[dict[Path, InMemoryEntry] | None, list[RenderingProfileEntry]]]:
+    """Split the template files across the workers of the rendering process pool and render them there.
+
+    If the pool is broken, it's discarded, so that the next call creates a new one, and `BrokenProcessPool` is raised.
+    """
+    loop = asyncio.get_running_loop()
+    process_pool = get_rendering_process_pool(processes)
+    try:
+        return await asyncio.gather(
+            *(
+                loop.run_in_executor(
+                    process_pool,
+                    _render_template_file_entries_in_worker,
+                    template_root_dir,
+                    template_repository_version_hash,
+                    template_file_entries[worker_idx::processes],
+                    worker_incarnation_root_dir,
+                    template_data,
+                    max_concurrency,
+                    trusted,
+                    profiled,
+                )
+                for worker_idx in range(min(processes, len(template_file_entries)))
+            )
         )
+    except BrokenProcessPool:
+        discard_rendering_process_pool(process_pool)
+        raise
+
 
-    async def _render_template_file(template_file_path, render_content: bool):
-        return await render_template_file(
+async def _render_template_file_entries(
+    environment: Environment,
+    path_renderer: TemplatePathRenderer,
+    template_root_dir: Path,
+    template_file_entries: list[TemplateEntry],
+    sink: RenderSink,
+    template_data: TemplateData,
+    max_concurrency: int,
+) -> None:
+    streaming_threshold = get_engine_settings().rendering_streaming_threshold
+
+    def _job(entry: TemplateEntry):
+        if entry.type is TemplateEntryType.SYMLINK:
+            return render_template_symlink(
+                environment,
+                template_root_dir / entry.path,
+                sink,
+                template_data,
+                path_renderer=path_renderer,
+                template_entry=entry,
+            )
+        return render_template_file(
             environment,
-            template_file_path,
-            incarnation_root_dir,
+            template_root_dir / entry.path,
+            sink,
             template_data,
-            render_content=render_content,
+            render_content=not entry.excluded,
+            path_renderer=path_renderer,
+            template_entry=entry,
+            stream=streaming_threshold is not None and entry.size >= streaming_threshold,
         )
 
-    for root_dir, dirs, files in os.walk(template_root_dir):
-        for d in dirs:
-            template_dir_path = Path(root_dir) / d
-            if template_dir_path.is_symlink():
-                await _render_template_symlink(template_dir_path)
-            else:
-                await _render_template_dir(template_dir_path)
-
-        for f in files:
-            template_file_path = Path(root_dir) / f
-            if template_file_path.is_symlink():
-                await _render_template_symlink(template_file_path)
-            else:
-                await _render_template_file(
-                    template_file_path,
-                    render_content=template_file_path in files_to_render,
-                )
+    await run_bounded((functools.partial(_job, e) for e in template_file_entries), max_concurrency)
+    await sink.flush()
+
+
+def _render_template_file_entries_in_worker(
+    template_root_dir: Path,
+    template_repository_version_hash: str | None,
+    template_file_entries: list[TemplateEntry],
+    incarnation_root_dir: Path | None,
+    template_data: TemplateData,
+    max_concurrency: int,
+    trusted: bool,
+    profiled: bool,
+) -> tuple[dict[Path, InMemoryEntry] | None, list[RenderingProfileEntry]]:
+    """Render a share of the template files inside a process pool worker.
+
+    If no incarnation directory is given, the files are rendered in memory
+    and the rendered entries are returned to the parent process.
+    If the rendering is `profiled`, the profiles of the rendered files are returned as well.
+    """
+    environment = create_template_environment(template_root_dir, template_repository_version_hash, trusted)
+    sink: DirectorySink | InMemorySink = (
+        InMemorySink() if incarnation_root_dir is None else DirectorySink(incarnation_root_dir, WRITE_BATCH_SIZE)
+    )
+    with profile_rendering() if profiled else contextlib.nullcontext() as profile:
+        asyncio.run(
+            _render_template_file_entries(
+                environment,
+                TemplatePathRenderer(environment, template_data),
+                template_root_dir,
+                template_file_entries,
+                sink,
+                template_data,
+                max_concurrency,
+            )
+        )
+    # NOTE: the workers compile the templates of their share, thus, they prune the templates they've cached.
+    if isinstance(environment.bytecode_cache, TemplateBytecodeCache):
+        environment.bytecode_cache.prune()
+    return sink.entries if isinstance(sink, InMemorySink) else None, profile.entries if profile is not None else []
+
+
+async def render_template_content(template: Template, template_data: TemplateData) -> str:
+    """Render the given template, asynchronously unless it belongs to a trusted environment."""
+    if template.environment.is_async:
+        return await template.render_async(**template_data)
+    return template.render(**template_data)
+
+
+def generate_template_content(template: Template, template_data: TemplateData) -> typing.AsyncIterator[str]:
+    """Render the given template in chunks, see `render_template_content`."""
+    if template.environment.is_async:
+        return template.generate_async(**template_data)
+    return _iterate_async(template.generate(**template_data))
+
+
+async def _iterate_async(chunks: typing.Iterator[str]) -> typing.AsyncIterator[str]:
+    for chunk in chunks:
+        yield chunk
+
+
+def as_render_sink(incarnation: Path | RenderSink, batch_size: int = 1) -> RenderSink:
+    """Get the sink to render into, a path is rendered into as a directory on the local file system.
+
+    :param batch_size: The number of entries written at once into a directory, see `DirectorySink`.
+    """
+    if isinstance(incarnation, Path):
+        return DirectorySink(incarnation, batch_size)
+    return incarnation
+
+
+def get_rendering_process_pool(processes: int) -> ProcessPoolExecutor:
+    """Get the process pool used to render templates with the given amount of worker processes.
+
+    The pool is created on first use and then shared by all renderings in this process,
+    until it's discarded, see `discard_rendering_process_pool`.
+    Workers are spawned instead of forked, because the parent process may run threads.
+    """
+    if (process_pool := _rendering_process_pools.get(processes)) is None:
+        process_pool = _rendering_process_pools[processes] = ProcessPoolExecutor(
+            max_workers=processes, mp_context=multiprocessing.get_context("spawn")
+        )
+    return process_pool
+
+
+def discard_rendering_process_pool(process_pool: ProcessPoolExecutor) -> None:
+    """Shut down the given rendering process pool and remove it, so that a new one is created on next use."""
+    for processes, pool in list(_rendering_process_pools.items()):
+        if pool is process_pool:
+            del _rendering_process_pools[processes]
+    process_pool.shutdown(wait=False, cancel_futures=True)
+
+
+@atexit.register
+def shutdown_rendering_process_pools() -> None:
+    """Shut down all rendering process pools, this is done when the interpreter exits."""
+    while _rendering_process_pools:
+        _, process_pool = _rendering_process_pools.popitem()
+        process_pool.shutdown(wait=True, cancel_futures=True)
+
+
+async def run_bounded(
+    jobs: typing.Iterable[typing.Callable[[], typing.Awaitable[typing.Any]]],
+    max_concurrency: int,
+) -> None:
+    """Run the given jobs with at most `max_concurrency` of them in flight at once.
+
+    A job is only started once a slot is free. If any job fails, the jobs which
+    are still pending or running are cancelled and the error is re-raised.
+    """
+    if max_concurrency == 1:
+        for job in jobs:
+            await job()
+        return
+
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def _run(job):
+        async with semaphore:
+            return await job()
+
+    tasks = [asyncio.ensure_future(_run(job)) for job in jobs]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
 
 
 async def render_template_file(
-    environment: SandboxedEnvironment,
+    environment: Environment,
     template_file_path: Path,
-    incarnation_root_dir: Path,
+    incarnation_root_dir: Path | RenderSink,
     template_data: TemplateData,
     render_content: bool,
+    path_renderer: TemplatePathRenderer | None = None,
+    template_entry: TemplateEntry | None = None,
+    stream: bool = False,
 ) -> Path:
     """Render a template file into an incarnation file.
 
     The template file content and file name are rendered if rendering_enabled is True. Otherwise, rendering of the file
     content is skipped.
-    """
-    loader: FileSystemLoader = typing.cast(FileSystemLoader, environment.loader)
-    relative_template_path = template_file_path.relative_to(loader.searchpath[0])
 
-    if render_content:
+    A `path_renderer` may be shared between the entries of a template to memoize the rendered directories.
+    If the `template_entry` from the template manifest is given, the template file isn't stat'ed again.
+
+    Files which are known to be `literal` are copied like files which content isn't rendered.
+
+    If the rendering is profiled, the compile and render time of the file are recorded, see `profile_rendering`.
+
+    In streaming mode the rendered content is written to the incarnation file in chunks while it's
+    being rendered, instead of rendering the entire content in memory first.
+    This bounds the memory used for very large files.
+
+    Returns the rendered path relative to the incarnation root.
+    """
+    sink = as_render_sink(incarnation_root_dir)
+    if path_renderer is None:
+        path_renderer = TemplatePathRenderer(environment, template_data)
+    if template_entry is None:
+        template_entry = _get_template_entry(environment, template_file_path)
+
+    profile = get_rendering_profile()
+    started_at = time.perf_counter()
+    compile_time = 0.0
+
+    content_template = None
+    rendered_content = None
+    if render_content and not template_entry.literal:
         # get and render template file contents
-        content_template = environment.get_template(str(relative_template_path))
-        rendered_content = await content_template.render_async(**template_data)
-    else:
-        rendered_content = template_file_path.read_text()
+        content_template = environment.get_template(template_entry.path.as_posix())
+        compile_time = time.perf_counter() - started_at
+        if not stream:
+            rendered_content = await render_template_content(content_template, template_data)
 
     # get and render template file path
     # NOTE (AH): Even when file content rendering is disabled, we still need to render the file path.
     #            This is because we always render folder names - so the file wouldn't end up in the correct location
     #            within the incarnation.
-    path_template = environment.from_string(str(relative_template_path))
-    rendered_path = Path(await path_template.render_async(**template_data))
+    rendered_path = await path_renderer.render(template_entry.path)
 
     logger.debug(
         "rendering file in incarnation",
-        content_rendered=render_content,
+        content_rendered=content_template is not None,
         path=rendered_path,
     )
 
-    template_file_stat = template_file_path.stat(follow_symlinks=False)  # type: ignore
-    incarnation_file_path = AsyncPath(incarnation_root_dir, rendered_path)
-    await incarnation_file_path.parent.mkdir(parents=True, exist_ok=True)
-    await incarnation_file_path.write_text(rendered_content)
-    apply_path_stats(Path(incarnation_file_path), template_file_stat)
-    return incarnation_file_path
+    output_bytes = template_entry.size
+    if rendered_content is not None:
+        if profile is not None:
+            output_bytes = len(rendered_content.encode("utf-8"))
+        await sink.write_file(rendered_path, rendered_content, template_entry.mode)
+    elif content_template is not None:
+        chunks = generate_template_content(content_template, template_data)
+        if profile is not None:
+            output_bytes = 0
+
+            async def _count_bytes(chunks: typing.AsyncIterator[str]) -> typing.AsyncIterator[str]:
+                nonlocal output_bytes
+                async for chunk in chunks:
+                    output_bytes += len(chunk.encode("utf-8"))
+                    yield chunk
+
+            chunks = _count_bytes(chunks)
+        await sink.write_file_chunks(rendered_path, chunks, template_entry.mode)
+    else:
+        # NOTE: files which are not rendered are passed through as raw bytes,
+        #       they may not even be text files (e.g. images).
+        await sink.copy_file(rendered_path, template_file_path, template_entry.mode)
+
+    if profile is not None:
+        profile.record(
+            RenderingProfileEntry(
+                template_path=template_entry.path,
+                compile_time=compile_time,
+                render_time=time.perf_counter() - started_at - compile_time,
+                output_bytes=output_bytes,
+                cached=content_template is not None and _is_compiled_template_cached(environment, content_template),
+            )
+        )
+    return rendered_path
+
+
+def _is_compiled_template_cached(environment: Environment, template: Template) -> bool:
+    """Check if the compiled template has been loaded from the template cache."""
+    bytecode_cache = environment.bytecode_cache
+    return (
+        isinstance(bytecode_cache, TemplateBytecodeCache)
+        and template.name is not None
+        and bytecode_cache.get_cache_key(template.name) in bytecode_cache.loaded_keys
+    )
 
 
 async def render_template_dir(
-    environment: SandboxedEnvironment,
+    environment: Environment,
     template_dir_path: Path,
-    incarnation_root_dir: Path,
+    incarnation_root_dir: Path | RenderSink,
     template_data: TemplateData,
+    path_renderer: TemplatePathRenderer | None = None,
+    template_entry: TemplateEntry | None = None,
 ) -> Path:
-    """Render a template directory path into an incarnation directory path."""
-    loader: FileSystemLoader = typing.cast(FileSystemLoader, environment.loader)
-    relative_template_dir_path = template_dir_path.relative_to(loader.searchpath[0])
+    """Render a template directory path into an incarnation directory path.
+
+    Returns the rendered path relative to the incarnation root.
+    """
+    sink = as_render_sink(incarnation_root_dir)
+    if path_renderer is None:
+        path_renderer = TemplatePathRenderer(environment, template_data)
+    if template_entry is None:
+        template_entry = _get_template_entry(environment, template_dir_path)
 
     # get and render template file path
-    path_template = environment.from_string(str(relative_template_dir_path))
-    rendered_path = Path(await path_template.render_async(**template_data))
+    rendered_path = await path_renderer.render(template_entry.path)
 
     logger.debug("rendering directory in incarnation", path=rendered_path)
 
-    template_dir_stat = template_dir_path.stat(follow_symlinks=False)  # type: ignore
-    incarnation_dir_path = AsyncPath(incarnation_root_dir, rendered_path)
-    await incarnation_dir_path.mkdir(parents=True, exist_ok=True)
-    apply_path_stats(Path(incarnation_dir_path), template_dir_stat)
-    return incarnation_dir_path
+    await sink.write_directory(rendered_path, template_entry.mode)
+    return rendered_path
 
 
 async def render_template_symlink(
-    environment: SandboxedEnvironment,
+    environment: Environment,
     template_symlink_path: Path,
-    incarnation_root_dir: Path,
+    incarnation_root_dir: Path | RenderSink,
     template_data: TemplateData,
+    path_renderer: TemplatePathRenderer | None = None,
+    template_entry: TemplateEntry | None = None,
 ) -> Path:
-    """Render a template symlink path into an incarnation symlink path."""
-    loader: FileSystemLoader = typing.cast(FileSystemLoader, environment.loader)
-    relative_template_symlink_path = template_symlink_path.relative_to(loader.searchpath[0])
+    """Render a template symlink path into an incarnation symlink path.
+
+    Returns the rendered path relative to the incarnation root.
+    """
+    sink = as_render_sink(incarnation_root_dir)
+    if path_renderer is None:
+        path_renderer = TemplatePathRenderer(environment, template_data)
+    if template_entry is None:
+        template_entry = _get_template_entry(environment, template_symlink_path)
 
     # get and render template file path
-    path_template = environment.from_string(str(relative_template_symlink_path))
-    rendered_path = Path(await path_template.render_async(**template_data))
+    rendered_path = await path_renderer.render(template_entry.path)
     # get and render template symlink target
-    symlink_target_template = environment.from_string(str(template_symlink_path.readlink()))
-    rendered_symlink_target_path = Path(await symlink_target_template.render_async(**template_data))
+    rendered_symlink_target = str(
+        Path(await path_renderer.render_string(typing.cast(str, template_entry.symlink_target)))
+    )
 
     logger.debug(
         "rendering symlink in incarnation",
         source_path=rendered_path,
-        target_path=rendered_symlink_target_path,
+        target_path=rendered_symlink_target,
     )
 
-    template_symlink_stat = template_symlink_path.stat(follow_symlinks=False)  # type: ignore
-    incarnation_symlink_path = incarnation_root_dir / rendered_path
-    incarnation_symlink_path.parent.mkdir(parents=True, exist_ok=True)
-    incarnation_symlink_path.symlink_to(rendered_symlink_target_path)
-    apply_path_stats(incarnation_symlink_path, template_symlink_stat)
-    return incarnation_symlink_path
-
-
-def apply_path_stats(path: Path, target_stat: os.stat_result) -> None:
-    """Apply the stats obtained from one path to another path.
-
-    Insights:
-
-        fengine mainly operates within Git repositories.
-        Git doesn't store information about the owners and also ONLY
-        tracks the executable bit of a UNIX file permissions, meaning that
-        only the modes `100755` and `100644` are supported.
-
-        However, this function still applies the entire mode (reported by `stat`),
-        to keep things simple.
-        It also doesn't affect the ownership of the file.
-
-    This function doesn't follow symlinks.
-    """
-    chmod = functools.partial(path.chmod, target_stat.st_mode)
-    if path.is_symlink():
-        try:
-            chmod(follow_symlinks=False)
-        except NotImplementedError:
-            # NOTE(TF): some UNIX platforms (like Linux) don't allow to change permissions
-            #           on symlinks. They ALWAYS get 0o777.
-            #           Thus, we don't do nothing here.
-            pass
-    else:
-        chmod()
+    await sink.write_symlink(rendered_path, rendered_symlink_target, template_entry.mode)
+    return rendered_path
+
+
+def _get_template_entry(environment: Environment, template_path: Path) -> TemplateEntry:
+    """Get the manifest entry for a single template path, e.g. when rendering it outside of `render_template`."""
+    loader = typing.cast(ImmutableFileSystemLoader, environment.loader)
+    relative_template_path = template_path.relative_to(loader.searchpath[0])
+    template_stat = template_path.stat(follow_symlinks=False)  # type: ignore
+    if stat.S_ISLNK(template_stat.st_mode):
+        return TemplateEntry(
+            relative_template_path,
+            TemplateEntryType.SYMLINK,
+            template_stat.st_mode,
+            symlink_target=str(template_path.readlink()),
+        )
+    if stat.S_ISDIR(template_stat.st_mode):
+        return TemplateEntry(relative_template_path, TemplateEntryType.DIRECTORY, template_stat.st_mode)
+    return TemplateEntry(
+        relative_template_path,
+        TemplateEntryType.FILE,
+        template_stat.st_mode,
+        size=template_stat.st_size,
+    )
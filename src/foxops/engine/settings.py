@@ -0,0 +1,51 @@
+from functools import cache
+from pathlib import Path
+
+from pydantic import BaseSettings, Field
+
+
+class EngineSettings(BaseSettings):
+    """Settings to tune the rendering and updating of incarnations.
+
+    All settings can be provided as environment variables prefixed with `FOXOPS_ENGINE_`,
+    e.g. `FOXOPS_ENGINE_RENDERING_CONCURRENCY=16`.
+    They apply to both, the `fengine` CLI and the foxops API.
+    """
+
+    #: Holds the maximum number of template files which are rendered concurrently.
+    #: A value of `1` renders the files one after another.
+    rendering_concurrency: int = Field(1, ge=1)
+    #: Holds the number of worker processes the template files are rendered in.
+    #: A value of `1` renders in the current process, `0` uses one process per CPU core.
+    rendering_processes: int = Field(1, ge=0)
+    #: Holds the size in bytes from which on template files are rendered in streaming mode,
+    #: i.e. the rendered content is written in chunks instead of at once.
+    #: Streaming is disabled if not set.
+    rendering_streaming_threshold: int | None = Field(None, ge=0)
+    #: Holds the directory the compiled template files are cached in.
+    #: The cache is disabled if not set.
+    template_cache_dir: Path | None = None
+    #: Holds the maximum size in bytes of the compiled template cache.
+    template_cache_max_size: int = Field(256 * 1024 * 1024, ge=0)
+    #: Holds the template repositories which are trusted and rendered without the jinja2 sandbox.
+    #: The repositories must match the `template_repository` of the incarnations exactly.
+    trusted_template_repositories: list[str] = Field(default_factory=list)
+    #: Holds the directory the rendered incarnations are cached in, keyed by their incarnation state.
+    #: The cache is disabled if not set.
+    rendering_cache_dir: Path | None = None
+    #: Holds the maximum size in bytes of the rendered incarnation cache.
+    rendering_cache_max_size: int = Field(1024 * 1024 * 1024, ge=0)
+    #: Holds whether the renderings of the reconciliations are profiled.
+    #: The slowest template files are logged after each reconciliation.
+    rendering_profile: bool = False
+    #: Holds whether the rejected changes of an update are merged with the incarnation (three-way merge),
+    #: so that only changes which overlap with changes of the incarnation remain rejected.
+    three_way_merge: bool = False
+
+    class Config:
+        env_prefix = "foxops_engine_"
+
+
+@cache
+def get_engine_settings() -> EngineSettings:
+    return EngineSettings()
@@ -0,0 +1,295 @@
+import asyncio
+import errno
+import functools
+import hashlib
+import os
+import shutil
+import stat
+import typing
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from aiopath import AsyncPath
+
+#: Holds the number of characters buffered before they are written when streaming a rendered file
+_STREAMING_BUFFER_SIZE = 64 * 1024
+#: Holds the number of entries a `DirectorySink` writes in a single executor job when writing many entries at once
+WRITE_BATCH_SIZE = 64
+#: Holds the maximum number of content bytes queued by a `DirectorySink` before they are written
+_WRITE_BATCH_MAX_BYTES = 4 * 1024 * 1024
+#: Holds the maximum number of bytes copied by a single `copy_file_range` call
+_COPY_FILE_RANGE_CHUNK_SIZE = 1 << 30
+#: Holds the errnos for which `copy_file_range` is not supported between two files
+_COPY_FILE_RANGE_UNSUPPORTED_ERRNOS = frozenset(
+    {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EPERM}
+)
+
+
+class RenderSink(typing.Protocol):
+    """A target the rendered entries of a template are written to.
+
+    All paths are relative to the root of the incarnation.
+    The modes are the ones reported by `lstat` for the corresponding template entry.
+    """
+
+    async def write_directory(self, path: Path, mode: int) -> None:
+        ...
+
+    async def write_file(self, path: Path, content: str | bytes, mode: int) -> None:
+        ...
+
+    async def write_file_chunks(self, path: Path, chunks: typing.AsyncIterator[str], mode: int) -> None:
+        ...
+
+    async def copy_file(self, path: Path, source: Path, mode: int) -> None:
+        ...
+
+    async def write_symlink(self, path: Path, target: str, mode: int) -> None:
+        ...
+
+    async def flush(self) -> None:
+        """Write the entries which are still buffered by the sink, if any."""
+        ...
+
+
+class DirectorySink:
+    """Write the rendered entries into a directory on the local file system.
+
+    The blocking file system operations of an entry (creating the parent directories, writing
+    the content and applying the mode) don't hop to the thread pool one by one.
+    Instead, the entries are queued and written in batches of `batch_size` entries
+    (or `_WRITE_BATCH_MAX_BYTES` of content), each batch in a single executor job.
+    Every directory is created only once.
+
+    With a `batch_size` greater than 1, `flush()` must be called to write the remaining entries.
+    """
+
+    def __init__(self, root_dir: Path, batch_size: int = 1):
+        self.root_dir = root_dir
+        self.batch_size = batch_size
+        self._pending: list[typing.Callable[[], None]] = []
+        self._pending_bytes = 0
+        self._created_dirs: set[Path] = set()
+
+    async def write_directory(self, path: Path, mode: int) -> None:
+        await self._enqueue(functools.partial(self._write_directory, self.root_dir / path, mode))
+
+    async def write_file(self, path: Path, content: str | bytes, mode: int) -> None:
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        await self._enqueue(functools.partial(self._write_file, self.root_dir / path, content, mode), len(content))
+
+    async def write_file_chunks(self, path: Path, chunks: typing.AsyncIterator[str], mode: int) -> None:
+        """Write the chunks of a rendered template to the given file as they are generated.
+
+        The chunks are buffered up to `_STREAMING_BUFFER_SIZE` characters, so that not every
+        (possibly tiny) chunk results in a separate write.
+        Streamed files are written right away, they are not part of a batch.
+        """
+        file = AsyncPath(self.root_dir, path)
+        await asyncio.to_thread(self._make_dirs, Path(file.parent))
+        # NOTE: like `write_file`, the content is encoded as UTF-8, regardless of the locale.
+        async with file.open("w", encoding="utf-8") as f:
+            buffer: list[str] = []
+            buffer_size = 0
+            async for chunk in chunks:
+                buffer.append(chunk)
+                buffer_size += len(chunk)
+                if buffer_size >= _STREAMING_BUFFER_SIZE:
+                    await f.write("".join(buffer))
+                    buffer.clear()
+                    buffer_size = 0
+            if buffer:
+                await f.write("".join(buffer))
+        await asyncio.to_thread(apply_path_mode, Path(file), mode)
+
+    async def copy_file(self, path: Path, source: Path, mode: int) -> None:
+        await self._enqueue(functools.partial(self._copy_file, self.root_dir / path, source, mode))
+
+    async def write_symlink(self, path: Path, target: str, mode: int) -> None:
+        await self._enqueue(functools.partial(self._write_symlink, self.root_dir / path, target, mode))
+
+    async def flush(self) -> None:
+        """Write all queued entries."""
+        if not self._pending:
+            return
+        operations, self._pending, self._pending_bytes = self._pending, [], 0
+        await asyncio.to_thread(_run_all, operations)
+
+    async def _enqueue(self, operation: typing.Callable[[], None], size: int = 0) -> None:
+        self._pending.append(operation)
+        self._pending_bytes += size
+        if len(self._pending) >= self.batch_size or self._pending_bytes >= _WRITE_BATCH_MAX_BYTES:
+            await self.flush()
+
+    def _make_dirs(self, directory: Path) -> None:
+        if directory not in self._created_dirs:
+            directory.mkdir(parents=True, exist_ok=True)
+            self._created_dirs.add(directory)
+
+    def _write_directory(self, directory: Path, mode: int) -> None:
+        self._make_dirs(directory)
+        apply_path_mode(directory, mode)
+
+    def _write_file(self, file: Path, content: bytes, mode: int) -> None:
+        self._make_dirs(file.parent)
+        with file.open("wb") as f:
+            f.write(content)
+            # NOTE: changing the mode of the open file saves the path lookup of `chmod`.
+            os.fchmod(f.fileno(), stat.S_IMODE(mode))
+
+    def _copy_file(self, file: Path, source: Path, mode: int) -> None:
+        self._make_dirs(file.parent)
+        copy_file_content(source, file)
+        apply_path_mode(file, mode)
+
+    def _write_symlink(self, symlink: Path, target: str, mode: int) -> None:
+        self._make_dirs(symlink.parent)
+        symlink.symlink_to(target)
+        apply_path_mode(symlink, mode)
+
+
+@dataclass(frozen=True)
+class InMemoryEntry:
+    """Represents a rendered entry held by an `InMemorySink`."""
+
+    #: Holds the mode of the entry
+    mode: int
+    #: Holds the content of the entry if it's a file
+    content: bytes | None = None
+    #: Holds the target of the entry if it's a symlink
+    symlink_target: str | None = None
+    #: Holds the hash of the type, mode and content of the entry, computed when the entry is written
+    digest: bytes = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        if self.symlink_target is not None:
+            digest = hashlib.sha256(b"symlink %o\0" % self.mode)
+            digest.update(self.symlink_target.encode("utf-8"))
+        elif self.content is not None:
+            digest = hashlib.sha256(b"file %o\0" % self.mode)
+            digest.update(self.content)
+        else:
+            digest = hashlib.sha256(b"directory %o\0" % self.mode)
+        object.__setattr__(self, "digest", digest.digest())
+
+
+class InMemorySink:
+    """Hold the rendered entries in memory.
+
+    This is useful for renderings which are only used to be compared with
+    each other, e.g. when updating an incarnation.
+    The entries are kept in the order they have been written.
+    Text content is stored UTF-8 encoded.
+    """
+
+    def __init__(self, entries: dict[Path, InMemoryEntry] | None = None):
+        self.entries: dict[Path, InMemoryEntry] = entries if entries is not None else {}
+
+    async def write_directory(self, path: Path, mode: int) -> None:
+        self.entries[path] = InMemoryEntry(mode)
+
+    async def write_file(self, path: Path, content: str | bytes, mode: int) -> None:
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        self.entries[path] = InMemoryEntry(mode, content=content)
+
+    async def write_file_chunks(self, path: Path, chunks: typing.AsyncIterator[str], mode: int) -> None:
+        await self.write_file(path, "".join([c async for c in chunks]), mode)
+
+    async def copy_file(self, path: Path, source: Path, mode: int) -> None:
+        self.entries[path] = InMemoryEntry(mode, content=await asyncio.to_thread(source.read_bytes))
+
+    async def write_symlink(self, path: Path, target: str, mode: int) -> None:
+        self.entries[path] = InMemoryEntry(mode, symlink_target=target)
+
+    async def flush(self) -> None:
+        pass
+
+    def read_bytes(self, path: Path) -> bytes | None:
+        """Read the content of the file at the given path, `None` if there is no such file."""
+        if (entry := self.entries.get(path)) is None:
+            return None
+        return entry.content
+
+    async def replay(self, sink: RenderSink) -> None:
+        """Write all entries of this sink to another sink."""
+        for path, entry in self.entries.items():
+            if entry.symlink_target is not None:
+                await sink.write_symlink(path, entry.symlink_target, entry.mode)
+            elif entry.content is not None:
+                await sink.write_file(path, entry.content, entry.mode)
+            else:
+                await sink.write_directory(path, entry.mode)
+        await sink.flush()
+
+    async def write_to(self, directory: Path) -> None:
+        """Write all entries of this sink to the given directory."""
+        await self.replay(DirectorySink(directory, batch_size=WRITE_BATCH_SIZE))
+
+
+def _run_all(operations: list[typing.Callable[[], None]]) -> None:
+    for operation in operations:
+        operation()
+
+
+def copy_file_content(source: Path, destination: Path) -> None:
+    """Copy the bytes of the `source` file to the `destination` file without decoding them.
+
+    The copy is done in the kernel using `copy_file_range`, which shares the data blocks
+    (reflink) on copy-on-write file systems like btrfs or XFS.
+    If that's not supported by the platform or file systems, `shutil.copyfile` is used,
+    which falls back to `sendfile` or the platform specific fast-copy mechanism.
+
+    Hardlinks are deliberately not used, because the incarnation file must be independent
+    of the template file, e.g. when its mode is changed.
+    """
+    if hasattr(os, "copy_file_range"):
+        try:
+            with source.open("rb") as fsrc, destination.open("wb") as fdst:
+                while os.copy_file_range(fsrc.fileno(), fdst.fileno(), _COPY_FILE_RANGE_CHUNK_SIZE) > 0:
+                    pass
+            return
+        except OSError as exc:
+            if exc.errno not in _COPY_FILE_RANGE_UNSUPPORTED_ERRNOS:
+                raise
+
+    shutil.copyfile(source, destination)
+
+
+def apply_path_stats(path: Path, target_stat: os.stat_result) -> None:
+    """Apply the stats obtained from one path to another path.
+
+    See `apply_path_mode`.
+    """
+    apply_path_mode(path, target_stat.st_mode)
+
+
+def apply_path_mode(path: Path, mode: int) -> None:
+    """Apply the mode obtained from one path to another path.
+
+    Insights:
+
+        fengine mainly operates within Git repositories.
+        Git doesn't store information about the owners and also ONLY
+        tracks the executable bit of a UNIX file permissions, meaning that
+        only the modes `100755` and `100644` are supported.
+
+        However, this function still applies the entire mode (reported by `stat`),
+        to keep things simple.
+        It also doesn't affect the ownership of the file.
+
+    This function doesn't follow symlinks. Whether `path` is a symlink is
+    derived from the given `mode`.
+    """
+    chmod = functools.partial(path.chmod, mode)
+    if stat.S_ISLNK(mode):
+        try:
+            chmod(follow_symlinks=False)
+        except NotImplementedError:
+            # NOTE(TF): some UNIX platforms (like Linux) don't allow to change permissions
+            #           on symlinks. They ALWAYS get 0o777.
+            #           Thus, we don't do nothing here.
+            pass
+    else:
+        chmod()
@@ -1,22 +1,56 @@
+import asyncio
+import typing
 from pathlib import Path
 from tempfile import TemporaryDirectory
 
 from foxops import utils
+from foxops.engine.caching import RenderingCache, get_rendering_cache
+from foxops.engine.dependencies import get_template_paths_affected_by_update
 from foxops.engine.fvars import merge_template_data_with_fvars
 from foxops.engine.initialization import _initialize_incarnation
+from foxops.engine.merkle import prune_unchanged_subtrees
 from foxops.engine.models import IncarnationState, TemplateData, load_incarnation_state
+from foxops.engine.sinks import InMemorySink
+from foxops.external.git import GitRepository
 from foxops.logger import get_logger
 
 #: Holds the module logger
 logger = get_logger(__name__)
 
+T = typing.TypeVar("T")
+
+#: Holds the name of the directory in a template repository which contains the template
+TEMPLATE_DIRECTORY_NAME = "template"
+
+
+class DiffPatchFunc(typing.Protocol):
+    """Diffs two rendered incarnations and applies the changes to the incarnation in `patch_directory`.
+
+    The rendered incarnations are either directories or `InMemorySink`s, `update_incarnation` always passes
+    the latter. They may only contain the subtrees which differ, see `prune_unchanged_subtrees`.
+    Files with rejected hunks get a `.rej` file next to them, like with `git apply --reject`.
+
+    Returns `None` if there are no changes, otherwise the files with conflicts
+    relative to the root of the repository the incarnation is in.
+    See `diff_and_patch`, `tree_diff_and_patch`, `index_diff_and_patch` and `inprocess_diff_and_patch`.
+    """
+
+    async def __call__(
+        self,
+        diff_a_directory: Path | InMemorySink,
+        diff_b_directory: Path | InMemorySink,
+        patch_directory: Path,
+    ) -> list[Path] | None:
+        ...
+
 
 async def update_incarnation_from_git_template_repository(
     template_git_repository: Path,
     update_template_repository_version: str,
     update_template_data: TemplateData,
     incarnation_root_dir: Path,
-    diff_patch_func,
+    diff_patch_func: DiffPatchFunc,
+    rendering_processes: int | None = None,
 ) -> tuple[bool, IncarnationState, list[Path] | None]:
     # initialize pristine incarnation from current incarnation state
     current_incarnation_state_path = incarnation_root_dir / ".fengine.yaml"
@@ -48,6 +82,13 @@ async def update_incarnation_from_git_template_repository(
             cwd=template_git_repository,
         )
 
+        changed_files = await GitRepository(template_git_repository).changed_files(
+            current_incarnation_state.template_repository_version_hash,
+            update_template_repository_version,
+            path=TEMPLATE_DIRECTORY_NAME,
+        )
+        logger.debug(f"{len(changed_files)} template files changed between the template versions")
+
         return await update_incarnation(
             original_template_root_dir=Path(original_template_root_dir),
             updated_template_root_dir=Path(updated_template_root_dir),
@@ -55,6 +96,8 @@ async def update_incarnation_from_git_template_repository(
             updated_template_data=update_template_data,
             incarnation_root_dir=incarnation_root_dir,
             diff_patch_func=diff_patch_func,
+            rendering_processes=rendering_processes,
+            changed_template_paths=[p.relative_to(TEMPLATE_DIRECTORY_NAME) for p in changed_files],
         )
 
 
@@ -64,59 +107,190 @@ async def update_incarnation(
     updated_template_repository_version: str,
     updated_template_data: TemplateData,
     incarnation_root_dir: Path,
-    diff_patch_func,
+    diff_patch_func: DiffPatchFunc,
+    rendering_processes: int | None = None,
+    changed_template_paths: list[Path] | None = None,
 ) -> tuple[bool, IncarnationState, list[Path] | None]:
-    """Update an incarnation with a new version of a template."""
+    """Update an incarnation with a new version of a template.
+
+    The pristine and the updated incarnation are rendered in memory, see `InMemorySink`,
+    and passed as such to the `diff_patch_func`, thus, it must accept `InMemorySink`s, see `DiffPatchFunc`.
+
+    If the `changed_template_paths` between the two template versions are given (relative to
+    the `template` directory of the template), only the changed files and the files affected by
+    changed template data are rendered for both incarnations, see `get_template_paths_affected_by_update`.
+    Otherwise, if the template version doesn't change, only the files affected by the changed
+    template data are rendered again for the updated incarnation.
+
+    If the rendering cache is enabled, the pristine incarnation is looked up there. On a cache miss,
+    it's rendered completely, regardless of the `changed_template_paths`, and the complete renderings
+    are recorded after the update under the incarnation states they have been rendered from,
+    see `RenderingCache`.
+
+    Only the subtrees of the incarnations which Merkle hashes differ are passed to the
+    `diff_patch_func`, which isn't called at all if the root hashes match, see `prune_unchanged_subtrees`.
+    """
     # initialize pristine incarnation from current incarnation state
     current_incarnation_state_path = incarnation_root_dir / ".fengine.yaml"
     current_incarnation_state = load_incarnation_state(current_incarnation_state_path)
+    updated_template_data = merge_template_data_with_fvars(updated_template_data, incarnation_root_dir)
+
+    template_paths = None
+    if changed_template_paths is not None:
+        template_paths = await get_template_paths_affected_by_update(
+            original_template_root_dir,
+            updated_template_root_dir,
+            changed_template_paths,
+            current_incarnation_state.template_data,
+            updated_template_data,
+        )
+
+    rendering_cache = get_rendering_cache()
+    cached_pristine_incarnation = None
+    if rendering_cache is not None and await _is_clean_checkout(
+        original_template_root_dir, current_incarnation_state.template_repository_version_hash
+    ):
+        cached_pristine_incarnation = await asyncio.to_thread(rendering_cache.load, current_incarnation_state)
+
+    pristine_incarnation = cached_pristine_incarnation or InMemorySink()
+    # NOTE: with a rendering cache, the pristine incarnation is rendered completely (instead of only
+    #       the `template_paths`), so that it can be stored and the following updates hit the cache.
+    render_complete_pristine_incarnation = rendering_cache is not None
+    pristine_incarnation_is_complete = (
+        cached_pristine_incarnation is not None or template_paths is None or render_complete_pristine_incarnation
+    )
+    # NOTE: the updated incarnation is derived from a complete pristine incarnation if possible,
+    #       otherwise, the two incarnations are independent of each other and rendered concurrently.
+    derive_updated_incarnation = pristine_incarnation_is_complete and (
+        template_paths is not None
+        or await _is_same_template_version(original_template_root_dir, updated_template_root_dir)
+    )
+
+    async def _initialize_pristine_incarnation() -> IncarnationState:
+        if cached_pristine_incarnation is not None:
+            logger.debug("use cached pristine incarnation from current incarnation state")
+            return current_incarnation_state
 
-    with TemporaryDirectory() as tmp_pristine_incarnation_dir, TemporaryDirectory() as tmp_updated_incarnation_dir:
         logger.debug(
             "initialize pristine incarnation from current incarnation state",
             template_dir=original_template_root_dir,
-            incarnation_dir=tmp_pristine_incarnation_dir,
         )
-        await _initialize_incarnation(
+        return await _initialize_incarnation(
             template_root_dir=original_template_root_dir,
             template_repository=current_incarnation_state.template_repository,
             template_repository_version=current_incarnation_state.template_repository_version,
             template_data=current_incarnation_state.template_data,
-            incarnation_root_dir=Path(tmp_pristine_incarnation_dir),
+            incarnation_root_dir=pristine_incarnation,
+            rendering_processes=rendering_processes,
+            template_paths=None if render_complete_pristine_incarnation else template_paths,
         )
 
+    updated_incarnation = InMemorySink()
+
+    async def _initialize_updated_incarnation(
+        previous_rendering: tuple[IncarnationState, InMemorySink] | None
+    ) -> IncarnationState:
         logger.debug(
             "initialize new incarnation from update incarnation state",
             template_dir=updated_template_root_dir,
-            incarnation_dir=tmp_updated_incarnation_dir,
         )
-        updated_incarnation_state = await _initialize_incarnation(
+        return await _initialize_incarnation(
             template_root_dir=updated_template_root_dir,
             template_repository=current_incarnation_state.template_repository,
             template_repository_version=updated_template_repository_version,
-            template_data=merge_template_data_with_fvars(
-                updated_template_data,
-                incarnation_root_dir,
-            ),
-            incarnation_root_dir=Path(tmp_updated_incarnation_dir),
+            template_data=updated_template_data,
+            incarnation_root_dir=updated_incarnation,
+            rendering_processes=rendering_processes,
+            previous_rendering=previous_rendering,
+            template_paths=template_paths,
+        )
+
+    if derive_updated_incarnation:
+        pristine_incarnation_state = await _initialize_pristine_incarnation()
+        updated_incarnation_state = await _initialize_updated_incarnation(
+            (pristine_incarnation_state, pristine_incarnation)
         )
+    else:
+        pristine_incarnation_state, updated_incarnation_state = await gather_in_order(
+            _initialize_pristine_incarnation(),
+            _initialize_updated_incarnation(None),
+        )
+    updated_incarnation_is_complete = derive_updated_incarnation or template_paths is None
 
-        # diff pristine and new incarnations
-        # apply patch on incarnation to update
+    # diff pristine and new incarnations
+    # apply patch on incarnation to update
+    changed_incarnations = await asyncio.to_thread(prune_unchanged_subtrees, pristine_incarnation, updated_incarnation)
+    if changed_incarnations is None:
+        logger.debug("pristine and new incarnations have the same root hash, no patch to apply")
+        files_with_conflicts = None
+    else:
         logger.debug(
             "applying patch on pristine and new incarnations",
-            diff_a_directory=tmp_pristine_incarnation_dir,
-            diff_b_directory=tmp_updated_incarnation_dir,
             patch_directory=incarnation_root_dir,
         )
-        if (
-            files_with_conflicts := await diff_patch_func(
-                diff_a_directory=tmp_pristine_incarnation_dir,
-                diff_b_directory=tmp_updated_incarnation_dir,
-                patch_directory=incarnation_root_dir,
+        files_with_conflicts = await diff_patch_func(
+            diff_a_directory=changed_incarnations[0],
+            diff_b_directory=changed_incarnations[1],
+            patch_directory=incarnation_root_dir,
+        )
+
+    if rendering_cache is not None:
+        if cached_pristine_incarnation is None and pristine_incarnation_is_complete:
+            await _store_rendering(
+                rendering_cache, original_template_root_dir, pristine_incarnation_state, pristine_incarnation
+            )
+        if updated_incarnation_is_complete:
+            await _store_rendering(
+                rendering_cache, updated_template_root_dir, updated_incarnation_state, updated_incarnation
             )
-        ) is not None:
-            return True, updated_incarnation_state, files_with_conflicts
-        else:
-            logger.debug("Update didn't change anything")
-            return False, updated_incarnation_state, None
+
+    if files_with_conflicts is not None:
+        return True, updated_incarnation_state, files_with_conflicts
+    else:
+        logger.debug("Update didn't change anything")
+        return False, updated_incarnation_state, None
+
+
+async def gather_in_order(*aws: typing.Awaitable[T]) -> list[T]:
+    """Run the given awaitables concurrently and return their results in order.
+
+    In contrast to `asyncio.gather`, all awaitables are run to completion, even if one of them fails.
+    If any of them fails, the error of the first failed awaitable (in the given order) is raised.
+    Thus, the raised error doesn't depend on which awaitable fails faster.
+    """
+    results = await asyncio.gather(*aws, return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return typing.cast(list[T], results)
+
+
+async def _store_rendering(
+    rendering_cache: RenderingCache,
+    template_root_dir: Path,
+    incarnation_state: IncarnationState,
+    incarnation: InMemorySink,
+) -> None:
+    # NOTE: renderings of modified templates don't match the template version of their incarnation state.
+    if not await GitRepository(template_root_dir).has_uncommitted_changes():
+        await asyncio.to_thread(rendering_cache.store, incarnation_state, incarnation)
+
+
+async def _is_clean_checkout(template_root_dir: Path, template_repository_version_hash: str) -> bool:
+    """Check if the template directory holds the given, unmodified template version."""
+    template_repository = GitRepository(template_root_dir)
+    return (
+        await template_repository.head() == template_repository_version_hash
+        and not await template_repository.has_uncommitted_changes()
+    )
+
+
+async def _is_same_template_version(original_template_root_dir: Path, updated_template_root_dir: Path) -> bool:
+    """Check if both template directories hold the same, unmodified template version."""
+    original_repository = GitRepository(original_template_root_dir)
+    updated_repository = GitRepository(updated_template_root_dir)
+    if await original_repository.head() != await updated_repository.head():
+        return False
+    return not (
+        await original_repository.has_uncommitted_changes() or await updated_repository.has_uncommitted_changes()
+    )
@@ -117,6 +117,28 @@ class GitRepository:
 
         return stdout.decode()
 
+    async def changed_files(self, ref_old: str, ref_new: str, path: str | None = None) -> list[Path]:
+        """Get the files changed between the given refs, relative to the repository root.
+
+        Renames are reported as a deletion of the old path and an addition of the new path.
+        """
+        cmdline = ["git", "diff", "--name-only", "--no-renames", "-z", ref_old, ref_new]
+        if path is not None:
+            cmdline.extend(["--", path])
+        # NOTE: the output is read while the process is running, because it may not fit into the pipe buffer.
+        proc = await asyncio.create_subprocess_exec(
+            *cmdline,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            cwd=str(self.directory),
+        )
+        stdout, stderr = await proc.communicate()
+
+        if proc.returncode != 0:
+            raise GitError(message=stderr)
+
+        return [Path(p.decode("utf-8")) for p in stdout.split(b"\0") if p]
+
     async def current_branch(self) -> str:
         proc = await self._run("branch", "--show-current")
         if proc.stdout is None:
@@ -140,6 +162,23 @@ class GitRepository:
 
         return await self.head()
 
+    async def has_uncommitted_changes(self) -> bool:
+        # NOTE: the output is read while the process is running, because it may not fit into the pipe buffer.
+        proc = await asyncio.create_subprocess_exec(
+            "git",
+            "status",
+            "--porcelain",
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            cwd=str(self.directory),
+        )
+        stdout, stderr = await proc.communicate()
+
+        if proc.returncode != 0:
+            raise GitError(message=stderr)
+
+        return len(stdout.strip()) > 0
+
     async def head(self) -> str:
         proc = await self._run("rev-parse", "HEAD")
         if proc.stdout is None:
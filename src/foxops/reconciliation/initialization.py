@@ -104,13 +104,16 @@ async def initialize_incarnation(
             exist_ok=True,
         )
 
-        _ = await fengine.initialize_incarnation(
-            template_root_dir=local_template_repository.directory,
-            template_repository=desired_incarnation_state.template_repository,
-            template_repository_version=desired_incarnation_state.template_repository_version,
-            template_data=desired_incarnation_state.template_data,
-            incarnation_root_dir=(local_incarnation_repository.directory / desired_incarnation_state.target_directory),
-        )
+        with fengine.log_rendering_profile(logger):
+            _ = await fengine.initialize_incarnation(
+                template_root_dir=local_template_repository.directory,
+                template_repository=desired_incarnation_state.template_repository,
+                template_repository_version=desired_incarnation_state.template_repository_version,
+                template_data=desired_incarnation_state.template_data,
+                incarnation_root_dir=(
+                    local_incarnation_repository.directory / desired_incarnation_state.target_directory
+                ),
+            )
 
         await local_incarnation_repository.commit_all(
             f"foxops: initializing incarnation from template {desired_incarnation_state.template_repository} "
@@ -82,17 +82,18 @@ async def update_incarnation(
         logger.debug(f"Creating new update branch {update_branch} in incarnation repository")
         await local_incarnation_repository.create_and_checkout_branch(update_branch)
 
-        (
-            update_performed,
-            updated_incarnation_state,
-            files_with_conflicts,
-        ) = await fengine.update_incarnation_from_git_template_repository(
-            template_git_repository=local_template_repository.directory,
-            update_template_repository_version=template_repository_version_update,
-            update_template_data=template_data_update,
-            incarnation_root_dir=(local_incarnation_repository.directory / incarnation.target_directory),
-            diff_patch_func=fengine.diff_and_patch,
-        )
+        with fengine.log_rendering_profile(logger):
+            (
+                update_performed,
+                updated_incarnation_state,
+                files_with_conflicts,
+            ) = await fengine.update_incarnation_from_git_template_repository(
+                template_git_repository=local_template_repository.directory,
+                update_template_repository_version=template_repository_version_update,
+                update_template_data=template_data_update,
+                incarnation_root_dir=(local_incarnation_repository.directory / incarnation.target_directory),
+                diff_patch_func=fengine.diff_and_patch,
+            )
 
         if not update_performed:
             # FIXME: what is the proper thing to do here?
@@ -0,0 +1,277 @@
+import os
+import shutil
+from pathlib import Path
+
+import pytest
+from pytest_mock import MockerFixture
+
+from foxops import utils
+from foxops.engine import (
+    IncarnationState,
+    caching,
+    diff_and_patch,
+    initialize_incarnation,
+    rendering,
+    update_incarnation,
+    update_incarnation_from_git_template_repository,
+)
+from foxops.engine.caching import (
+    RenderingCache,
+    TemplateBytecodeCache,
+    prune_least_recently_used,
+)
+from foxops.engine.rendering import render_template
+from foxops.engine.settings import get_engine_settings
+from foxops.engine.sinks import InMemorySink
+from foxops.external.git import GitRepository
+
+
+@pytest.fixture
+def template_cache_dir(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    cache_dir = tmp_path / "cache"
+    monkeypatch.setattr(get_engine_settings(), "template_cache_dir", cache_dir)
+    return cache_dir
+
+
+async def test_compiled_templates_are_reused_for_same_template_version_in_other_directory(
+    tmp_path: Path, template_cache_dir: Path, mocker: MockerFixture
+):
+    # GIVEN
+    template_dir = tmp_path / "template"
+    template_dir.mkdir()
+    (template_dir / "README.md").write_text("{{ data }}")
+    other_template_dir = tmp_path / "other-template"
+    shutil.copytree(template_dir, other_template_dir)
+    dump_spy = mocker.spy(TemplateBytecodeCache, "dump_bytecode")
+
+    # WHEN
+    for idx, directory in enumerate([template_dir, other_template_dir]):
+        incarnation_dir = tmp_path / f"incarnation-{idx}"
+        incarnation_dir.mkdir()
+        await render_template(
+            directory,
+            incarnation_dir,
+            {"data": f"Hello {idx}"},
+            [],
+            template_repository_version_hash="any-sha",
+        )
+
+    # THEN
+    assert dump_spy.call_count == 1
+    assert (tmp_path / "incarnation-1" / "README.md").read_text() == "Hello 1"
+
+
+async def test_template_cache_is_only_pruned_after_writing_compiled_templates(
+    tmp_path: Path, template_cache_dir: Path, mocker: MockerFixture
+):
+    # GIVEN
+    template_dir = tmp_path / "template"
+    template_dir.mkdir()
+    (template_dir / "README.md").write_text("{{ data }}")
+    prune_spy = mocker.spy(caching, "prune_template_cache")
+
+    # WHEN
+    for idx in range(2):
+        await render_template(
+            template_dir, InMemorySink(), {"data": f"Hello {idx}"}, [], template_repository_version_hash="any-sha"
+        )
+
+    # THEN
+    assert prune_spy.call_count == 1
+
+
+async def test_compiled_templates_are_not_reused_when_the_template_source_changed(
+    tmp_path: Path, template_cache_dir: Path
+):
+    # GIVEN
+    template_dir = tmp_path / "template"
+    template_dir.mkdir()
+    (template_dir / "README.md").write_text("old: {{ data }}")
+    await render_template(
+        template_dir, tmp_path / "incarnation-old", {"data": "foo"}, [], template_repository_version_hash="any-sha"
+    )
+
+    # WHEN
+    (template_dir / "README.md").write_text("new: {{ data }}")
+    await render_template(
+        template_dir, tmp_path / "incarnation-new", {"data": "foo"}, [], template_repository_version_hash="any-sha"
+    )
+
+    # THEN
+    assert (tmp_path / "incarnation-new" / "README.md").read_text() == "new: foo"
+
+
+def test_prune_least_recently_used_removes_oldest_entries_first(tmp_path: Path):
+    # GIVEN
+    for idx in range(4):
+        entry = tmp_path / f"entry-{idx}.cache"
+        entry.write_bytes(b"x" * 10)
+        os.utime(entry, (idx, idx))
+    (tmp_path / "unrelated.txt").write_bytes(b"x" * 100)
+
+    # WHEN
+    prune_least_recently_used(tmp_path, "entry-*.cache", max_size=25)
+
+    # THEN
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["entry-2.cache", "entry-3.cache", "unrelated.txt"]
+
+
+@pytest.fixture
+def rendering_cache_dir(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    cache_dir = tmp_path / "rendering-cache"
+    monkeypatch.setattr(get_engine_settings(), "rendering_cache_dir", cache_dir)
+    return cache_dir
+
+
+async def test_rendering_cache_restores_stored_rendering(tmp_path: Path):
+    # GIVEN
+    template_dir = tmp_path / "template"
+    (template_dir / "{{ name }}").mkdir(parents=True)
+    (template_dir / "{{ name }}" / "run.sh").write_text("echo {{ name }}")
+    (template_dir / "{{ name }}" / "run.sh").chmod(0o755)
+    (template_dir / "logo.png").write_bytes(b"\x89PNG\r\n\x1a\n\xff")
+    (template_dir / "README-symlink").symlink_to("{{ name }}/run.sh")
+    incarnation = InMemorySink()
+    await render_template(template_dir, incarnation, {"name": "jon"}, ["*.png"])
+    cache = RenderingCache(tmp_path / "cache", max_size=1024 * 1024)
+    incarnation_state = IncarnationState("any-url", "any-version", "any-sha", {"name": "jon"})
+
+    # WHEN
+    cache.store(incarnation_state, incarnation)
+    cached_incarnation = cache.load(incarnation_state)
+
+    # THEN
+    assert cached_incarnation is not None
+    assert cached_incarnation.entries == incarnation.entries
+    assert cache.load(IncarnationState("any-url", "any-version", "any-sha", {"name": "ygritte"})) is None
+
+
+async def test_update_uses_cached_pristine_incarnation(
+    tmp_path: Path, rendering_cache_dir: Path, mocker: MockerFixture
+):
+    # GIVEN
+    template_dir = tmp_path / "template"
+    (template_dir / "template").mkdir(parents=True)
+    (template_dir / "template" / "README.md").write_text("{{ name }}")
+    await _commit_all(template_dir)
+    updated_template_dir = tmp_path / "updated-template"
+    shutil.copytree(template_dir, updated_template_dir)
+    (updated_template_dir / "template" / "README.md").write_text("Hello {{ name }}")
+    await _commit_all(updated_template_dir)
+
+    incarnation_dir = tmp_path / "incarnation"
+    incarnation_dir.mkdir()
+    incarnation_state = await initialize_incarnation(template_dir, "any-url", "v1", {"name": "jon"}, incarnation_dir)
+    await _commit_all(incarnation_dir)
+
+    async def _update():
+        return await update_incarnation(
+            original_template_root_dir=template_dir,
+            updated_template_root_dir=updated_template_dir,
+            updated_template_repository_version="v2",
+            updated_template_data=incarnation_state.template_data,
+            incarnation_root_dir=incarnation_dir,
+            diff_patch_func=diff_and_patch,
+        )
+
+    await _update()
+    await utils.check_call("git", "checkout", ".", cwd=incarnation_dir)
+    render_spy = mocker.spy(rendering, "render_template_file")
+
+    # WHEN
+    update_performed, updated_incarnation_state, _ = await _update()
+
+    # THEN
+    assert update_performed
+    assert render_spy.call_count == 1
+    assert (incarnation_dir / "README.md").read_text() == "Hello jon"
+    assert RenderingCache(rendering_cache_dir, max_size=1024 * 1024).load(updated_incarnation_state) is not None
+
+
+async def test_update_from_git_template_repository_populates_and_uses_rendering_cache(
+    tmp_path: Path, template_cache_dir: Path, rendering_cache_dir: Path, mocker: MockerFixture
+):
+    # GIVEN
+    template_dir = tmp_path / "template"
+    (template_dir / "template").mkdir(parents=True)
+    (template_dir / "template" / "README.md").write_text("{{ name }}")
+    (template_dir / "template" / "LICENSE").write_text("unchanged")
+    await _commit_all(template_dir)
+    (template_dir / "template" / "README.md").write_text("Hello {{ name }}")
+    await utils.check_call("git", "commit", "-am", "update", cwd=template_dir)
+    updated_template_version = await GitRepository(template_dir).head()
+    await utils.check_call("git", "checkout", "--quiet", "HEAD~1", cwd=template_dir)
+
+    incarnation_dir = tmp_path / "incarnation"
+    incarnation_dir.mkdir()
+    incarnation_state = await initialize_incarnation(template_dir, "any-url", "v1", {"name": "jon"}, incarnation_dir)
+    await _commit_all(incarnation_dir)
+
+    async def _update():
+        return await update_incarnation_from_git_template_repository(
+            template_git_repository=template_dir,
+            update_template_repository_version=updated_template_version,
+            update_template_data=incarnation_state.template_data,
+            incarnation_root_dir=incarnation_dir,
+            diff_patch_func=diff_and_patch,
+        )
+
+    await _update()
+    await utils.check_call("git", "checkout", ".", cwd=incarnation_dir)
+    load_spy = mocker.spy(RenderingCache, "load")
+    render_spy = mocker.spy(rendering, "render_template_file")
+
+    # WHEN
+    update_performed, _, _ = await _update()
+
+    # THEN
+    assert update_performed
+    assert load_spy.spy_return is not None
+    assert render_spy.call_count == 1
+    assert (incarnation_dir / "README.md").read_text() == "Hello jon"
+
+
+async def test_update_renaming_a_templated_directory_leaves_no_stale_directory_in_the_rendering(
+    tmp_path: Path, template_cache_dir: Path, rendering_cache_dir: Path
+):
+    # GIVEN
+    template_dir = tmp_path / "template"
+    (template_dir / "template" / "{{ name }}").mkdir(parents=True)
+    (template_dir / "template" / "{{ name }}" / "README.md").write_text("{{ name }}")
+    (template_dir / "template" / "LICENSE").write_text("unchanged")
+    await _commit_all(template_dir)
+    await utils.check_call("git", "mv", "template/{{ name }}", "template/{{ name }}-docs", cwd=template_dir)
+    await utils.check_call("git", "commit", "-m", "rename", cwd=template_dir)
+    updated_template_version = await GitRepository(template_dir).head()
+    await utils.check_call("git", "checkout", "--quiet", "HEAD~1", cwd=template_dir)
+
+    incarnation_dir = tmp_path / "incarnation"
+    incarnation_dir.mkdir()
+    incarnation_state = await initialize_incarnation(template_dir, "any-url", "v1", {"name": "jon"}, incarnation_dir)
+    await _commit_all(incarnation_dir)
+
+    # WHEN
+    update_performed, updated_incarnation_state, _ = await update_incarnation_from_git_template_repository(
+        template_git_repository=template_dir,
+        update_template_repository_version=updated_template_version,
+        update_template_data=incarnation_state.template_data,
+        incarnation_root_dir=incarnation_dir,
+        diff_patch_func=diff_and_patch,
+    )
+
+    # THEN
+    assert update_performed
+    assert not (incarnation_dir / "jon").exists()
+    assert (incarnation_dir / "jon-docs" / "README.md").read_text() == "jon"
+    cached_rendering = RenderingCache(rendering_cache_dir, max_size=1024 * 1024).load(updated_incarnation_state)
+    assert cached_rendering is not None
+    assert Path("jon") not in cached_rendering.entries
+    assert Path("jon-docs") in cached_rendering.entries
+
+
+async def _commit_all(directory: Path) -> None:
+    await utils.check_call("git", "init", ".", cwd=directory)
+    await utils.check_call("git", "config", "user.name", "test", cwd=directory)
+    await utils.check_call("git", "config", "user.email", "test@test.com", cwd=directory)
+    await utils.check_call("git", "add", ".", cwd=directory)
+    await utils.check_call("git", "commit", "-m", "commit", cwd=directory)
@@ -169,6 +169,65 @@ def test_app_should_initialize_incarnation_from_template_with_variables(
     assert (incarnation_dir / "README.md").read_text() == "# Hello, jon of age 42!"
 
 
+def test_app_should_initialize_incarnation_with_multiple_rendering_processes(
+    cli_runner: CliRunner,
+    template_repository_with_two_versions: Path,
+    tmp_path: Path,
+):
+    # GIVEN
+    incarnation_dir = tmp_path / "incarnation"
+
+    # WHEN
+    result = cli_runner.invoke(
+        app,
+        [
+            "initialize",
+            str(template_repository_with_two_versions),
+            str(incarnation_dir),
+            "-d",
+            "name=jon",
+            "-d",
+            "age=42",
+            "--processes",
+            "2",
+        ],
+    )
+
+    # THEN
+    assert result.exit_code == 0
+    assert (incarnation_dir / "README.md").read_text() == "# Hello, jon of age 42!"
+    assert (incarnation_dir / "info.txt").read_text() == "some info for jon."
+
+
+def test_app_should_print_the_slowest_template_files_when_profiling(
+    cli_runner: CliRunner,
+    template_repository: Path,
+    tmp_path: Path,
+):
+    # GIVEN
+    incarnation_dir = tmp_path / "incarnation"
+
+    # WHEN
+    result = cli_runner.invoke(
+        app,
+        [
+            "initialize",
+            str(template_repository),
+            str(incarnation_dir),
+            "-d",
+            "name=jon",
+            "-d",
+            "age=42",
+            "--profile",
+        ],
+    )
+
+    # THEN
+    assert result.exit_code == 0
+    assert "rendered 1 template files" in result.stdout
+    assert "README.md" in result.stdout
+
+
 def test_app_should_initialize_incarnation_of_specific_template_version(
     cli_runner: CliRunner,
     template_repository_with_two_versions: Path,
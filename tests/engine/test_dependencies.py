@@ -0,0 +1,165 @@
+import hashlib
+from pathlib import Path
+
+from pytest_mock import MockerFixture
+
+from foxops.engine import dependencies
+from foxops.engine.dependencies import (
+    TemplateVersionManifest,
+    VariableDependencyIndex,
+    build_template_version_manifest,
+    build_variable_dependency_index,
+    get_changed_variables,
+    get_template_paths_affected_by_update,
+    get_template_version_manifest,
+)
+from foxops.engine.manifest import scan_template
+from foxops.engine.rendering import create_template_environment, render_template
+from foxops.engine.settings import get_engine_settings
+
+
+def test_variable_dependency_index_maps_variables_to_dependent_entries(tmp_path: Path):
+    # GIVEN
+    (tmp_path / "{{ name }}").mkdir()
+    (tmp_path / "{{ name }}" / "README.md").write_text("no variables")
+    (tmp_path / "config-{{ env }}.yaml").write_text("{% for x in items %}{{ x }}{{ sep }}{% endfor %}")
+    (tmp_path / "base.txt").write_text("{{ base }}")
+    (tmp_path / "included.txt").write_text("{% include 'base.txt' %}")
+    (tmp_path / "logo.png").write_text("{{ not_rendered }}")
+    (tmp_path / "link").symlink_to("{{ target }}")
+
+    # WHEN
+    index = build_variable_dependency_index(create_template_environment(tmp_path), scan_template(tmp_path, ["*.png"]))
+
+    # THEN
+    assert index.variables == {
+        "name": frozenset({Path("{{ name }}"), Path("{{ name }}/README.md")}),
+        "env": frozenset({Path("config-{{ env }}.yaml")}),
+        "items": frozenset({Path("config-{{ env }}.yaml")}),
+        "sep": frozenset({Path("config-{{ env }}.yaml")}),
+        "base": frozenset({Path("base.txt")}),
+        "target": frozenset({Path("link")}),
+    }
+    assert index.always_rendered == frozenset({Path("included.txt")})
+    assert VariableDependencyIndex.from_json(index.to_json()) == index
+    assert index.affected_by({"sep"}) == {Path("config-{{ env }}.yaml"), Path("included.txt")}
+
+
+def test_changed_variables_include_added_and_removed_variables():
+    assert get_changed_variables({"a": 1, "b": [1], "c": "x"}, {"a": 1, "b": [2], "d": "x"}) == {"b", "c", "d"}
+
+
+def test_template_version_manifest_holds_config_entries_and_dependencies(tmp_path: Path):
+    # GIVEN
+    (tmp_path / "fengine.yaml").write_text(
+        "rendering:\n  excluded_files: ['*.png']\nvariables:\n  name: {type: str, description: dummy}\n"
+    )
+    template_dir = tmp_path / "template"
+    (template_dir / "{{ name }}").mkdir(parents=True)
+    (template_dir / "{{ name }}" / "README.md").write_text("no variables")
+    (template_dir / "config.yaml").write_text("{{ name }}")
+    (template_dir / "windows.bat").write_bytes(b"no variables\r\n")
+    (template_dir / "logo.png").write_bytes(b"\x89PNG")
+
+    # WHEN
+    manifest = build_template_version_manifest(tmp_path)
+
+    # THEN
+    assert list(manifest.template_config.variables) == ["name"]
+    entries = {e.path: e for e in manifest.entries}
+    assert entries[Path("logo.png")].excluded
+    assert entries[Path("logo.png")].content_hash == hashlib.sha256(b"\x89PNG").hexdigest()
+    assert {p for p, e in entries.items() if e.literal} == {Path("{{ name }}/README.md")}
+    assert manifest.dependency_index.affected_by({"name"}) == {
+        Path("{{ name }}"),
+        Path("{{ name }}/README.md"),
+        Path("config.yaml"),
+    }
+    assert TemplateVersionManifest.from_json(manifest.to_json()) == manifest
+
+
+async def test_rendering_with_a_template_version_manifest_copies_literal_files(tmp_path: Path):
+    # GIVEN
+    template_dir = tmp_path / "template"
+    template_dir.mkdir()
+    (template_dir / "README.md").write_text("no variables\n")
+    (template_dir / "config.yaml").write_text("{{ name }}")
+    manifest = build_template_version_manifest(tmp_path)
+
+    # WHEN
+    await render_template(template_dir, tmp_path / "incarnation", {"name": "jon"}, [], manifest=manifest.entries)
+
+    # THEN
+    assert (tmp_path / "incarnation" / "README.md").read_text() == "no variables\n"
+    assert (tmp_path / "incarnation" / "config.yaml").read_text() == "jon"
+
+
+def test_template_version_manifest_is_cached_per_template_version(tmp_path: Path, monkeypatch, mocker: MockerFixture):
+    # GIVEN
+    monkeypatch.setattr(get_engine_settings(), "template_cache_dir", tmp_path / "cache")
+    (tmp_path / "template").mkdir()
+    (tmp_path / "template" / "README.md").write_text("{{ name }}")
+    build_spy = mocker.spy(dependencies, "build_template_version_manifest")
+
+    # WHEN
+    manifests = [get_template_version_manifest(tmp_path, sha) for sha in ["a" * 40, "a" * 40, "b" * 40]]
+
+    # THEN
+    assert build_spy.call_count == 2
+    assert manifests[0] == manifests[1] == manifests[2]
+
+
+def test_cached_template_version_manifest_of_another_format_version_is_rebuilt(
+    tmp_path: Path, monkeypatch, mocker: MockerFixture
+):
+    # GIVEN
+    monkeypatch.setattr(get_engine_settings(), "template_cache_dir", tmp_path / "cache")
+    (tmp_path / "template").mkdir()
+    (tmp_path / "template" / "README.md").write_text("{{ name }}")
+    manifest = get_template_version_manifest(tmp_path, "a" * 40)
+    [cache_file] = (tmp_path / "cache").glob("__fengine_manifest_*.json")
+    cache_file.write_text(cache_file.read_text().replace('"format_version": 1', '"format_version": 0'))
+    build_spy = mocker.spy(dependencies, "build_template_version_manifest")
+
+    # WHEN
+    rebuilt_manifest = get_template_version_manifest(tmp_path, "a" * 40)
+
+    # THEN
+    assert build_spy.call_count == 1
+    assert rebuilt_manifest == manifest
+    assert TemplateVersionManifest.from_json(cache_file.read_text()) == manifest
+
+
+def test_cached_template_version_manifests_are_pruned_with_the_template_cache(tmp_path: Path, monkeypatch):
+    # GIVEN
+    monkeypatch.setattr(get_engine_settings(), "template_cache_dir", tmp_path / "cache")
+    (tmp_path / "template").mkdir()
+    (tmp_path / "template" / "README.md").write_text("{{ name }}")
+    get_template_version_manifest(tmp_path, "a" * 40)
+    [cache_file] = (tmp_path / "cache").glob("__fengine_manifest_*.json")
+    monkeypatch.setattr(get_engine_settings(), "template_cache_max_size", cache_file.stat().st_size)
+
+    # WHEN
+    get_template_version_manifest(tmp_path, "b" * 40)
+
+    # THEN
+    assert [p.name for p in (tmp_path / "cache").glob("__fengine_manifest_*.json")] == [
+        "__fengine_manifest_%s.json" % ("b" * 40)
+    ]
+
+
+async def test_template_paths_affected_by_update_are_not_determined_without_template_cache(
+    tmp_path: Path, monkeypatch, mocker: MockerFixture
+):
+    # GIVEN
+    monkeypatch.setattr(get_engine_settings(), "template_cache_dir", None)
+    build_spy = mocker.spy(dependencies, "build_template_version_manifest")
+
+    # WHEN
+    affected_template_paths = await get_template_paths_affected_by_update(
+        tmp_path / "original", tmp_path / "updated", [Path("changed.txt")], {"name": "jon"}, {"name": "ygritte"}
+    )
+
+    # THEN
+    assert affected_template_paths is None
+    assert build_spy.call_count == 0
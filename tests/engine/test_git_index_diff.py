@@ -0,0 +1,46 @@
+from pathlib import Path
+
+from foxops.engine.patching.git_index_diff import ScratchObjectStore
+from foxops.engine.rendering import render_template
+from foxops.engine.sinks import InMemorySink
+
+
+async def test_directories_and_in_memory_renderings_yield_the_same_tree(tmp_path: Path):
+    # GIVEN
+    template_dir = tmp_path / "template"
+    (template_dir / "dir").mkdir(parents=True)
+    (template_dir / "dir" / "README.md").write_text("{{ data }}")
+    (template_dir / ".gitignore").write_text("*.log\n")
+    (template_dir / "debug.log").write_text("ignored by git, but part of the incarnation")
+    (template_dir / "run.sh").write_text("echo {{ data }}")
+    (template_dir / "run.sh").chmod(0o755)
+    (template_dir / "link").symlink_to("run.sh")
+    incarnation_dir = tmp_path / "incarnation"
+    await render_template(template_dir, incarnation_dir, {"data": "Hello"}, [])
+    sink = InMemorySink()
+    await render_template(template_dir, sink, {"data": "Hello"}, [])
+    store = await ScratchObjectStore.create()
+
+    # WHEN
+    with store.use():
+        directory_tree = await store.write_tree(incarnation_dir)
+        in_memory_tree = await store.write_tree(sink)
+
+    # THEN
+    assert directory_tree == in_memory_tree
+    assert not any(store.git_dir.glob("index-*"))
+
+
+async def test_retired_scratch_object_store_is_removed_after_its_last_diff(tmp_path: Path):
+    # GIVEN
+    store = await ScratchObjectStore.create(max_diffs=2)
+
+    # WHEN
+    with store.use():
+        with store.use():
+            assert store.retired
+        git_dir_exists_while_in_use = store.git_dir.exists()
+
+    # THEN
+    assert git_dir_exists_while_in_use
+    assert not store.git_dir.exists()
@@ -0,0 +1,59 @@
+import subprocess
+from pathlib import Path
+
+from foxops.engine.patching.git_objects import GitFastImport, GitTreeSink
+from foxops.engine.rendering import render_template
+
+
+def git(git_dir: Path, *args: str) -> str:
+    return subprocess.check_output(["git", *args], cwd=git_dir, text=True)
+
+
+async def test_rendering_into_a_git_tree_writes_files_modes_and_symlinks(tmp_path: Path):
+    # GIVEN
+    template_dir = tmp_path / "template"
+    (template_dir / "{{ name }}" / "empty").mkdir(parents=True)
+    (template_dir / "{{ name }}" / "file with spaces.txt").write_text("{{ data }}")
+    (template_dir / "run.sh").write_text("echo {{ data }}")
+    (template_dir / "run.sh").chmod(0o755)
+    (template_dir / "README-symlink").symlink_to("run.sh")
+    git_dir = tmp_path / "objects"
+    git_dir.mkdir()
+    git(git_dir, "init", "--bare", "--quiet")
+
+    # WHEN
+    async with GitFastImport(git_dir) as fast_import:
+        sink = GitTreeSink(fast_import, "refs/heads/rendered")
+        await render_template(template_dir, sink, {"name": "jon", "data": "Hello"}, [])
+        tree = await sink.write_tree()
+
+    # THEN
+    assert git(git_dir, "ls-tree", "-r", "--format=%(objectmode) %(path)", tree).splitlines() == [
+        "120000 README-symlink",
+        "100644 jon/file with spaces.txt",
+        "100755 run.sh",
+    ]
+    assert git(git_dir, "show", f"{tree}:jon/file with spaces.txt") == "Hello"
+    assert git(git_dir, "show", f"{tree}:README-symlink") == "run.sh"
+
+
+async def test_identical_renderings_yield_the_same_git_tree(tmp_path: Path):
+    # GIVEN
+    template_dir = tmp_path / "template"
+    template_dir.mkdir()
+    (template_dir / "README.md").write_text("{{ data }}")
+    git_dir = tmp_path / "objects"
+    git_dir.mkdir()
+    git(git_dir, "init", "--bare", "--quiet")
+
+    # WHEN
+    async with GitFastImport(git_dir) as fast_import:
+        trees = []
+        for ref, data in [("refs/heads/a", "Hello"), ("refs/heads/b", "Hello"), ("refs/heads/c", "World")]:
+            sink = GitTreeSink(fast_import, ref)
+            await render_template(template_dir, sink, {"data": data}, [], max_concurrency=4)
+            trees.append(await sink.write_tree())
+
+    # THEN
+    assert trees[0] == trees[1]
+    assert trees[0] != trees[2]
@@ -1,9 +1,11 @@
 from pathlib import Path
 
 import pytest
+from jinja2.exceptions import SecurityError
 
 from foxops import utils
 from foxops.engine import initialize_incarnation
+from foxops.engine.settings import get_engine_settings
 from foxops.errors import ReconciliationUserError
 
 
@@ -405,3 +407,41 @@ template_repository_version: any-version
 template_repository_version_hash: {repository_head}
 """
     )
+
+
+@pytest.mark.parametrize(
+    "trusted_template_repositories,expected_content",
+    [([], None), (["any-repository-url"], "str")],
+)
+async def test_initialize_renders_only_trusted_template_repositories_without_sandbox(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    trusted_template_repositories: list[str],
+    expected_content: str | None,
+):
+    # GIVEN
+    monkeypatch.setattr(get_engine_settings(), "trusted_template_repositories", trusted_template_repositories)
+    template_dir = tmp_path / "template"
+    template_dir.mkdir()
+    (template_dir / "README.md").write_text("{{ name.__class__.__name__ }}")
+    await init_repository(tmp_path)
+    incarnation_dir = tmp_path / "incarnation"
+    incarnation_dir.mkdir()
+
+    # WHEN
+    async def _initialize():
+        await initialize_incarnation(
+            template_root_dir=tmp_path,
+            template_repository="any-repository-url",
+            template_repository_version="any-version",
+            template_data={"name": "jon"},
+            incarnation_root_dir=incarnation_dir,
+        )
+
+    # THEN
+    if expected_content is None:
+        with pytest.raises(SecurityError):
+            await _initialize()
+    else:
+        await _initialize()
+        assert (incarnation_dir / "README.md").read_text() == expected_content
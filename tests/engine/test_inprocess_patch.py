@@ -0,0 +1,102 @@
+import shutil
+import subprocess
+from pathlib import Path
+
+import pytest
+
+from foxops.engine.patching.hunks import unified_hunks
+from foxops.engine.patching.inprocess_patch import apply_hunks, inprocess_diff_and_patch
+from foxops.engine.patching.merge import split_lines
+from foxops.engine.patching.tree_diff import read_git_files, tree_diff_and_patch
+
+
+def lines(*values: object) -> str:
+    return "".join(f"{v}\n" for v in values)
+
+
+@pytest.fixture
+def old_directory(tmp_path: Path) -> Path:
+    old_directory = tmp_path / "old"
+    (old_directory / "dir").mkdir(parents=True)
+    (old_directory / "offset.txt").write_text(lines(*range(30)))
+    (old_directory / "conflict.txt").write_text(lines(*range(30)))
+    (old_directory / "no-newline.txt").write_text("first\nlast")
+    (old_directory / "dir" / "deleted.txt").write_text("deleted\n")
+    (old_directory / "modified-deleted.txt").write_text("deleted\n")
+    (old_directory / "missing.txt").write_text("missing\n")
+    (old_directory / "logo.png").write_bytes(b"\x89PNG\0\x01")
+    (old_directory / "run.sh").write_text("echo hello\n")
+    (old_directory / "link").symlink_to("offset.txt")
+    return old_directory
+
+
+@pytest.fixture
+def new_directory(tmp_path: Path, old_directory: Path) -> Path:
+    new_directory = tmp_path / "new"
+    shutil.copytree(old_directory, new_directory, symlinks=True)
+    (new_directory / "offset.txt").write_text(lines(*range(30)).replace("15\n", "fifteen\n"))
+    (new_directory / "conflict.txt").write_text(lines(*range(30)).replace("2\n", "two\n").replace("20\n", "twenty\n"))
+    (new_directory / "no-newline.txt").write_text("first\nchanged")
+    (new_directory / "dir" / "deleted.txt").unlink()
+    (new_directory / "modified-deleted.txt").unlink()
+    (new_directory / "missing.txt").write_text("changed\n")
+    (new_directory / "logo.png").write_bytes(b"\x89PNG\0\x02")
+    (new_directory / "run.sh").chmod(0o755)
+    (new_directory / "link").unlink()
+    (new_directory / "link").symlink_to("run.sh")
+    (new_directory / "added.txt").write_text("added\n")
+    (new_directory / "existing.txt").write_text("added\n")
+    return new_directory
+
+
+@pytest.fixture
+def incarnation_directory(tmp_path: Path, old_directory: Path) -> Path:
+    incarnation_directory = tmp_path / "incarnation"
+    shutil.copytree(old_directory, incarnation_directory / "sub", symlinks=True)
+    subprocess.run(["git", "init", "--quiet", str(incarnation_directory)], check=True)
+    incarnation_directory = incarnation_directory / "sub"
+    (incarnation_directory / "offset.txt").write_text(lines("a", "b", *range(30)))
+    (incarnation_directory / "conflict.txt").write_text(lines(*range(30)).replace("20\n", "local\n"))
+    (incarnation_directory / "modified-deleted.txt").write_text("modified\n")
+    (incarnation_directory / "missing.txt").unlink()
+    (incarnation_directory / "existing.txt").write_text("existing\n")
+    return incarnation_directory
+
+
+async def test_inprocess_patch_has_the_same_outcome_as_git_apply(
+    tmp_path: Path, old_directory: Path, new_directory: Path, incarnation_directory: Path
+):
+    # GIVEN
+    git_incarnation_directory = tmp_path / "git-incarnation" / "sub"
+    shutil.copytree(incarnation_directory.parent, git_incarnation_directory.parent, symlinks=True)
+
+    # WHEN
+    git_conflicts = await tree_diff_and_patch(old_directory, new_directory, git_incarnation_directory)
+    inprocess_conflicts = await inprocess_diff_and_patch(old_directory, new_directory, incarnation_directory)
+
+    # THEN
+    assert inprocess_conflicts == git_conflicts == [Path("sub/conflict.txt")]
+    assert (incarnation_directory / "conflict.txt.rej").read_bytes() == (
+        git_incarnation_directory / "conflict.txt.rej"
+    ).read_bytes()
+    assert await read_git_files(incarnation_directory) == await read_git_files(git_incarnation_directory)
+    assert not (incarnation_directory / "dir").exists()
+
+
+async def test_inprocess_patch_returns_none_if_nothing_changed(old_directory: Path, incarnation_directory: Path):
+    # THEN
+    assert await inprocess_diff_and_patch(old_directory, old_directory, incarnation_directory) is None
+
+
+def test_apply_hunks_searches_around_the_original_position_of_a_hunk():
+    # GIVEN
+    old_lines = split_lines(lines(*range(10)).encode())
+    new_lines = split_lines(lines(*range(10)).replace("5\n", "five\n").encode())
+    hunks = list(unified_hunks(old_lines, new_lines))
+
+    # WHEN
+    content, rejected_hunks = apply_hunks(lines("a", "b", *range(10)).encode(), hunks)
+
+    # THEN
+    assert rejected_hunks == []
+    assert content == lines("a", "b", *range(5), "five", *range(6, 10)).encode()
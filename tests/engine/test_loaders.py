@@ -0,0 +1,68 @@
+import builtins
+import os
+from pathlib import Path
+
+import pytest
+from jinja2 import Environment, TemplateNotFound
+from pytest_mock import MockerFixture
+
+from foxops.engine.loaders import ImmutableFileSystemLoader
+from foxops.engine.rendering import create_template_environment, render_template
+
+
+def test_loader_reads_every_template_source_only_once(tmp_path: Path, mocker: MockerFixture):
+    # GIVEN
+    (tmp_path / "README.md").write_text("{{ data }}")
+    loader = ImmutableFileSystemLoader(tmp_path)
+    open_spy = mocker.spy(builtins, "open")
+
+    # WHEN
+    sources = [loader.get_source(Environment(), "README.md") for _ in range(3)]
+
+    # THEN
+    assert open_spy.call_count == 1
+    for source, _, uptodate in sources:
+        assert source == "{{ data }}"
+        assert uptodate is not None
+        assert uptodate()
+
+
+def test_loader_raises_template_not_found_for_missing_templates(tmp_path: Path):
+    # GIVEN
+    (tmp_path / "dir").mkdir()
+    loader = ImmutableFileSystemLoader(tmp_path)
+
+    # THEN
+    for name in ["missing.txt", "dir", "../outside.txt"]:
+        with pytest.raises(TemplateNotFound):
+            loader.get_source(Environment(), name)
+
+
+async def test_rendering_never_revalidates_template_files(tmp_path: Path, mocker: MockerFixture):
+    # GIVEN
+    template_dir = tmp_path / "template"
+    (template_dir / "{{ name }}").mkdir(parents=True)
+    (template_dir / "{{ name }}" / "README.md").write_text("{{ data }}")
+    (template_dir / "base.txt").write_text("Hello")
+    (template_dir / "include.txt").write_text("{% include 'base.txt' %} {{ name }}")
+    getmtime_spy = mocker.spy(os.path, "getmtime")
+
+    # WHEN
+    await render_template(template_dir, tmp_path / "incarnation", {"name": "jon", "data": "Hello"}, [])
+
+    # THEN
+    getmtime_spy.assert_not_called()
+    assert (tmp_path / "incarnation" / "include.txt").read_text() == "Hello jon"
+
+
+def test_template_environment_never_auto_reloads_templates(tmp_path: Path):
+    # GIVEN
+    (tmp_path / "README.md").write_text("{{ data }}")
+    environment = create_template_environment(tmp_path, trusted=True)
+    environment.get_template("README.md")
+
+    # WHEN
+    (tmp_path / "README.md").write_text("changed")
+
+    # THEN
+    assert environment.get_template("README.md").render(data="Hello") == "Hello"
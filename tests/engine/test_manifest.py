@@ -0,0 +1,78 @@
+import stat
+from pathlib import Path
+
+import pytest
+
+from foxops.engine.manifest import ExcludeMatcher, TemplateEntryType, scan_template
+
+
+@pytest.fixture
+def template_dir(tmp_path: Path) -> Path:
+    template_dir = tmp_path / "template"
+    (template_dir / "{{ name }}" / "docs").mkdir(parents=True)
+    (template_dir / "assets" / "img").mkdir(parents=True)
+    (template_dir / "README.md").write_text("{{ name }}")
+    (template_dir / ".gitignore").write_text("*.pyc")
+    (template_dir / "{{ name }}" / "README.md").write_text("{{ name }}")
+    (template_dir / "{{ name }}" / "docs" / "index.md").write_text("{{ name }}")
+    (template_dir / "assets" / "logo.png").write_bytes(b"\x89PNG")
+    (template_dir / "assets" / "img" / "icon.png").write_bytes(b"\x89PNG")
+    (template_dir / "README-symlink").symlink_to("README.md")
+    return template_dir
+
+
+@pytest.mark.parametrize(
+    "pattern",
+    [
+        "README.md",
+        "*.md",
+        "**/*.md",
+        "**/*",
+        "{{ name }}/*",
+        "assets/**/*.png",
+        "assets/*.png",
+        "*/docs/index.[mt][dx]*",
+        ".*",
+        "?EADME.md",
+    ],
+)
+def test_exclude_matcher_matches_the_same_files_as_pathlib_glob(template_dir: Path, pattern: str):
+    # GIVEN
+    files = [p for p in template_dir.glob("**/*") if p.is_file() and not p.is_symlink()]
+    matcher = ExcludeMatcher([pattern])
+
+    # WHEN
+    matched_files = {p for p in files if matcher.matches(p.relative_to(template_dir))}
+
+    # THEN
+    assert matched_files == {p for p in template_dir.glob(pattern) if p in files}
+
+
+def test_exclude_matcher_rejects_absolute_patterns():
+    with pytest.raises(ValueError):
+        ExcludeMatcher(["/etc/*"])
+
+
+def test_scan_template_lists_entries_top_down_with_metadata(template_dir: Path):
+    # GIVEN
+    (template_dir / "README.md").chmod(0o755)
+
+    # WHEN
+    manifest = scan_template(template_dir, ["assets/**/*.png"])
+
+    # THEN
+    entries = {e.path: e for e in manifest}
+    assert [e.path for e in manifest][:5] == [
+        Path(".gitignore"),
+        Path("README-symlink"),
+        Path("README.md"),
+        Path("assets"),
+        Path("{{ name }}"),
+    ]
+    assert entries[Path("assets")].type is TemplateEntryType.DIRECTORY
+    assert entries[Path("README-symlink")].type is TemplateEntryType.SYMLINK
+    assert entries[Path("README-symlink")].symlink_target == "README.md"
+    assert stat.S_IMODE(entries[Path("README.md")].mode) == 0o755
+    assert entries[Path("assets/img/icon.png")].excluded
+    assert entries[Path("assets/logo.png")].excluded
+    assert not entries[Path("README.md")].excluded
@@ -0,0 +1,41 @@
+from foxops.engine.patching.merge import merge_file_content
+
+
+def test_merge_takes_the_changes_of_both_versions():
+    # GIVEN
+    base = b"".join(b"line %d\n" % i for i in range(10))
+    ours = base.replace(b"line 2\n", b"ours\n")
+    theirs = base.replace(b"line 5\n", b"theirs 5\n").replace(b"line 9\n", b"theirs 9\n")
+
+    # WHEN
+    merged = merge_file_content(base, ours, theirs)
+
+    # THEN
+    assert merged == base.replace(b"line 2\n", b"ours\n").replace(b"line 5\n", b"theirs 5\n").replace(
+        b"line 9\n", b"theirs 9\n"
+    )
+
+
+def test_merge_takes_identical_changes_once():
+    # GIVEN
+    base = b"a\nb\nc\n"
+    changed = b"a\nchanged\nc\nd"
+
+    # THEN
+    assert merge_file_content(base, changed, changed) == changed
+
+
+def test_merge_fails_for_overlapping_changes():
+    # GIVEN
+    base = b"a\nb\nc\n"
+
+    # THEN
+    assert merge_file_content(base, b"a\nours\nc\n", b"a\ntheirs\nc\n") is None
+
+
+def test_merge_fails_for_binary_files():
+    # GIVEN
+    base = b"\x89PNG\0a\nb\n"
+
+    # THEN
+    assert merge_file_content(base, base + b"ours\n", b"theirs\n" + base) is None
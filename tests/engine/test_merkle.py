@@ -0,0 +1,65 @@
+from pathlib import Path
+
+from foxops.engine.merkle import (
+    ROOT,
+    build_merkle_tree,
+    changed_subtrees,
+    prune_unchanged_subtrees,
+)
+from foxops.engine.sinks import InMemorySink
+
+
+async def render_incarnation(readme: str = "Hello", mode: int = 0o100644) -> InMemorySink:
+    incarnation = InMemorySink()
+    await incarnation.write_directory(Path("docs"), 0o40755)
+    await incarnation.write_file(Path("docs/index.md"), "index", 0o100644)
+    await incarnation.write_file(Path("src/app/main.py"), "main", 0o100644)
+    await incarnation.write_file(Path("src/app/README.md"), readme, mode)
+    await incarnation.write_symlink(Path("link"), "docs/index.md", 0o120777)
+    return incarnation
+
+
+async def test_identical_incarnations_have_the_same_root_hash_regardless_of_the_write_order():
+    # GIVEN
+    incarnation = await render_incarnation()
+    reversed_incarnation = InMemorySink(dict(reversed(incarnation.entries.items())))
+
+    # THEN
+    assert build_merkle_tree(incarnation).root_hash == build_merkle_tree(reversed_incarnation).root_hash
+    assert prune_unchanged_subtrees(incarnation, reversed_incarnation) is None
+
+
+async def test_changed_subtrees_only_descend_into_directories_with_different_hashes():
+    # GIVEN
+    old_tree = build_merkle_tree(await render_incarnation())
+    new_tree = build_merkle_tree(await render_incarnation(readme="Hello World"))
+
+    # THEN
+    assert changed_subtrees(old_tree, new_tree) == {ROOT, Path("src"), Path("src/app"), Path("src/app/README.md")}
+
+
+async def test_a_changed_mode_changes_the_root_hash():
+    # GIVEN
+    old_tree = build_merkle_tree(await render_incarnation())
+    new_tree = build_merkle_tree(await render_incarnation(mode=0o100755))
+
+    # THEN
+    assert old_tree.root_hash != new_tree.root_hash
+    assert Path("src/app/README.md") in changed_subtrees(old_tree, new_tree)
+
+
+async def test_pruned_incarnations_only_hold_the_changed_entries():
+    # GIVEN
+    old_incarnation = await render_incarnation()
+    new_incarnation = await render_incarnation(readme="Hello World")
+    await new_incarnation.write_file(Path("docs/added.md"), "added", 0o100644)
+
+    # WHEN
+    pruned = prune_unchanged_subtrees(old_incarnation, new_incarnation)
+
+    # THEN
+    assert pruned is not None
+    old_pruned, new_pruned = pruned
+    assert set(old_pruned.entries) == {Path("docs"), Path("src/app/README.md")}
+    assert set(new_pruned.entries) == {Path("docs"), Path("src/app/README.md"), Path("docs/added.md")}
+    assert new_pruned.read_bytes(Path("src/app/README.md")) == b"Hello World"
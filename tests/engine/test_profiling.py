@@ -0,0 +1,71 @@
+from pathlib import Path
+
+import pytest
+from pytest_mock import MockerFixture
+
+from foxops.engine.profiling import log_rendering_profile, profile_rendering
+from foxops.engine.rendering import render_template
+from foxops.engine.settings import get_engine_settings
+from foxops.engine.sinks import InMemorySink
+
+
+@pytest.fixture
+def template_dir(tmp_path: Path) -> Path:
+    template_dir = tmp_path / "template"
+    template_dir.mkdir()
+    (template_dir / "README.md").write_text("{{ data }}")
+    (template_dir / "large.txt").write_text("{% for _ in range(1000) %}{{ data }}{% endfor %}")
+    (template_dir / "logo.png").write_bytes(b"\x89PNG")
+    return template_dir
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+async def test_profiling_records_every_rendered_template_file(template_dir: Path, processes: int):
+    # WHEN
+    with profile_rendering() as profile:
+        await render_template(template_dir, InMemorySink(), {"data": "Hello"}, ["*.png"], processes=processes)
+
+    # THEN
+    entries = {e.template_path: e for e in profile.entries}
+    assert set(entries) == {Path("README.md"), Path("large.txt"), Path("logo.png")}
+    assert entries[Path("large.txt")].output_bytes == 5000
+    assert entries[Path("logo.png")].output_bytes == 4
+    assert entries[Path("logo.png")].compile_time == 0
+    assert not any(e.cached for e in profile.entries)
+    assert profile.slowest(1)[0].total_time == max(e.total_time for e in profile.entries)
+
+
+async def test_profiling_records_compiled_templates_loaded_from_the_template_cache(
+    tmp_path: Path, template_dir: Path, monkeypatch: pytest.MonkeyPatch
+):
+    # GIVEN
+    monkeypatch.setattr(get_engine_settings(), "template_cache_dir", tmp_path / "cache")
+    await render_template(
+        template_dir, InMemorySink(), {"data": "Hello"}, ["*.png"], template_repository_version_hash="a"
+    )
+
+    # WHEN
+    with profile_rendering() as profile:
+        await render_template(
+            template_dir, InMemorySink(), {"data": "Hello"}, ["*.png"], template_repository_version_hash="a"
+        )
+
+    # THEN
+    assert {e.template_path for e in profile.entries if e.cached} == {Path("README.md"), Path("large.txt")}
+
+
+async def test_rendering_profile_is_logged_if_enabled(
+    template_dir: Path, monkeypatch: pytest.MonkeyPatch, mocker: MockerFixture
+):
+    # GIVEN
+    monkeypatch.setattr(get_engine_settings(), "rendering_profile", True)
+    logger = mocker.Mock()
+
+    # WHEN
+    with log_rendering_profile(logger):
+        await render_template(template_dir, InMemorySink(), {"data": "Hello"}, ["*.png"])
+
+    # THEN
+    logger.info.assert_called_once()
+    assert logger.info.call_args.kwargs["rendered_template_files"] == 3
+    assert len(logger.info.call_args.kwargs["slowest_template_files"]) == 3
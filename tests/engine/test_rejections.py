@@ -0,0 +1,116 @@
+from pathlib import Path
+
+import pytest
+
+from foxops.engine.patching.hunks import parse_hunks, unified_hunks
+from foxops.engine.patching.merge import split_lines
+from foxops.engine.patching.rejections import HunkStatus, analyze_rejections
+from foxops.engine.settings import get_engine_settings
+from foxops.engine.sinks import InMemorySink
+
+#: Holds the lines of the pristine file all tests start with
+PRISTINE_CONTENT = b"".join(b"line %d\n" % i for i in range(30))
+
+
+def write_rejection(incarnation_dir: Path, path: Path, pristine: bytes, updated: bytes) -> None:
+    hunks = b"".join(h.to_bytes() for h in unified_hunks(split_lines(pristine), split_lines(updated)))
+    (incarnation_dir / f"{path}.rej").write_bytes(
+        b"diff a/%s b/%s\t(rejected hunks)\n" % (bytes(path), bytes(path)) + hunks
+    )
+
+
+def test_parse_hunks_reads_the_hunks_written_by_to_bytes():
+    # GIVEN
+    hunks = list(unified_hunks(split_lines(b"a\nb\nc"), split_lines(b"a\nB\nc\nd")))
+
+    # WHEN
+    parsed_hunks = parse_hunks(b"diff a/x b/x\t(rejected hunks)\n" + b"".join(h.to_bytes() for h in hunks))
+
+    # THEN
+    assert parsed_hunks == hunks
+
+
+async def test_analyze_rejections_reports_the_status_of_every_hunk(tmp_path: Path):
+    # GIVEN
+    pristine_incarnation = InMemorySink()
+    await pristine_incarnation.write_file(Path("file.txt"), PRISTINE_CONTENT, 0o100644)
+    updated_content = PRISTINE_CONTENT.replace(b"line 2\n", b"two\n").replace(b"line 25\n", b"twenty-five\n")
+    updated_incarnation = InMemorySink()
+    await updated_incarnation.write_file(Path("file.txt"), updated_content, 0o100644)
+    # the first change has been made in the incarnation as well, the second one conflicts
+    (tmp_path / "file.txt").write_bytes(PRISTINE_CONTENT.replace(b"line 2\n", b"two\n").replace(b"line 25\n", b"25\n"))
+    write_rejection(tmp_path, Path("file.txt"), PRISTINE_CONTENT, updated_content)
+
+    # WHEN
+    [file_rejection] = await analyze_rejections([Path("file.txt")], tmp_path, updated_incarnation, pristine_incarnation)
+
+    # THEN
+    assert file_rejection.hunks == [HunkStatus.APPLIED, HunkStatus.CONFLICT]
+    assert not file_rejection.resolved
+    assert (tmp_path / "file.txt.rej").exists()
+
+
+async def test_analyze_rejections_compares_the_content_of_identical_files(tmp_path: Path):
+    # GIVEN
+    updated_dir = tmp_path / "updated"
+    incarnation_dir = tmp_path / "incarnation"
+    updated_dir.mkdir()
+    incarnation_dir.mkdir()
+    updated_content = PRISTINE_CONTENT.replace(b"line 2\n", b"two\n")
+    (updated_dir / "file.txt").write_bytes(updated_content)
+    (incarnation_dir / "file.txt").write_bytes(updated_content.replace(b"two", b"TWO"))
+    write_rejection(incarnation_dir, Path("file.txt"), PRISTINE_CONTENT, updated_content)
+    (incarnation_dir / "same.txt").write_bytes(updated_content)
+    (updated_dir / "same.txt").write_bytes(updated_content)
+    write_rejection(incarnation_dir, Path("same.txt"), PRISTINE_CONTENT, updated_content)
+
+    # WHEN
+    file_rejections = await analyze_rejections([Path("file.txt"), Path("same.txt")], incarnation_dir, updated_dir)
+
+    # THEN
+    assert [r.resolved for r in file_rejections] == [False, True]
+    assert (incarnation_dir / "file.txt.rej").exists()
+    assert not (incarnation_dir / "same.txt.rej").exists()
+
+
+async def test_analyze_rejections_merges_conflicting_hunks_with_three_way_merge(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    # GIVEN
+    monkeypatch.setattr(get_engine_settings(), "three_way_merge", True)
+    pristine_incarnation = InMemorySink()
+    await pristine_incarnation.write_file(Path("file.txt"), PRISTINE_CONTENT, 0o100644)
+    updated_content = PRISTINE_CONTENT.replace(b"line 10\n", b"ten\n")
+    updated_incarnation = InMemorySink()
+    await updated_incarnation.write_file(Path("file.txt"), updated_content, 0o100644)
+    (tmp_path / "file.txt").write_bytes(PRISTINE_CONTENT.replace(b"line 12\n", b"twelve\n"))
+    write_rejection(tmp_path, Path("file.txt"), PRISTINE_CONTENT, updated_content)
+
+    # WHEN
+    [file_rejection] = await analyze_rejections([Path("file.txt")], tmp_path, updated_incarnation, pristine_incarnation)
+
+    # THEN
+    assert file_rejection.hunks == [HunkStatus.MERGED]
+    assert file_rejection.resolved
+    assert (tmp_path / "file.txt").read_bytes() == updated_content.replace(b"line 12\n", b"twelve\n")
+    assert not (tmp_path / "file.txt.rej").exists()
+
+
+async def test_analyze_rejections_reports_a_conflict_if_a_deleted_line_has_been_modified(tmp_path: Path):
+    # GIVEN
+    pristine_content = b"x\ny\nz\nw\n"
+    pristine_incarnation = InMemorySink()
+    await pristine_incarnation.write_file(Path("file.txt"), pristine_content, 0o100644)
+    updated_content = b"x\ny\nz\n"
+    updated_incarnation = InMemorySink()
+    await updated_incarnation.write_file(Path("file.txt"), updated_content, 0o100644)
+    (tmp_path / "file.txt").write_bytes(b"x\ny\nz\nw-modified-by-user\n")
+    write_rejection(tmp_path, Path("file.txt"), pristine_content, updated_content)
+
+    # WHEN
+    [file_rejection] = await analyze_rejections([Path("file.txt")], tmp_path, updated_incarnation, pristine_incarnation)
+
+    # THEN
+    assert file_rejection.hunks == [HunkStatus.CONFLICT]
+    assert not file_rejection.resolved
+    assert (tmp_path / "file.txt.rej").exists()
@@ -1,16 +1,24 @@
 import stat
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
 from tempfile import TemporaryDirectory
 
 import jinja2
 import pytest
+from pytest_mock import MockerFixture
 
+from foxops.engine import rendering
+from foxops.engine.models import TemplateData
 from foxops.engine.rendering import (
+    TemplatePathRenderer,
     create_template_environment,
+    get_rendering_process_pool,
     render_template,
     render_template_file,
     render_template_symlink,
 )
+from foxops.engine.sinks import InMemorySink
 
 
 def supports_symlink_permissions():
@@ -48,6 +56,31 @@ async def test_rendering_a_template_file_renders_data_in_file_content(tmp_path:
     assert (incarnation_dir / "template.txt").read_text() == "Hello World"
 
 
+@pytest.mark.parametrize("trusted", [False, True])
+@pytest.mark.parametrize("stream", [False, True])
+async def test_rendering_a_large_template_file_renders_entire_content(tmp_path: Path, stream: bool, trusted: bool):
+    # GIVEN
+    template_file = tmp_path / "lockfile.txt"
+    template_file.write_text("{% for i in range(count) %}{{ data }}-{{ i }}\n{% endfor %}")
+    incarnation_dir = tmp_path / "incarnation"
+    incarnation_dir.mkdir()
+
+    env = create_template_environment(tmp_path, trusted=trusted)
+
+    # WHEN
+    await render_template_file(
+        env,
+        template_file,
+        incarnation_dir,
+        {"data": "Hello World", "count": 20000},
+        render_content=True,
+        stream=stream,
+    )
+
+    # THEN
+    assert (incarnation_dir / "lockfile.txt").read_text() == "".join(f"Hello World-{i}\n" for i in range(20000))
+
+
 async def test_rendering_a_template_file_with_invalid_templating_syntax_raises_exception(
     tmp_path: Path,
 ):
@@ -348,3 +381,149 @@ async def test_rendering_a_template_directory_inherits_file_permissions(tmp_path
     assert stat.S_IMODE((incarnation_dir / "subdir").stat().st_mode) == expected_subdir_mode
     assert (incarnation_dir / "subdir" / "template.txt").exists()
     assert stat.S_IMODE((incarnation_dir / "subdir" / "template.txt").stat().st_mode) == expected_file_mode
+
+
+@pytest.mark.parametrize(
+    "max_concurrency,processes",
+    [(8, 1), (1, 2), (4, 2)],
+)
+async def test_rendering_an_entire_template_directory_concurrently_yields_same_incarnation(
+    tmp_path: Path, max_concurrency: int, processes: int
+):
+    # GIVEN
+    template_dir = tmp_path / "template"
+    for idx in range(20):
+        (template_dir / "{{ name }}" / f"dir-{idx}").mkdir(parents=True)
+        (template_dir / "{{ name }}" / f"dir-{idx}" / "file-{{ idx }}.txt").write_text(f"{idx}: {{{{ data }}}}")
+    (template_dir / "README-symlink").symlink_to("{{ name }}/dir-0/file-{{ idx }}.txt")
+
+    serial_incarnation_dir = tmp_path / "serial"
+    serial_incarnation_dir.mkdir()
+    concurrent_incarnation_dir = tmp_path / "concurrent"
+    concurrent_incarnation_dir.mkdir()
+    template_data: TemplateData = {"name": "jon", "idx": "42", "data": "Hello World"}
+
+    # WHEN
+    await render_template(template_dir, serial_incarnation_dir, template_data, [], max_concurrency=1, processes=1)
+    await render_template(
+        template_dir,
+        concurrent_incarnation_dir,
+        template_data,
+        [],
+        max_concurrency=max_concurrency,
+        processes=processes,
+    )
+
+    # THEN
+    serial_entries = sorted(p.relative_to(serial_incarnation_dir) for p in serial_incarnation_dir.glob("**/*"))
+    concurrent_entries = sorted(
+        p.relative_to(concurrent_incarnation_dir) for p in concurrent_incarnation_dir.glob("**/*")
+    )
+    assert serial_entries == concurrent_entries
+    assert (concurrent_incarnation_dir / "jon" / "dir-7" / "file-42.txt").read_text() == "7: Hello World"
+    assert (concurrent_incarnation_dir / "README-symlink").readlink() == Path("jon/dir-0/file-42.txt")
+
+
+async def test_rendering_a_template_in_worker_processes_propagates_rendering_errors(tmp_path: Path):
+    # GIVEN
+    template_dir = tmp_path / "template"
+    template_dir.mkdir()
+    (template_dir / "valid.txt").write_text("{{ data }}")
+    (template_dir / "invalid.txt").write_text("{{ data }")
+
+    incarnation_dir = tmp_path / "incarnation"
+    incarnation_dir.mkdir()
+
+    # THEN
+    with pytest.raises(jinja2.TemplateSyntaxError):
+        # WHEN
+        await render_template(template_dir, incarnation_dir, {"data": "Hello World"}, [], processes=2)
+
+
+async def test_rendering_a_template_in_worker_processes_replaces_a_broken_process_pool(
+    tmp_path: Path, mocker: MockerFixture
+):
+    # GIVEN
+    template_dir = tmp_path / "template"
+    template_dir.mkdir()
+    (template_dir / "first.txt").write_text("{{ data }}")
+    (template_dir / "second.txt").write_text("{{ data }}!")
+
+    broken_process_pool = mocker.Mock(spec=ProcessPoolExecutor)
+    broken_process_pool.submit.side_effect = BrokenProcessPool("a worker died")
+    mocker.patch.dict(rendering._rendering_process_pools, {2: broken_process_pool})
+    incarnation = InMemorySink()
+
+    # WHEN
+    await render_template(template_dir, incarnation, {"data": "Hello World"}, [], processes=2)
+
+    # THEN
+    assert incarnation.read_bytes(Path("first.txt")) == b"Hello World"
+    assert incarnation.read_bytes(Path("second.txt")) == b"Hello World!"
+    broken_process_pool.shutdown.assert_called_once()
+    assert get_rendering_process_pool(2) is not broken_process_pool
+
+
+async def test_path_renderer_returns_literal_paths_without_compiling_them(tmp_path: Path, mocker: MockerFixture):
+    # GIVEN
+    env = create_template_environment(tmp_path)
+    from_string_spy = mocker.spy(env, "from_string")
+    path_renderer = TemplatePathRenderer(env, {"name": "jon"})
+
+    # WHEN
+    rendered_path = await path_renderer.render(Path("src/main/README.md"))
+
+    # THEN
+    assert rendered_path == Path("src/main/README.md")
+    assert from_string_spy.call_count == 0
+
+
+async def test_path_renderer_renders_each_directory_prefix_only_once(tmp_path: Path, mocker: MockerFixture):
+    # GIVEN
+    env = create_template_environment(tmp_path)
+    from_string_spy = mocker.spy(env, "from_string")
+    path_renderer = TemplatePathRenderer(env, {"name": "jon", "idx": "42"})
+
+    # WHEN
+    rendered_paths = [
+        await path_renderer.render(Path("{{ name }}/src/a.txt")),
+        await path_renderer.render(Path("{{ name }}/src/file-{{ idx }}.txt")),
+        await path_renderer.render(Path("{{ name }}/b.txt")),
+    ]
+
+    # THEN
+    assert rendered_paths == [Path("jon/src/a.txt"), Path("jon/src/file-42.txt"), Path("jon/b.txt")]
+    assert [c.args[0] for c in from_string_spy.call_args_list] == ["{{ name }}", "file-{{ idx }}.txt"]
+
+
+async def test_path_renderer_keeps_semantics_of_segments_rendering_to_empty_strings(tmp_path: Path):
+    # GIVEN
+    env = create_template_environment(tmp_path)
+    path_renderer = TemplatePathRenderer(env, {"flag": False})
+
+    # WHEN
+    rendered_path = await path_renderer.render(Path("src/{% if flag %}optional{% endif %}/README.md"))
+
+    # THEN
+    assert rendered_path == Path("src/README.md")
+
+
+async def test_rendering_an_entire_template_directory_passes_excluded_binary_files_through_unchanged(
+    tmp_path: Path,
+):
+    # GIVEN
+    template_dir = tmp_path / "template"
+    (template_dir / "assets").mkdir(parents=True)
+    binary_content = bytes(range(256)) * 64
+    (template_dir / "assets" / "logo.png").write_bytes(binary_content)
+    (template_dir / "assets" / "logo.png").chmod(0o755)
+
+    incarnation_dir = tmp_path / "incarnation"
+    incarnation_dir.mkdir()
+
+    # WHEN
+    await render_template(template_dir, incarnation_dir, {}, ["assets/*.png"])
+
+    # THEN
+    assert (incarnation_dir / "assets" / "logo.png").read_bytes() == binary_content
+    assert stat.S_IMODE((incarnation_dir / "assets" / "logo.png").stat().st_mode) == 0o755
@@ -0,0 +1,89 @@
+import asyncio
+import stat
+from pathlib import Path
+
+import pytest
+from pytest_mock import MockerFixture
+
+from foxops.engine.models import TemplateData
+from foxops.engine.rendering import render_template
+from foxops.engine.sinks import WRITE_BATCH_SIZE, InMemorySink
+
+
+@pytest.fixture
+def template_dir(tmp_path: Path) -> Path:
+    template_dir = tmp_path / "template"
+    for idx in range(4):
+        (template_dir / "{{ name }}" / f"dir-{idx}").mkdir(parents=True)
+        (template_dir / "{{ name }}" / f"dir-{idx}" / "file.txt").write_text(f"{idx}: {{{{ data }}}}")
+    (template_dir / "run.sh").write_text("echo {{ data }}")
+    (template_dir / "run.sh").chmod(0o755)
+    (template_dir / "logo.png").write_bytes(b"\x89PNG\r\n\x1a\n\xff")
+    (template_dir / "README-symlink").symlink_to("{{ name }}/dir-0/file.txt")
+    return template_dir
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+async def test_rendering_into_memory_does_not_touch_the_disk(tmp_path: Path, template_dir: Path, processes: int):
+    # GIVEN
+    sink = InMemorySink()
+    entries_before = set(tmp_path.glob("**/*"))
+
+    # WHEN
+    await render_template(template_dir, sink, {"name": "jon", "data": "Hello"}, ["*.png"], processes=processes)
+
+    # THEN
+    assert set(tmp_path.glob("**/*")) == entries_before
+    assert sink.read_bytes(Path("jon/dir-3/file.txt")) == b"3: Hello"
+    assert sink.read_bytes(Path("logo.png")) == b"\x89PNG\r\n\x1a\n\xff"
+    assert sink.entries[Path("README-symlink")].symlink_target == "jon/dir-0/file.txt"
+    assert stat.S_IMODE(sink.entries[Path("run.sh")].mode) == 0o755
+    assert sink.read_bytes(Path("jon")) is None
+
+
+async def test_writing_an_in_memory_rendering_to_a_directory_yields_same_incarnation(
+    tmp_path: Path, template_dir: Path
+):
+    # GIVEN
+    template_data: TemplateData = {"name": "jon", "data": "Hello"}
+    incarnation_dir = tmp_path / "incarnation"
+    incarnation_dir.mkdir()
+    await render_template(template_dir, incarnation_dir, template_data, ["*.png"])
+    sink = InMemorySink()
+    await render_template(template_dir, sink, template_data, ["*.png"])
+
+    # WHEN
+    materialized_dir = tmp_path / "materialized"
+    await sink.write_to(materialized_dir)
+
+    # THEN
+    incarnation_entries = sorted(p.relative_to(incarnation_dir) for p in incarnation_dir.glob("**/*"))
+    assert sorted(p.relative_to(materialized_dir) for p in materialized_dir.glob("**/*")) == incarnation_entries
+    for entry in incarnation_entries:
+        incarnation_path = incarnation_dir / entry
+        materialized_path = materialized_dir / entry
+        assert materialized_path.lstat().st_mode == incarnation_path.lstat().st_mode
+        if incarnation_path.is_symlink():
+            assert materialized_path.readlink() == incarnation_path.readlink()
+        elif incarnation_path.is_file():
+            assert materialized_path.read_bytes() == incarnation_path.read_bytes()
+
+
+async def test_rendering_into_a_directory_writes_entries_in_batches(tmp_path: Path, mocker: MockerFixture):
+    # GIVEN
+    template_dir = tmp_path / "template"
+    for idx in range(10):
+        (template_dir / f"dir-{idx}").mkdir(parents=True)
+        for file_idx in range(10):
+            (template_dir / f"dir-{idx}" / f"file-{file_idx}.txt").write_text("{{ data }}")
+    (template_dir / "dir-0" / "file-0.txt").chmod(0o755)
+    to_thread_spy = mocker.spy(asyncio, "to_thread")
+
+    # WHEN
+    await render_template(template_dir, tmp_path / "incarnation", {"data": "Hello"}, [])
+
+    # THEN
+    # NOTE: one job for all directories and the files in batches.
+    assert to_thread_spy.call_count == 1 + -(-100 // WRITE_BATCH_SIZE)
+    assert (tmp_path / "incarnation" / "dir-9" / "file-9.txt").read_text() == "Hello"
+    assert stat.S_IMODE((tmp_path / "incarnation" / "dir-0" / "file-0.txt").stat().st_mode) == 0o755
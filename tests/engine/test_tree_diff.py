@@ -0,0 +1,77 @@
+import shutil
+import subprocess
+from pathlib import Path
+
+import pytest
+
+from foxops.engine.patching.tree_diff import diff_trees, read_git_files
+from foxops.engine.sinks import InMemorySink
+
+
+def git(directory: Path, *args: str, input: bytes | None = None) -> bytes:
+    return subprocess.run(["git", *args], cwd=directory, input=input, check=True, capture_output=True).stdout
+
+
+@pytest.fixture
+def old_directory(tmp_path: Path) -> Path:
+    old_directory = tmp_path / "old"
+    (old_directory / "dir").mkdir(parents=True)
+    (old_directory / "README.md").write_text("".join(f"line {i}\n" for i in range(20)))
+    (old_directory / "no-newline.txt").write_text("first\nlast")
+    (old_directory / "dir" / "file with spaces.txt").write_text("spaces\n")
+    (old_directory / "dir" / "ünicode.txt").write_text("unicode\n")
+    (old_directory / "crlf.txt").write_bytes(b"a\r\nb\r\n")
+    (old_directory / "logo.png").write_bytes(b"\x89PNG\0\0\x01")
+    (old_directory / "run.sh").write_text("echo hello\n")
+    (old_directory / "deleted.txt").write_text("deleted\n")
+    (old_directory / "empty.txt").write_text("")
+    (old_directory / "link").symlink_to("README.md")
+    (old_directory / "link-to-file").symlink_to("README.md")
+    return old_directory
+
+
+async def test_applying_the_tree_diff_yields_the_new_tree(tmp_path: Path, old_directory: Path):
+    # GIVEN
+    new_directory = tmp_path / "new"
+    shutil.copytree(old_directory, new_directory, symlinks=True)
+    (new_directory / "README.md").write_text("".join(f"line {i}\n" for i in range(20) if i not in {3, 15}) + "end\n")
+    (new_directory / "no-newline.txt").write_text("first\nchanged")
+    (new_directory / "dir" / "file with spaces.txt").write_text("more spaces\n")
+    (new_directory / "dir" / "ünicode.txt").write_text("more unicode\n")
+    (new_directory / "crlf.txt").write_bytes(b"a\r\nc\r\n")
+    (new_directory / "logo.png").write_bytes(b"\x89PNG\0\0\x02")
+    (new_directory / "run.sh").chmod(0o755)
+    (new_directory / "deleted.txt").unlink()
+    (new_directory / "added.txt").write_text("added\n")
+    (new_directory / "empty.txt").write_text("not empty anymore")
+    (new_directory / "link").unlink()
+    (new_directory / "link").symlink_to("run.sh")
+    (new_directory / "link-to-file").unlink()
+    (new_directory / "link-to-file").write_text("file\n")
+
+    patched_directory = tmp_path / "patched"
+    shutil.copytree(old_directory, patched_directory, symlinks=True)
+    git(patched_directory, "init", "--quiet")
+
+    # WHEN
+    patch = diff_trees(await read_git_files(old_directory), await read_git_files(new_directory))
+    git(patched_directory, "apply", "--check", "-", input=patch)
+    git(patched_directory, "apply", "-", input=patch)
+
+    # THEN
+    shutil.rmtree(patched_directory / ".git")
+    assert await read_git_files(patched_directory) == await read_git_files(new_directory)
+
+
+async def test_tree_diff_of_identical_trees_is_empty(old_directory: Path):
+    # GIVEN
+    sink = InMemorySink()
+    for path in old_directory.glob("**/*"):
+        relative_path = path.relative_to(old_directory)
+        if path.is_symlink():
+            await sink.write_symlink(relative_path, str(path.readlink()), path.lstat().st_mode)
+        elif path.is_file():
+            await sink.write_file(relative_path, path.read_bytes(), path.lstat().st_mode)
+
+    # THEN
+    assert diff_trees(await read_git_files(old_directory), await read_git_files(sink)) == b""
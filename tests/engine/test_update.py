@@ -1,10 +1,29 @@
+import asyncio
 import shutil
+import tempfile
 from pathlib import Path
 
 import pytest
+from pytest_mock import MockerFixture
 
 from foxops import utils
-from foxops.engine import diff_and_patch, initialize_incarnation, update_incarnation
+from foxops.engine import (
+    diff_and_patch,
+    index_diff_and_patch,
+    initialize_incarnation,
+    inprocess_diff_and_patch,
+    rendering,
+    tree_diff_and_patch,
+    update_incarnation,
+)
+from foxops.engine.patching.git_diff_patch import patch
+from foxops.engine.settings import get_engine_settings
+from foxops.engine.sinks import InMemorySink
+from foxops.engine.update import gather_in_order
+from foxops.errors import ReconciliationUserError
+
+#: Holds the `diff_patch_func` implementations all update tests run with
+DIFF_PATCH_FUNCS = [diff_and_patch, tree_diff_and_patch, index_diff_and_patch, inprocess_diff_and_patch]
 
 
 async def init_repository(repository_dir: Path) -> None:
@@ -17,10 +36,7 @@ async def init_repository(repository_dir: Path) -> None:
     return (await proc.stdout.read()).decode().strip()  # type: ignore
 
 
-@pytest.mark.parametrize(
-    "diff_patch_func",
-    [diff_and_patch],
-)
+@pytest.mark.parametrize("diff_patch_func", DIFF_PATCH_FUNCS)
 async def test_diff_and_patch_update_single_file_without_conflict(diff_patch_func, tmp_path):
     # GIVEN
     old_directory = tmp_path / "old"
@@ -44,7 +60,38 @@ async def test_diff_and_patch_update_single_file_without_conflict(diff_patch_fun
     assert (to_patch_directory / "file.txt").read_text() == "new content"
 
 
-@pytest.mark.parametrize("diff_patch_func", [diff_and_patch])
+@pytest.mark.parametrize("diff_patch_func", DIFF_PATCH_FUNCS)
+async def test_diff_and_patch_streams_large_patches_without_temporary_files(
+    diff_patch_func, tmp_path, monkeypatch: pytest.MonkeyPatch
+):
+    # GIVEN
+    old_directory = tmp_path / "old"
+    old_directory.mkdir()
+    (old_directory / "file.txt").write_text("".join(f"old line {i}\n" for i in range(100_000)))
+    new_directory = tmp_path / "new"
+    to_patch_directory = tmp_path / "to_patch"
+    shutil.copytree(old_directory, to_patch_directory)
+    await init_repository(to_patch_directory)
+    shutil.copytree(old_directory, new_directory)
+    (new_directory / "file.txt").write_text("".join(f"new line {i}\n" for i in range(100_000)))
+    tempdir = tmp_path / "tmp"
+    tempdir.mkdir()
+    monkeypatch.setattr(tempfile, "tempdir", str(tempdir))
+
+    # WHEN
+    files_with_conflicts = await diff_patch_func(
+        diff_a_directory=old_directory,
+        diff_b_directory=new_directory,
+        patch_directory=to_patch_directory,
+    )
+
+    # THEN
+    assert files_with_conflicts == []
+    assert (to_patch_directory / "file.txt").read_text() == (new_directory / "file.txt").read_text()
+    assert not any(tempdir.glob("*.patch"))
+
+
+@pytest.mark.parametrize("diff_patch_func", DIFF_PATCH_FUNCS)
 async def test_diff_and_patch_adding_new_file_without_conflict(diff_patch_func, tmp_path):
     # GIVEN
     old_directory = tmp_path / "old"
@@ -68,7 +115,7 @@ async def test_diff_and_patch_adding_new_file_without_conflict(diff_patch_func,
     assert (to_patch_directory / "new-file.txt").read_text() == "new content"
 
 
-@pytest.mark.parametrize("diff_patch_func", [diff_and_patch])
+@pytest.mark.parametrize("diff_patch_func", DIFF_PATCH_FUNCS)
 async def test_diff_and_patch_removing_file_without_conflict(diff_patch_func, tmp_path):
     # GIVEN
     old_directory = tmp_path / "old"
@@ -93,7 +140,7 @@ async def test_diff_and_patch_removing_file_without_conflict(diff_patch_func, tm
     assert not (to_patch_directory / "deprecated-file.txt").exists()
 
 
-@pytest.mark.parametrize("diff_patch_func", [diff_and_patch])
+@pytest.mark.parametrize("diff_patch_func", DIFF_PATCH_FUNCS)
 async def test_diff_and_patch_no_change_when_updating_to_template_version_with_identical_change(
     diff_patch_func,
     tmp_path,
@@ -167,7 +214,7 @@ r2 {...}
     )
 
 
-@pytest.mark.parametrize("diff_patch_func", [diff_and_patch])
+@pytest.mark.parametrize("diff_patch_func", DIFF_PATCH_FUNCS)
 async def test_diff_and_patch_no_change_when_updating_to_template_version_with_identical_change_in_subdirectory(
     diff_patch_func,
     tmp_path,
@@ -248,7 +295,7 @@ r2 {...}
     )
 
 
-@pytest.mark.parametrize("diff_patch_func", [diff_and_patch])
+@pytest.mark.parametrize("diff_patch_func", DIFF_PATCH_FUNCS)
 async def test_diff_and_patch_conflict_for_nearby_changes_in_template_and_incarnation(
     diff_patch_func,
     tmp_path,
@@ -313,7 +360,112 @@ c
     assert Path("myfile.txt") in files_with_conflicts
 
 
-@pytest.mark.parametrize("diff_patch_func", [diff_and_patch])
+@pytest.mark.parametrize("diff_patch_func", DIFF_PATCH_FUNCS)
+async def test_diff_and_patch_merges_nearby_changes_in_template_and_incarnation_with_three_way_merge(
+    diff_patch_func,
+    tmp_path,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    # GIVEN
+    monkeypatch.setattr(get_engine_settings(), "three_way_merge", True)
+    template_directory = tmp_path / "template"
+    (template_directory / "template").mkdir(parents=True)
+    (template_directory / "template" / "myfile.txt").write_text("a\nb\nc\n")
+    await init_repository(tmp_path)
+    incarnation_directory = tmp_path / "incarnation"
+    incarnation_directory.mkdir()
+    incarnation_state = await initialize_incarnation(
+        template_root_dir=template_directory,
+        template_repository="any-repository-url",
+        template_repository_version="any-version",
+        template_data={},
+        incarnation_root_dir=incarnation_directory,
+    )
+
+    updated_template_directory = tmp_path / "updated-template"
+    shutil.copytree(template_directory, updated_template_directory)
+    (updated_template_directory / "template" / "myfile.txt").write_text("a\nb\na\n")
+    (incarnation_directory / "myfile.txt").write_text("c\nb\nc\n")
+    await init_repository(incarnation_directory)
+
+    # WHEN
+    update_performed, _, files_with_conflicts = await update_incarnation(
+        original_template_root_dir=template_directory,
+        updated_template_root_dir=updated_template_directory,
+        updated_template_repository_version=incarnation_state.template_repository_version,
+        updated_template_data=incarnation_state.template_data,
+        incarnation_root_dir=incarnation_directory,
+        diff_patch_func=diff_patch_func,
+    )
+
+    # THEN
+    assert update_performed is True
+    assert files_with_conflicts == []
+    assert (incarnation_directory / "myfile.txt").read_text() == "c\nb\na\n"
+    assert not (incarnation_directory / "myfile.txt.rej").exists()
+
+
+@pytest.mark.parametrize("diff_patch_func", DIFF_PATCH_FUNCS)
+async def test_diff_and_patch_conflict_when_deleting_lines_modified_in_incarnation(diff_patch_func, tmp_path):
+    # GIVEN
+    old_directory = tmp_path / "old"
+    old_directory.mkdir()
+    (old_directory / "file.txt").write_text("x\ny\nz\nw\n")
+    new_directory = tmp_path / "new"
+    new_directory.mkdir()
+    (new_directory / "file.txt").write_text("x\ny\nz\n")
+    to_patch_directory = tmp_path / "to_patch"
+    to_patch_directory.mkdir()
+    (to_patch_directory / "file.txt").write_text("x\ny\nz\nw-modified-by-user\n")
+    await init_repository(to_patch_directory)
+
+    # WHEN
+    files_with_conflicts = await diff_patch_func(
+        diff_a_directory=old_directory,
+        diff_b_directory=new_directory,
+        patch_directory=to_patch_directory,
+    )
+
+    # THEN
+    assert files_with_conflicts == [Path("file.txt")]
+    assert (to_patch_directory / "file.txt.rej").exists()
+
+
+@pytest.mark.parametrize("diff_patch_func", DIFF_PATCH_FUNCS)
+@pytest.mark.parametrize(
+    "incarnation_content",
+    ["a\nW\nc\nc\nc\ng\nh\n", "a\nc\nc\nc\nW\ng\nh\n"],
+    ids=["modified-before-deletion", "modified-deleted-line"],
+)
+async def test_diff_and_patch_conflict_when_deleting_a_repeated_line_next_to_an_incarnation_change(
+    diff_patch_func, incarnation_content, tmp_path
+):
+    # GIVEN
+    old_directory = tmp_path / "old"
+    old_directory.mkdir()
+    (old_directory / "file.txt").write_text("a\nc\nc\nc\nc\ng\nh\n")
+    new_directory = tmp_path / "new"
+    new_directory.mkdir()
+    (new_directory / "file.txt").write_text("a\nc\nc\nc\ng\nh\n")
+    to_patch_directory = tmp_path / "to_patch"
+    to_patch_directory.mkdir()
+    (to_patch_directory / "file.txt").write_text(incarnation_content)
+    await init_repository(to_patch_directory)
+
+    # WHEN
+    files_with_conflicts = await diff_patch_func(
+        diff_a_directory=old_directory,
+        diff_b_directory=new_directory,
+        patch_directory=to_patch_directory,
+    )
+
+    # THEN
+    assert files_with_conflicts == [Path("file.txt")]
+    assert (to_patch_directory / "file.txt.rej").exists()
+    assert (to_patch_directory / "file.txt").read_text() == incarnation_content
+
+
+@pytest.mark.parametrize("diff_patch_func", DIFF_PATCH_FUNCS)
 async def test_diff_and_patch_success_when_changes_in_different_places_in_template_and_incarnation(
     diff_patch_func,
     tmp_path,
@@ -402,7 +554,7 @@ mychange
     )
 
 
-@pytest.mark.parametrize("diff_patch_func", [diff_and_patch])
+@pytest.mark.parametrize("diff_patch_func", DIFF_PATCH_FUNCS)
 async def test_diff_and_patch_success_when_update_in_fvars_file(
     diff_patch_func,
     tmp_path: Path,
@@ -463,7 +615,7 @@ variables:
     assert (incarnation_directory / "myfile.txt").read_text() == "From: Updated John Doe"
 
 
-@pytest.mark.parametrize("diff_patch_func", [diff_and_patch])
+@pytest.mark.parametrize("diff_patch_func", DIFF_PATCH_FUNCS)
 async def test_diff_and_patch_success_when_deleting_file_in_template(
     diff_patch_func,
     tmp_path,
@@ -514,3 +666,242 @@ async def test_diff_and_patch_success_when_deleting_file_in_template(
     # THEN
     assert (incarnation_directory / "myfile1.txt").exists()
     assert not (incarnation_directory / "myfile2.txt").exists()
+
+
+@pytest.mark.parametrize("diff_patch_func", DIFF_PATCH_FUNCS)
+async def test_diff_and_patch_only_rerenders_files_affected_by_changed_template_data(
+    diff_patch_func,
+    tmp_path,
+    mocker: MockerFixture,
+):
+    # GIVEN
+    template_directory = tmp_path / "template"
+    (template_directory / "template" / "{{ name }}").mkdir(parents=True)
+    (template_directory / "template" / "{{ name }}" / "README.md").write_text("Hello {{ name }}")
+    (template_directory / "template" / "CHANGELOG.md").write_text("{{ author }}")
+    await init_repository(template_directory)
+
+    incarnation_directory = tmp_path / "incarnation"
+    incarnation_directory.mkdir()
+    incarnation_state = await initialize_incarnation(
+        template_root_dir=template_directory,
+        template_repository="any-repository-url",
+        template_repository_version="any-version",
+        template_data={"name": "jon", "author": "jane"},
+        incarnation_root_dir=incarnation_directory,
+    )
+    await init_repository(incarnation_directory)
+    render_spy = mocker.spy(rendering, "render_template_file")
+
+    # WHEN
+    update_performed, _, files_with_conflicts = await update_incarnation(
+        original_template_root_dir=template_directory,
+        updated_template_root_dir=template_directory,
+        updated_template_repository_version=incarnation_state.template_repository_version,
+        updated_template_data={"name": "ygritte", "author": "jane"},
+        incarnation_root_dir=incarnation_directory,
+        diff_patch_func=diff_patch_func,
+    )
+
+    # THEN
+    assert update_performed is True
+    assert files_with_conflicts == []
+    # both files for the pristine incarnation, only the README for the updated one
+    assert render_spy.call_count == 3
+    assert not (incarnation_directory / "jon").exists()
+    assert (incarnation_directory / "ygritte" / "README.md").read_text() == "Hello ygritte"
+    assert (incarnation_directory / "CHANGELOG.md").read_text() == "jane"
+    assert "ygritte" in (incarnation_directory / ".fengine.yaml").read_text()
+
+
+@pytest.mark.parametrize("diff_patch_func", DIFF_PATCH_FUNCS)
+async def test_diff_and_patch_only_renders_changed_files_and_files_affected_by_changed_template_data(
+    diff_patch_func,
+    tmp_path,
+    mocker: MockerFixture,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    # GIVEN
+    monkeypatch.setattr(get_engine_settings(), "template_cache_dir", tmp_path / "cache")
+    template_directory = tmp_path / "template"
+    (template_directory / "template" / "{{ name }}").mkdir(parents=True)
+    (template_directory / "template" / "{{ name }}" / "untouched.txt").write_text("{{ name }}")
+    (template_directory / "template" / "changed.txt").write_text("old")
+    (template_directory / "template" / "defaulted.txt").write_text("{{ greeting }}")
+    (template_directory / "fengine.yaml").write_text(
+        """
+variables:
+  name:
+    type: str
+    description: the name
+  greeting:
+    type: str
+    description: the greeting
+    default: hello
+"""
+    )
+    await init_repository(template_directory)
+
+    incarnation_directory = tmp_path / "incarnation"
+    incarnation_directory.mkdir()
+    incarnation_state = await initialize_incarnation(
+        template_root_dir=template_directory,
+        template_repository="any-repository-url",
+        template_repository_version="any-version",
+        template_data={"name": "jon"},
+        incarnation_root_dir=incarnation_directory,
+    )
+    await init_repository(incarnation_directory)
+
+    updated_template_directory = tmp_path / "updated-template"
+    shutil.copytree(template_directory, updated_template_directory)
+    (updated_template_directory / "template" / "changed.txt").write_text("new")
+    (updated_template_directory / "fengine.yaml").write_text(
+        (updated_template_directory / "fengine.yaml").read_text().replace("hello", "howdy")
+    )
+    await utils.check_call("git", "commit", "-am", "update", cwd=updated_template_directory)
+    render_spy = mocker.spy(rendering, "render_template_file")
+
+    # WHEN
+    update_performed, _, files_with_conflicts = await update_incarnation(
+        original_template_root_dir=template_directory,
+        updated_template_root_dir=updated_template_directory,
+        updated_template_repository_version="updated-version",
+        updated_template_data=incarnation_state.template_data | {"greeting": "howdy"},
+        incarnation_root_dir=incarnation_directory,
+        diff_patch_func=diff_patch_func,
+        changed_template_paths=[Path("changed.txt")],
+    )
+
+    # THEN
+    assert update_performed is True
+    assert files_with_conflicts == []
+    rendered_files = {call.args[1].name for call in render_spy.call_args_list}
+    assert rendered_files == {"changed.txt", "defaulted.txt"}
+    assert (incarnation_directory / "changed.txt").read_text() == "new"
+    assert (incarnation_directory / "defaulted.txt").read_text() == "howdy"
+    assert (incarnation_directory / "jon" / "untouched.txt").read_text() == "jon"
+
+
+async def test_update_incarnation_skips_the_diff_if_the_rendered_incarnations_are_identical(
+    tmp_path, mocker: MockerFixture
+):
+    # GIVEN
+    template_directory = tmp_path / "template"
+    (template_directory / "template").mkdir(parents=True)
+    (template_directory / "template" / "README.md").write_text("Hello {{ name }}")
+    await init_repository(template_directory)
+
+    incarnation_directory = tmp_path / "incarnation"
+    incarnation_directory.mkdir()
+    incarnation_state = await initialize_incarnation(
+        template_root_dir=template_directory,
+        template_repository="any-repository-url",
+        template_repository_version="any-version",
+        template_data={"name": "jon"},
+        incarnation_root_dir=incarnation_directory,
+    )
+    await init_repository(incarnation_directory)
+    diff_patch_func = mocker.AsyncMock()
+
+    # WHEN
+    update_performed, _, files_with_conflicts = await update_incarnation(
+        original_template_root_dir=template_directory,
+        updated_template_root_dir=template_directory,
+        updated_template_repository_version=incarnation_state.template_repository_version,
+        updated_template_data={"name": "jon"},
+        incarnation_root_dir=incarnation_directory,
+        diff_patch_func=diff_patch_func,
+    )
+
+    # THEN
+    assert update_performed is False
+    assert files_with_conflicts is None
+    diff_patch_func.assert_not_called()
+
+
+async def test_gather_in_order_raises_the_error_of_the_first_failed_awaitable():
+    # GIVEN
+    async def _fail_slowly():
+        await asyncio.sleep(0.01)
+        raise ValueError("slow")
+
+    async def _fail_fast():
+        raise ReconciliationUserError("fast")
+
+    # THEN
+    with pytest.raises(ValueError):
+        # WHEN
+        await gather_in_order(_fail_slowly(), _fail_fast())
+
+
+@pytest.mark.parametrize("diff_patch_func", DIFF_PATCH_FUNCS)
+async def test_diff_and_patch_raises_user_error_when_updated_template_requires_missing_variable(
+    diff_patch_func,
+    tmp_path,
+):
+    # GIVEN
+    template_directory = tmp_path / "template"
+    (template_directory / "template").mkdir(parents=True)
+    (template_directory / "template" / "README.md").write_text("{{ name }}")
+    await init_repository(template_directory)
+
+    incarnation_directory = tmp_path / "incarnation"
+    incarnation_directory.mkdir()
+    incarnation_state = await initialize_incarnation(
+        template_root_dir=template_directory,
+        template_repository="any-repository-url",
+        template_repository_version="any-version",
+        template_data={"name": "jon"},
+        incarnation_root_dir=incarnation_directory,
+    )
+    await init_repository(incarnation_directory)
+
+    updated_template_directory = tmp_path / "updated-template"
+    shutil.copytree(template_directory, updated_template_directory)
+    (updated_template_directory / "fengine.yaml").write_text(
+        """
+variables:
+  author:
+    type: str
+    description: the author
+"""
+    )
+    await utils.check_call("git", "add", ".", cwd=updated_template_directory)
+    await utils.check_call("git", "commit", "-m", "require author", cwd=updated_template_directory)
+
+    # THEN
+    with pytest.raises(ReconciliationUserError):
+        # WHEN
+        await update_incarnation(
+            original_template_root_dir=template_directory,
+            updated_template_root_dir=updated_template_directory,
+            updated_template_repository_version="updated-version",
+            updated_template_data=incarnation_state.template_data,
+            incarnation_root_dir=incarnation_directory,
+            diff_patch_func=diff_patch_func,
+        )
+
+
+async def test_patch_kills_git_apply_without_applying_anything_if_the_patch_producer_fails(
+    tmp_path, mocker: MockerFixture
+):
+    # GIVEN
+    incarnation_directory = tmp_path / "incarnation"
+    incarnation_directory.mkdir()
+    (incarnation_directory / "file.txt").write_text("old\n")
+    await init_repository(incarnation_directory)
+    subprocess_spy = mocker.spy(asyncio, "create_subprocess_exec")
+
+    async def _failing_diff_output():
+        yield b"diff --git a/file.txt b/file.txt\n--- a/file.txt\n+++ b/file.txt\n@@ -1 +1 @@\n-old\n+new\n"
+        raise RuntimeError("diff failed")
+
+    # THEN
+    with pytest.raises(RuntimeError, match="diff failed"):
+        # WHEN
+        await patch(_failing_diff_output(), incarnation_directory, InMemorySink())
+
+    apply_proc = subprocess_spy.spy_return
+    assert apply_proc.returncode is not None
+    assert (incarnation_directory / "file.txt").read_text() == "old\n"
@@ -46,6 +46,21 @@ async def test_has_any_commits_returns_true_if_there_are_commits(tmp_path):
     assert result is True
 
 
+async def test_has_uncommitted_changes_reads_status_output_larger_than_the_pipe_buffer(tmp_path):
+    # GIVEN
+    repo = GitRepository(tmp_path)
+    await repo._run("init")
+    # NOTE: the output exceeds both the pipe buffer and the buffer of the asyncio stream reader.
+    for i in range(3000):
+        (tmp_path / f"untracked-file-{i:04}-{'x' * 100}").touch()
+
+    # WHEN
+    result = await repo.has_uncommitted_changes()
+
+    # THEN
+    assert result is True
+
+
 def test_add_authentication_to_git_clone_url_includes_username_password_in_output():
     # GIVEN
     source = "https://myrepo/test.git"